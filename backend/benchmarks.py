@@ -0,0 +1,268 @@
+"""Reproducible latency benchmarks for the API's hot paths
+
+    python benchmarks.py                           # every benchmark, printed as a table
+    python benchmarks.py --save baseline.json      # keep the results as a baseline
+    python benchmarks.py --compare baseline.json   # exit 1 if something got slower
+    python benchmarks.py --only predict history --iterations 2000 --db-rows 500000
+
+Requests go through Flask's test client, so timings cover routing, JSON
+and the handler but not the network. History runs against a temporary
+``predictions.db`` seeded with ``--db-rows`` rows; chat runs against a
+stub OpenAI client (``--llm-latency`` seconds per reply) and against the
+keyword fallback. Inputs come from a seeded RNG, so runs are comparable.
+
+For each benchmark: p50/p99 latency, throughput (sequential calls per
+second) and peak Python memory allocated during one call (tracemalloc,
+measured in a separate short pass so it does not slow the timed loop).
+Each benchmark runs ``--repeat`` times and keeps the best value of each
+metric, which damps noise from other processes when comparing.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+COUNTRIES = ['India', 'Brazil', 'Kenya', 'Mexico', 'Pakistan', 'Turkey', 'Japan', 'Australia']
+ITEMS = ['Maize', 'Potatoes', 'Rice, paddy', 'Wheat', 'Sorghum', 'Soybeans', 'Cassava']
+QUESTIONS = ['How should I irrigate maize in a dry season?', 'Best fertilizer for potatoes?',
+             'How do I control pests on rice?', 'When should I plant wheat?',
+             'How can I improve soil health?', 'Tell me about market costs for cotton next year']
+USERS = 100
+SEED_START = 1704067200  # 2024-01-01; seeded history spans the year after
+
+
+def random_features(rng):
+    return [rng.randint(1990, 2013), round(rng.uniform(50, 3000), 1),
+            round(rng.uniform(0, 300000), 1), round(rng.uniform(1, 35), 2),
+            rng.choice(COUNTRIES), rng.choice(ITEMS)]
+
+
+class _Namespace:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class StubOpenAI:
+    """Stands in for ``openai.OpenAI``: answers ``chat.completions.create`` after ``latency``"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.chat = _Namespace(completions=_Namespace(create=self._create))
+
+    def _create(self, messages, **options):
+        if self.latency:
+            time.sleep(self.latency)
+        reply = f'Advice about: {messages[-1]["content"]}'
+        return _Namespace(choices=[_Namespace(message=_Namespace(content=reply))])
+
+
+def seed_database(path, rows, seed):
+    """Write ``rows`` saved predictions for ``USERS`` users over one year"""
+    from database import PredictionDatabase, extract_fields
+
+    database = PredictionDatabase(path)
+    database.init_schema()
+    rng = random.Random(seed)
+    batch = []
+    with database.connection() as conn:
+        for i in range(rows):
+            features = random_features(rng)
+            input_data = {'features': features}
+            crop, country = extract_fields(input_data)
+            timestamp = time.strftime('%Y-%m-%d %H:%M:%S',
+                                      time.gmtime(SEED_START + i * 365 * 86400 / max(rows, 1)))
+            batch.append((timestamp, json.dumps(input_data),
+                          json.dumps({'prediction': rng.uniform(1000, 300000), 'confidence': 90.0}),
+                          json.dumps({}), f'user{rng.randrange(USERS)}', crop, country))
+            if len(batch) == 10000 or i == rows - 1:
+                conn.execute('BEGIN')
+                conn.executemany('''
+                    INSERT INTO predictions
+                    (timestamp, input_data, prediction_result, location_data, user_id, crop, country)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', batch)
+                conn.execute('COMMIT')
+                batch = []
+    return database
+
+
+def build_benchmarks(crop, rng, llm_latency):
+    """name -> callable doing one request; each asserts a successful response"""
+    from chat_service import ChatService
+
+    client = crop.app.test_client()
+    stub = StubOpenAI(llm_latency)
+    stub_service = ChatService(client_factory=lambda: stub, model='stub', max_tokens=100,
+                               temperature=0.0, max_concurrency=4, timeout=30)
+    cached_row = random_features(rng)
+
+    def post(path, body):
+        response = client.post(path, json=body)
+        assert response.status_code == 200, (path, response.status_code, response.get_data(True)[:200])
+
+    def get(path):
+        response = client.get(path)
+        assert response.status_code == 200, (path, response.status_code, response.get_data(True)[:200])
+
+    def chat(service, use_openai):
+        def run():
+            # Swap the chat backend in for this request only, so benchmarks stay independent
+            original = crop.chat_service, crop.USE_OPENAI
+            crop.chat_service, crop.USE_OPENAI = service, use_openai
+            try:
+                post('/chat', {'message': f'{rng.choice(QUESTIONS)} ({rng.random()})'})
+            finally:
+                crop.chat_service, crop.USE_OPENAI = original
+        return run
+
+    return {
+        'predict': lambda: post('/predict', {'features': random_features(rng)}),
+        'predict_cached': lambda: post('/predict', {'features': cached_row}),
+        'predict_enhanced': lambda: post('/predict-enhanced', {'features': random_features(rng)}),
+        'save_prediction': lambda: post('/save-prediction', {
+            'input_data': {'features': random_features(rng)},
+            'prediction': {'prediction': 1000.0}, 'user_id': f'user{rng.randrange(USERS)}'}),
+        'history': lambda: get(f'/history?user_id=user{rng.randrange(USERS)}&limit=50'),
+        'history_filtered': lambda: get(f'/history?user_id=user{rng.randrange(USERS)}'
+                                        f'&limit=50&crop={rng.choice(ITEMS)}'),
+        'trends': lambda: get(f'/analytics/trends?group_by=crop,country&country={rng.choice(COUNTRIES)}'),
+        'chat_openai': chat(stub_service, True),
+        'chat_fallback': chat(crop.chat_service, False),
+    }
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def measure(run, iterations, warmup, memory_iterations, repeat=1):
+    for _ in range(warmup):
+        run()
+    runs = []
+    for _ in range(repeat):
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(iterations):
+            began = time.perf_counter()
+            run()
+            latencies.append(time.perf_counter() - began)
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        runs.append((percentile(latencies, 0.50), percentile(latencies, 0.99), elapsed))
+
+    peak = 0
+    tracemalloc.start()
+    for _ in range(memory_iterations):
+        live = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        run()
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - live)
+    tracemalloc.stop()
+
+    elapsed = min(run[2] for run in runs)
+    return {
+        'iterations': iterations,
+        'p50_ms': round(min(run[0] for run in runs) * 1000, 4),
+        'p99_ms': round(min(run[1] for run in runs) * 1000, 4),
+        'mean_ms': round(elapsed / iterations * 1000, 4),
+        'throughput': round(iterations / elapsed, 1),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def compare(results, baseline, threshold, p99_threshold):
+    """Rows of (name, metric, baseline, current, change %, regressed)"""
+    rows = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        for metric, higher_is_better in (('p50_ms', False), ('p99_ms', False),
+                                         ('throughput', True), ('peak_kb', False)):
+            old, new = before.get(metric), result[metric]
+            if not old:
+                continue
+            change = (new - old) / old * 100
+            worse = -change if higher_is_better else change
+            limit = p99_threshold if metric == 'p99_ms' else threshold
+            rows.append((name, metric, old, new, change, worse > limit))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark prediction, history and chat')
+    parser.add_argument('--only', nargs='+', help='Benchmark names to run (default: all)')
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--memory-iterations', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per benchmark; best is kept')
+    parser.add_argument('--db-rows', type=int, default=100000, help='Rows seeded into predictions.db')
+    parser.add_argument('--llm-latency', type=float, default=0.0, help='Stub OpenAI reply delay (s)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', help='Write results to this JSON file')
+    parser.add_argument('--compare', help='Baseline JSON file to compare against')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='Percent change in the wrong direction counted as a regression')
+    parser.add_argument('--p99-threshold', type=float, default=25.0,
+                        help='Regression threshold for p99, which is noisier')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='cropcast-bench-')
+    try:
+        print(f'🌱 Seeding {args.db_rows} rows into a temporary predictions.db...')
+        database = seed_database(os.path.join(workdir, 'predictions.db'), args.db_rows, args.seed)
+
+        import crop
+
+        crop.prediction_db = database
+        crop.model_store.wait()
+        benchmarks = build_benchmarks(crop, random.Random(args.seed), args.llm_latency)
+        names = args.only or list(benchmarks)
+        unknown = [name for name in names if name not in benchmarks]
+        if unknown:
+            parser.error(f'Unknown benchmarks: {", ".join(unknown)} (choose from {", ".join(benchmarks)})')
+
+        results = {}
+        print(f'\n{"benchmark":<18} {"p50 ms":>9} {"p99 ms":>9} {"req/s":>9} {"peak KB":>9}')
+        for name in names:
+            result = measure(benchmarks[name], args.iterations, args.warmup,
+                             args.memory_iterations, args.repeat)
+            results[name] = result
+            print(f'{name:<18} {result["p50_ms"]:>9.3f} {result["p99_ms"]:>9.3f} '
+                  f'{result["throughput"]:>9.0f} {result["peak_kb"]:>9.1f}')
+        database.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    meta = {'db_rows': args.db_rows, 'iterations': args.iterations, 'repeat': args.repeat,
+            'seed': args.seed,
+            'python': sys.version.split()[0], 'created': time.strftime('%Y-%m-%d %H:%M:%S')}
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+        print(f'\n💾 Saved results to {args.save}')
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline['results'], args.threshold, args.p99_threshold)
+        print(f'\nCompared with {args.compare} ({baseline["meta"].get("created")}):')
+        print(f'{"benchmark":<18} {"metric":<11} {"baseline":>10} {"current":>10} {"change":>8}')
+        for name, metric, old, new, change, regressed in rows:
+            flag = '  ❌ regression' if regressed else ''
+            print(f'{name:<18} {metric:<11} {old:>10.3f} {new:>10.3f} {change:>+7.1f}%{flag}')
+        regressions = [row for row in rows if row[5]]
+        if regressions:
+            print(f'\n❌ {len(regressions)} regression(s) beyond {args.threshold}%')
+            return 1
+        print(f'\n✅ No regressions beyond {args.threshold}%')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
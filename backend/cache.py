@@ -0,0 +1,99 @@
+"""Bounded, thread-safe LRU cache with TTL eviction and hit/miss counters"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Least-recently-used cache whose entries also expire after ``ttl`` seconds
+
+    ``max_size=0`` disables caching and ``ttl=0`` disables expiry. Every
+    ``clear()`` bumps ``generation`` so values computed against an older
+    model can be dropped by passing the generation read before computing.
+    """
+
+    def __init__(self, max_size=4096, ttl=3600, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.generation = 0
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= self._clock():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, generation=None):
+        if self.max_size <= 0:
+            return
+        expires_at = self._clock() + self.ttl if self.ttl else None
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.generation += 1
+
+    def snapshot(self):
+        """Live entries as (key, value, seconds left or None), oldest first"""
+        now = self._clock()
+        with self._lock:
+            return [(key, value, None if expires_at is None else expires_at - now)
+                    for key, (value, expires_at) in self._data.items()
+                    if expires_at is None or expires_at > now]
+
+    def restore(self, entries):
+        """Re-insert ``snapshot()`` output, keeping each entry's remaining lifetime"""
+        if self.max_size <= 0:
+            return
+        now = self._clock()
+        with self._lock:
+            for key, value, seconds_left in entries:
+                if seconds_left is not None and seconds_left <= 0:
+                    continue
+                self._data[key] = (value, None if seconds_left is None else now + seconds_left)
+                self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'generation': self.generation
+            }
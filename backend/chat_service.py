@@ -0,0 +1,318 @@
+"""Bounded, time-limited access to the OpenAI chat API
+
+Upstream calls run on a small dedicated thread pool. A semaphore caps how
+many can be in flight, so chat traffic can never occupy more than
+``max_concurrency`` threads however many users are chatting. Callers that
+cannot get a slot within ``queue_timeout``, or whose reply does not arrive
+within ``timeout``, get ``None`` (or a ``ChatUnavailable`` error when
+streaming) and are expected to fall back to the canned answers.
+
+Replies can be cached by ``ResponseCache``: identical questions with the
+same recent history are answered from memory, and concurrent identical
+questions share one upstream call.
+"""
+import atexit
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from cache import LRUCache
+from metrics import stage
+
+
+class ChatUnavailable(Exception):
+    """The upstream model was busy, timed out or failed"""
+
+
+def build_messages(system_prompt, message, history):
+    """OpenAI message list: system prompt, the last 5 history entries, then the question"""
+    messages = [
+        {
+            "role": "system",
+            "content": system_prompt
+        }
+    ]
+
+    # Add recent conversation history
+    for msg in history[-5:]:  # Last 5 messages for context
+        if msg['sender'] == 'user':
+            messages.append({"role": "user", "content": msg['text']})
+        else:
+            messages.append({"role": "assistant", "content": msg['text']})
+
+    # Add current message
+    messages.append({"role": "user", "content": message})
+    return messages
+
+
+def normalize_text(text):
+    """Lower-case, collapse whitespace and drop trailing punctuation"""
+    return re.sub(r'\s+', ' ', str(text)).strip().lower().rstrip('?!.').rstrip()
+
+
+class ResponseCache:
+    """TTL/LRU cache of chat replies with in-flight request coalescing
+
+    When ``path`` is set, entries are loaded from that JSON file on start
+    and written back (atomically) at most every ``save_interval`` seconds
+    and at exit, so common answers survive restarts.
+    """
+
+    def __init__(self, max_size=1024, ttl=86400, path=None, save_interval=60.0):
+        self.cache = LRUCache(max_size=max_size, ttl=ttl)
+        self.path = path
+        self.save_interval = save_interval
+        self.coalesced = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        if path:
+            self.load()
+            atexit.register(self.save)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def put(self, key, value):
+        self.cache.put(key, value)
+        self._dirty = True
+        if self.path and time.monotonic() - self._saved_at >= self.save_interval:
+            self.save()
+
+    def get_or_compute(self, key, compute, wait_timeout=None):
+        """Cached value, or ``compute()`` run once for all concurrent callers
+
+        ``compute`` returning None (a failed call) is shared with the
+        waiting callers but not cached.
+        """
+        value = self.cache.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            try:
+                return future.result(timeout=wait_timeout)
+            except Exception:
+                return None
+
+        try:
+            value = compute()
+            if value is not None:
+                self.put(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f).get('entries', [])
+            self.cache.restore(entries)
+            print(f"💬 Loaded {len(self.cache)} cached chat replies from {self.path}")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"⚠️  Ignoring unreadable chat cache {self.path}: {e}")
+
+    def save(self):
+        """Write the live entries to ``path`` if anything changed"""
+        if not self.path or not self._dirty:
+            return
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'entries': self.cache.snapshot()}, f)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            self._dirty = True
+            print(f"⚠️  Could not save chat cache to {self.path}: {e}")
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats.update({'coalesced': self.coalesced, 'inflight': len(self._inflight),
+                      'path': self.path})
+        return stats
+
+
+class ChatService:
+    """Runs chat completions on a bounded worker pool with timeouts
+
+    ``client_factory`` returns an OpenAI-compatible client (or None when
+    unavailable); pointing the client at a local stub via ``base_url`` is
+    enough to exercise every path without the real API.
+    """
+
+    _END = object()
+
+    def __init__(self, client_factory, model, max_tokens, temperature,
+                 max_concurrency=4, timeout=30.0, queue_timeout=0.5, cache=None):
+        self.client_factory = client_factory
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.cache = cache
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency,
+                                            thread_name_prefix='chat-upstream')
+        self._lock = threading.Lock()
+        self.counters = {'completed': 0, 'timeouts': 0, 'rejected': 0, 'errors': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _create(self, messages, stream=False):
+        client = self.client_factory()
+        if client is None:
+            raise ChatUnavailable('OpenAI client unavailable')
+        with stage('llm_stream' if stream else 'llm'):
+            return client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                max_tokens=self.max_tokens,
+                temperature=self.temperature,
+                stream=stream,
+                timeout=self.timeout
+            )
+
+    def _acquire(self):
+        if self._slots.acquire(timeout=self.queue_timeout):
+            return True
+        self._count('rejected')
+        return False
+
+    def cache_key(self, messages):
+        """Key for a conversation: model settings plus the normalized messages"""
+        conversation = [(m['role'], normalize_text(m['content'])) for m in messages]
+        payload = json.dumps([self.model, self.max_tokens, self.temperature, conversation])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def complete(self, messages):
+        """Return the assistant reply, or None when busy, timed out or failed"""
+        if self.cache is None:
+            return self._complete(messages)
+        return self.cache.get_or_compute(self.cache_key(messages),
+                                         lambda: self._complete(messages),
+                                         self.queue_timeout + self.timeout)
+
+    def _complete(self, messages):
+        if not self._acquire():
+            return None
+        try:
+            future = self._executor.submit(self._create, messages)
+        except Exception:
+            self._slots.release()
+            raise
+        # The slot is held until the upstream call really ends, even after a timeout
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            response = future.result(timeout=self.timeout)
+        except FutureTimeout:
+            self._count('timeouts')
+            print(f"OpenAI API timeout after {self.timeout}s")
+            return None
+        except Exception as e:
+            self._count('errors')
+            print(f"OpenAI API error: {e}")
+            return None
+        self._count('completed')
+        return response.choices[0].message.content
+
+    def stream(self, messages):
+        """Yield reply tokens as they arrive
+
+        Raises ``ChatUnavailable`` when no slot is free, the upstream call
+        fails, or no token arrives within ``timeout`` seconds. Closing the
+        generator early (client disconnect) stops reading from upstream.
+        A cached reply is yielded as a single token; a finished stream is
+        added to the cache.
+        """
+        key = None
+        if self.cache is not None:
+            key = self.cache_key(messages)
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+        if not self._acquire():
+            raise ChatUnavailable('Chat is busy')
+        tokens = queue.Queue()
+        cancelled = threading.Event()
+
+        def produce():
+            try:
+                upstream = self._create(messages, stream=True)
+                try:
+                    for chunk in upstream:
+                        if cancelled.is_set():
+                            break
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            tokens.put(chunk.choices[0].delta.content)
+                finally:
+                    close = getattr(upstream, 'close', None)
+                    if close is not None:
+                        close()
+                tokens.put(self._END)
+            except Exception as e:
+                tokens.put(e)
+            finally:
+                self._slots.release()
+
+        try:
+            self._executor.submit(produce)
+        except Exception:
+            self._slots.release()
+            raise
+
+        received = []
+        try:
+            while True:
+                try:
+                    item = tokens.get(timeout=self.timeout)
+                except queue.Empty:
+                    self._count('timeouts')
+                    raise ChatUnavailable(f'No reply within {self.timeout}s') from None
+                if item is self._END:
+                    self._count('completed')
+                    if key is not None and received:
+                        self.cache.put(key, ''.join(received))
+                    return
+                if isinstance(item, Exception):
+                    self._count('errors')
+                    print(f"OpenAI API error: {item}")
+                    raise ChatUnavailable(str(item)) from item
+                received.append(item)
+                yield item
+        finally:
+            cancelled.set()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        counters.update({'max_concurrency': self.max_concurrency, 'timeout_seconds': self.timeout})
+        if self.cache is not None:
+            counters['cache'] = self.cache.stats()
+        return counters
@@ -0,0 +1,58 @@
+"""Per-leaf prediction confidence derived from the fitted decision tree
+
+The tree is grown to purity, so every leaf has zero variance and usually a
+single training sample; the leaf alone says nothing about reliability.
+Instead each node is judged by its neighbourhood: the nearest ancestor (or
+the node itself) holding at least ``min_samples`` training rows. Using that
+region's mean and variance (``tree_.value`` and ``tree_.impurity``), the
+confidence is the probability, under a normal approximation, that a target
+from the region lies within ``tolerance`` (relative) of the node's value.
+
+Everything is computed once per node at load time; at prediction time the
+confidence is one array lookup at the leaf ``apply()`` already found.
+"""
+import math
+
+import numpy as np
+
+DEFAULT_CONFIDENCE = 85  # Returned when the model offers no per-leaf statistics
+
+
+def node_confidence(children_left, children_right, value, impurity, n_node_samples,
+                    min_samples=10, tolerance=0.2):
+    """Confidence in percent (1-99) for every node of a fitted regression tree"""
+    node_count = len(value)
+    support = np.zeros(node_count, dtype=np.intp)
+    samples = np.asarray(n_node_samples)
+    # Nodes are stored parents-first, so one forward pass fills every child
+    for node in range(node_count):
+        for child in (children_left[node], children_right[node]):
+            if child >= 0:
+                support[child] = child if samples[child] >= min_samples else support[node]
+
+    value = np.asarray(value, dtype=np.float64)
+    mean = value[support]
+    std = np.sqrt(np.maximum(np.asarray(impurity, dtype=np.float64)[support], 0.0))
+    margin = tolerance * np.abs(value)
+    low, high = value - margin - mean, value + margin - mean
+
+    probability = np.where((low <= 0) & (high >= 0), 1.0, 0.0)
+    spread = std > 0
+    if spread.any():
+        erf = np.vectorize(math.erf, otypes=[np.float64])
+        scale = std[spread] * math.sqrt(2.0)
+        probability[spread] = 0.5 * (erf(high[spread] / scale) - erf(low[spread] / scale))
+    return np.clip(np.round(probability * 100.0, 1), 1.0, 99.0)
+
+
+def tree_confidence(estimator, min_samples=10, tolerance=0.2):
+    """``node_confidence`` for a fitted single-output sklearn tree"""
+    tree = estimator.tree_
+    return node_confidence(tree.children_left, tree.children_right, tree.value[:, 0, 0],
+                           tree.impurity, tree.n_node_samples, min_samples, tolerance)
+
+
+def leaf_samples(estimator):
+    """Training rows that reached each node of a fitted tree, zero for internal nodes"""
+    tree = estimator.tree_
+    return np.where(tree.children_left == -1, tree.n_node_samples, 0)
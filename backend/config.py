@@ -12,15 +12,88 @@ OPENAI_API_KEY = "your-openai-api-key-here"  # Replace with your actual OpenAI A
 OPENAI_MODEL = "gpt-4"  # Options: "gpt-4", "gpt-4-turbo", "gpt-3.5-turbo"
 MAX_TOKENS = 800
 TEMPERATURE = 0.3  # Lower = more consistent, Higher = more creative
+OPENAI_BASE_URL = None  # Override the API endpoint, e.g. "http://127.0.0.1:8001/v1" for a local stub
+CHAT_MAX_CONCURRENCY = 4  # Upstream chat calls in flight at once; extra requests get fallback answers
+CHAT_TIMEOUT = 30  # Seconds to wait for a reply (or for the next streamed token)
+CHAT_QUEUE_TIMEOUT = 0.5  # Seconds to wait for a free upstream slot before falling back
+CHAT_CACHE_SIZE = 1024  # Cached chat replies (0 disables the cache)
+CHAT_CACHE_TTL = 86400  # Seconds before a cached reply expires (0 = never)
+CHAT_CACHE_PATH = None  # e.g. "chat_cache.json" to keep cached replies across restarts
+INTENTS_PATH = "intents.json"  # Fallback chatbot intents, keywords and answers
+
+# Weather Configuration
+WEATHER_PROVIDER = "mock"  # "mock" (demo formula), "grid" (precomputed file) or "module:Class"
+WEATHER_GRID_DEGREES = 0.1  # Points are snapped to cells this size (a grid file uses its own step)
+WEATHER_GRID_PATH = "weather_grid.joblib"  # Written by: python weather.py build
+WEATHER_CACHE_SIZE = 10000  # Cached grid cells (0 disables the cache)
+WEATHER_CACHE_TTL = 600  # Seconds before a cached cell is fetched again
+WEATHER_BATCH_MAX_POINTS = 1000  # Largest accepted /weather/batch request
+
+# Prediction Configuration
+BATCH_MAX_ROWS = 10000  # Maximum rows accepted by /predict/batch in one request
+PREDICTION_CACHE_SIZE = 4096  # Cached single-row predictions (0 disables the cache)
+PREDICTION_CACHE_TTL = 3600  # Seconds before a cached prediction expires (0 = never)
+PREDICT_BATCHING = False  # Run concurrent single-row /predict cache misses as one batch (needs threaded workers)
+PREDICT_BATCH_MAX_SIZE = 32  # Most rows in one micro-batch
+PREDICT_BATCH_MAX_WAIT_MS = 2  # How long a batch waits after its first row for more to arrive
+PREDICT_BATCH_TIMEOUT_MS = 1000  # A row not predicted by then is predicted directly by its request
+INFERENCE_ENGINE = "sklearn"  # "sklearn" or "compiled" (flat-array tree, parity-checked at startup)
+FEATURE_ENCODER = "fast"  # "fast" (precomputed scaler/one-hot maps) or "sklearn" (preprocessor.transform)
+CONFIDENCE_MIN_SAMPLES = 10  # Training rows in the tree region a confidence is judged on
+CONFIDENCE_TOLERANCE = 0.2  # Confidence = chance a similar case is within this fraction of the prediction
+SWEEP_MAX_POINTS = 1000000  # Largest grid /predict/sweep will evaluate
+SWEEP_CHUNK_SIZE = 8192  # Grid points encoded and predicted per step of a sweep
+RULES_PATH = "rules.json"  # Anomaly, recommendation and factor thresholds
+RULES_RELOAD_INTERVAL = 2  # Seconds between checks for an edited rules file
+SCORE_CHUNK_SIZE = 50000  # Rows read, scored and written at a time by score.py
+SCORE_WORKERS = 1  # Default score.py worker processes (--workers)
+
+# Startup Configuration
+STARTUP_MODE = "eager"  # "eager" (load at import), "lazy" (first request) or "background" (warm-up thread)
+MODEL_FORMAT = "pickle"  # "pickle" (dtr.pkl) or "mmap" (flat tree arrays shared between worker processes)
+MODEL_ARRAYS_PATH = "dtr.joblib"  # Written by `python model_store.py export`; created on demand for "mmap"
+MODEL_REGISTRY_DIR = None  # e.g. "models": versioned model directories (python model_registry.py); None uses dtr.pkl
+MODEL_VERSION = None  # Pin a registry version; None follows the registry's ACTIVE file
+MODEL_REGISTRY_CHECK_INTERVAL = 5  # Seconds between checks of ACTIVE; a new version is warmed up and swapped in
+MODEL_SELF_TEST_MAX_MS = 50  # Median single-row latency a new version must meet before it is swapped in
 
 # Database Configuration
 DATABASE_PATH = "crop_data.db"
+PREDICTIONS_DB_PATH = "predictions.db"  # Saved predictions used by /save-prediction and /history
+DB_POOL_SIZE = 8  # Pooled read connections per process
+DB_WRITE_BATCH_SIZE = 128  # Most inserts committed in one group-commit transaction
+DB_WRITE_MAX_WAIT_MS = 0  # Extra time the writer lingers to grow a batch (0 = commit what is queued)
+HISTORY_MAX_LIMIT = 500  # Largest page /history returns; use next_cursor for more
+
+# Retention Configuration (python retention.py, e.g. nightly from cron)
+RETENTION_DAYS = 365  # Rows older than this move from predictions.db to ARCHIVE_DIR
+ARCHIVE_DIR = "archive"  # Day-partitioned gzip NDJSON files; /history?archived=1 reads them back
+ARCHIVE_BATCH_SIZE = 2000  # Rows archived and deleted per short write transaction
+
+# Drift Monitoring Configuration (GET /drift)
+DRIFT_ENABLED = True  # Histogram every scored row per feature and compare with the training profile
+DRIFT_REFERENCE_PATH = "drift_reference.json"  # From `python drift.py reference yield_df.csv`; optional
+DRIFT_WINDOW = 10000  # Rows per window; /drift covers the current and previous window
+DRIFT_SAMPLE_RATE = 1.0  # Fraction of rows counted (lower it to trim the per-request cost)
 
 # Flask Configuration
-DEBUG_MODE = True
+DEBUG_MODE = True  # Flask debug mode for `python crop.py` (never used by serve.py)
 HOST = "127.0.0.1"
 PORT = 5000
 
+# Metrics Configuration (GET /metrics, Prometheus text format)
+METRICS_ENABLED = True  # Per-endpoint and per-stage latency histograms; False makes timers no-ops
+METRICS_DIR = None  # Shared snapshot directory so /metrics covers every worker (serve.py picks one)
+METRICS_FLUSH_INTERVAL = 5  # Seconds between a worker's snapshot writes to METRICS_DIR
+
+# Response JSON Configuration
+JSON_PROVIDER = "fast"  # "fast" (orjson, stdlib if not installed), "stdlib", "default" (Flask's) or "module:Class"
+
+# Production Server Configuration (python serve.py)
+SERVER_WORKERS = 0  # Worker processes (0 = one per CPU core)
+SERVER_THREADS = 4  # Threads per worker, for slow clients, chat and streaming
+SERVER_TIMEOUT = 60  # Seconds before a stuck worker is restarted (keep above CHAT_TIMEOUT)
+
 # CORS Configuration
 CORS_ORIGINS = "*"  # Allow all origins for development
 
@@ -1,13 +1,24 @@
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-import pickle
-import os
-import sqlite3
-import json
-from datetime import datetime
-import requests
 import os
+import threading
+from datetime import datetime, timezone
+from inference import BatchFormatError, FEATURE_NAMES, model_categories, predict_rows, rows_from_csv, rows_from_json, validate_row
+from cache import LRUCache
+from model_store import ModelStore
+from model_registry import ModelRegistry, ModelRegistryError
+from database import PredictionDatabase, decode_cursor, encode_cursor, extract_model_version
+from retention import PredictionArchive
+from chat_service import ChatService, ChatUnavailable, ResponseCache, build_messages
+from intents import IntentEngine
+from weather import WeatherService, make_provider, parse_coordinates
+from sweep import Aggregator, Sweep, SweepError, run_sweep
+from rules import RuleStore
+from json_provider import json_fragment, make_json_provider
+from microbatch import MicroBatcher
+from drift import DriftMonitor, build_profile
+import metrics
 
 
 app = Flask(__name__)
@@ -16,6 +27,23 @@ CORS(app)
 # Configuration and OpenAI Setup
 try:
     from config import OPENAI_API_KEY, OPENAI_MODEL, MAX_TOKENS, TEMPERATURE, SYSTEM_PROMPT
+    from config import BATCH_MAX_ROWS, PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL, INFERENCE_ENGINE
+    from config import FEATURE_ENCODER, STARTUP_MODE, MODEL_FORMAT, MODEL_ARRAYS_PATH
+    from config import PREDICTIONS_DB_PATH, DB_POOL_SIZE, DB_WRITE_BATCH_SIZE, DB_WRITE_MAX_WAIT_MS
+    from config import HISTORY_MAX_LIMIT
+    from config import OPENAI_BASE_URL, CHAT_MAX_CONCURRENCY, CHAT_TIMEOUT, CHAT_QUEUE_TIMEOUT
+    from config import CHAT_CACHE_SIZE, CHAT_CACHE_TTL, CHAT_CACHE_PATH, INTENTS_PATH
+    from config import WEATHER_PROVIDER, WEATHER_GRID_DEGREES, WEATHER_GRID_PATH
+    from config import WEATHER_CACHE_SIZE, WEATHER_CACHE_TTL, WEATHER_BATCH_MAX_POINTS
+    from config import SWEEP_MAX_POINTS, SWEEP_CHUNK_SIZE, RULES_PATH, RULES_RELOAD_INTERVAL
+    from config import CONFIDENCE_MIN_SAMPLES, CONFIDENCE_TOLERANCE
+    from config import DEBUG_MODE, HOST, PORT
+    from config import METRICS_ENABLED, METRICS_DIR, METRICS_FLUSH_INTERVAL
+    from config import JSON_PROVIDER
+    from config import PREDICT_BATCHING, PREDICT_BATCH_MAX_SIZE, PREDICT_BATCH_MAX_WAIT_MS, PREDICT_BATCH_TIMEOUT_MS
+    from config import MODEL_REGISTRY_DIR, MODEL_VERSION, MODEL_REGISTRY_CHECK_INTERVAL, MODEL_SELF_TEST_MAX_MS
+    from config import ARCHIVE_DIR
+    from config import DRIFT_ENABLED, DRIFT_REFERENCE_PATH, DRIFT_WINDOW, DRIFT_SAMPLE_RATE
     print("✅ Configuration loaded from config.py")
 except ImportError:
     # Fallback configuration if config.py is not found
@@ -24,42 +52,242 @@ except ImportError:
     MAX_TOKENS = 800
     TEMPERATURE = 0.3
     SYSTEM_PROMPT = "You are an expert agricultural advisor. Provide helpful, practical farming advice."
+    BATCH_MAX_ROWS = 10000
+    PREDICTION_CACHE_SIZE = 4096
+    PREDICTION_CACHE_TTL = 3600
+    INFERENCE_ENGINE = "sklearn"
+    FEATURE_ENCODER = "fast"
+    STARTUP_MODE = "eager"
+    MODEL_FORMAT = "pickle"
+    MODEL_ARRAYS_PATH = "dtr.joblib"
+    PREDICTIONS_DB_PATH = "predictions.db"
+    DB_POOL_SIZE = 8
+    DB_WRITE_BATCH_SIZE = 128
+    DB_WRITE_MAX_WAIT_MS = 0
+    HISTORY_MAX_LIMIT = 500
+    OPENAI_BASE_URL = None
+    CHAT_MAX_CONCURRENCY = 4
+    CHAT_TIMEOUT = 30
+    CHAT_QUEUE_TIMEOUT = 0.5
+    CHAT_CACHE_SIZE = 1024
+    CHAT_CACHE_TTL = 86400
+    CHAT_CACHE_PATH = None
+    INTENTS_PATH = "intents.json"
+    WEATHER_PROVIDER = "mock"
+    WEATHER_GRID_DEGREES = 0.1
+    WEATHER_GRID_PATH = "weather_grid.joblib"
+    WEATHER_CACHE_SIZE = 10000
+    WEATHER_CACHE_TTL = 600
+    WEATHER_BATCH_MAX_POINTS = 1000
+    SWEEP_MAX_POINTS = 1000000
+    SWEEP_CHUNK_SIZE = 8192
+    RULES_PATH = "rules.json"
+    RULES_RELOAD_INTERVAL = 2
+    CONFIDENCE_MIN_SAMPLES = 10
+    CONFIDENCE_TOLERANCE = 0.2
+    DEBUG_MODE = True
+    HOST = "127.0.0.1"
+    PORT = 5000
+    METRICS_ENABLED = True
+    METRICS_DIR = None
+    METRICS_FLUSH_INTERVAL = 5
+    JSON_PROVIDER = "fast"
+    PREDICT_BATCHING = False
+    PREDICT_BATCH_MAX_SIZE = 32
+    PREDICT_BATCH_MAX_WAIT_MS = 2
+    PREDICT_BATCH_TIMEOUT_MS = 1000
+    MODEL_REGISTRY_DIR = None
+    MODEL_VERSION = None
+    MODEL_REGISTRY_CHECK_INTERVAL = 5
+    MODEL_SELF_TEST_MAX_MS = 50
+    ARCHIVE_DIR = "archive"
+    DRIFT_ENABLED = True
+    DRIFT_REFERENCE_PATH = "drift_reference.json"
+    DRIFT_WINDOW = 10000
+    DRIFT_SAMPLE_RATE = 1.0
     print("⚠️  config.py not found, using default configuration")
 
-from openai import OpenAI
-
-# Initialize OpenAI client
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def _local(path):
+    """Resolve a configured relative path against the backend directory, as the CLIs do"""
+    return path if os.path.isabs(path) or os.path.exists(path) else os.path.join(BASE_DIR, path)
+
+# OpenAI setup: the key is checked now, the openai package is imported on first chat
+USE_OPENAI = bool(OPENAI_API_KEY and OPENAI_API_KEY.startswith("sk-"))
+client = None
+_client_lock = threading.Lock()
+
+if USE_OPENAI:
+    print(f"🤖 Using {OPENAI_MODEL} for agricultural advice")
+else:
+    print("⚠️  OpenAI API key not configured or invalid format.")
+    print("💡 To use OpenAI API:")
+    print("   1. Get your API key from https://platform.openai.com/account/api-keys")
+    print("   2. Update OPENAI_API_KEY in backend/config.py with your key (starts with 'sk-')")
+    print("🔄 Using intelligent fallback responses for now")
+
+def get_openai_client():
+    """Create the OpenAI client on first use, or return None if unavailable"""
+    global client, USE_OPENAI
+    if client is not None or not USE_OPENAI:
+        return client
+    with _client_lock:
+        if client is None and USE_OPENAI:
+            try:
+                from openai import OpenAI
+                # No SDK retries: a slow upstream should fall back, not hold a chat slot longer
+                client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, max_retries=0)
+                print("✅ OpenAI client initialized successfully")
+            except Exception as e:
+                print(f"❌ OpenAI initialization error: {e}")
+                print("🔄 Switching to intelligent fallback responses")
+                USE_OPENAI = False
+    return client
+
+# Response encoding (orjson when available); also handles NumPy values
+app.json = make_json_provider(JSON_PROVIDER, app)
+
+# Request latency and per-stage timings, served at /metrics
+metrics.registry.configure(enabled=METRICS_ENABLED, directory=METRICS_DIR,
+                           flush_interval=METRICS_FLUSH_INTERVAL)
+metrics.init_app(app)
+
+# Upstream chat calls run on a bounded pool so chat users cannot starve /predict
+chat_service = ChatService(
+    client_factory=get_openai_client,
+    model=OPENAI_MODEL,
+    max_tokens=MAX_TOKENS,
+    temperature=TEMPERATURE,
+    max_concurrency=CHAT_MAX_CONCURRENCY,
+    timeout=CHAT_TIMEOUT,
+    queue_timeout=CHAT_QUEUE_TIMEOUT,
+    # Repeated questions (same recent history) reuse one upstream answer
+    cache=ResponseCache(max_size=CHAT_CACHE_SIZE, ttl=CHAT_CACHE_TTL, path=CHAT_CACHE_PATH)
+)
+
+# Keyword intents and canned answers used when OpenAI is unavailable
+intent_engine = IntentEngine.from_file(INTENTS_PATH)
+
+# Anomaly, recommendation and factor rules, reloaded when rules.json changes
+rule_store = RuleStore(RULES_PATH, check_interval=RULES_RELOAD_INTERVAL)
+
+# Weather answers are cached per grid cell in front of the configured provider
 try:
-    if OPENAI_API_KEY and OPENAI_API_KEY.startswith("sk-"):
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        USE_OPENAI = True
-        print("✅ OpenAI client initialized successfully")
-        print(f"🤖 Using {OPENAI_MODEL} for agricultural advice")
-    else:
-        print("⚠️  OpenAI API key not configured or invalid format.")
-        print("💡 To use OpenAI API:")
-        print("   1. Get your API key from https://platform.openai.com/account/api-keys")
-        print("   2. Update OPENAI_API_KEY in backend/config.py with your key (starts with 'sk-')")
-        print("🔄 Using intelligent fallback responses for now")
-        USE_OPENAI = False
-        client = None
+    weather_provider = make_provider(WEATHER_PROVIDER, grid_path=WEATHER_GRID_PATH)
 except Exception as e:
-    print(f"❌ OpenAI initialization error: {e}")
-    print("🔄 Switching to intelligent fallback responses")
-    USE_OPENAI = False
-    client = None
-
-# Try to load model and preprocessor, else use mock
-model = None
-preprocessor = None
-if os.path.exists('dtr.pkl'):
-    with open('dtr.pkl', 'rb') as f:
-        model = pickle.load(f)
-if os.path.exists('preprocesser.pkl'):
-    with open('preprocesser.pkl', 'rb') as f:
-        preprocessor = pickle.load(f)
-
-
+    print(f"❌ Weather provider {WEATHER_PROVIDER!r} unavailable: {e}")
+    print("🔄 Using mock weather data")
+    weather_provider = make_provider('mock')
+weather_service = WeatherService(weather_provider, grid_degrees=WEATHER_GRID_DEGREES,
+                                 cache_size=WEATHER_CACHE_SIZE, ttl=WEATHER_CACHE_TTL)
+
+# Memoized predictions keyed on the model version and the normalized feature tuple
+prediction_cache = LRUCache(max_size=PREDICTION_CACHE_SIZE, ttl=PREDICTION_CACHE_TTL)
+
+# Opt-in: concurrent single-row predictions that miss the cache run as one batch
+predict_batcher = None
+if PREDICT_BATCHING:
+    predict_batcher = MicroBatcher(max_batch_size=PREDICT_BATCH_MAX_SIZE,
+                                   max_wait=PREDICT_BATCH_MAX_WAIT_MS / 1000,
+                                   timeout=PREDICT_BATCH_TIMEOUT_MS / 1000)
+
+# Input and predicted-yield distributions of recent traffic vs the training profile, at /drift
+drift_monitor = None
+if DRIFT_ENABLED:
+    drift_monitor = DriftMonitor(window=DRIFT_WINDOW, sample_rate=DRIFT_SAMPLE_RATE)
+
+def on_model_load():
+    """Drop cached predictions and restart drift monitoring against the new model"""
+    prediction_cache.clear()
+    if drift_monitor is None:
+        return
+    models = model_store.current
+    reference_path = _local(DRIFT_REFERENCE_PATH) if DRIFT_REFERENCE_PATH else None
+    try:
+        drift_monitor.reset(build_profile(models, reference_path), models.version)
+    except Exception as e:
+        print(f"⚠️  Drift reference unavailable, using live traffic only: {e}")
+        drift_monitor.reset([], models.version)
+
+# Model files are loaded according to STARTUP_MODE (eager, lazy or background), from
+# MODEL_REGISTRY_DIR when set; a new ACTIVE version there is warmed up and swapped in live
+model_store = ModelStore(
+    model_path='dtr.pkl',
+    preprocessor_path='preprocesser.pkl',
+    arrays_path=MODEL_ARRAYS_PATH,
+    startup_mode=STARTUP_MODE,
+    model_format=MODEL_FORMAT,
+    inference_engine=INFERENCE_ENGINE,
+    feature_encoder=FEATURE_ENCODER,
+    on_load=on_model_load,
+    confidence_min_samples=CONFIDENCE_MIN_SAMPLES,
+    confidence_tolerance=CONFIDENCE_TOLERANCE,
+    registry=ModelRegistry(MODEL_REGISTRY_DIR) if MODEL_REGISTRY_DIR else None,
+    version=MODEL_VERSION,
+    check_interval=MODEL_REGISTRY_CHECK_INTERVAL,
+    self_test_max_ms=MODEL_SELF_TEST_MAX_MS
+)
+model_store.start()
+
+def require_models():
+    """Return (models, None) or (None, error response) when models are unavailable"""
+    models = model_store.get()
+    if models is not None:
+        return models, None
+    if model_store.loading or (model_store.startup_mode == 'background' and model_store.error is None):
+        return None, (jsonify({'error': 'Model is still loading, retry shortly'}), 503, {'Retry-After': '1'})
+    return None, (jsonify({'error': 'Model or preprocessor not loaded'}), 500)
+
+def cached_predict(models, features):
+    """(prediction, confidence) for one feature row, reusing earlier results for identical inputs"""
+    with metrics.stage('validate'):
+        normalized, error = validate_row(features)
+    if error:
+        raise ValueError(error)
+
+    # Keyed on the model version too, so a result computed by a model swapped out
+    # mid-request is never served by its replacement
+    key = (models.version, *normalized)
+    generation = prediction_cache.generation
+    value = prediction_cache.get(key)
+    if value is None:
+        if predict_batcher is not None:
+            value = predict_batcher.predict(models, normalized)
+        else:
+            predictions, confidences = models.predict(models.encode_row(normalized))
+            value = (float(predictions[0]), float(confidences[0]))
+        prediction_cache.put(key, value, generation)
+    if drift_monitor is not None:
+        drift_monitor.observe(normalized, value[0])
+    return value
+
+def cached_predict_items(models, features, items):
+    """(prediction, confidence) for one location and every crop in ``items``, in one batched call
+
+    ``features`` is ``[year, rainfall, pesticides, avgTemp, country]``; crops
+    already in the prediction cache are not recomputed.
+    """
+    countries, known_items = model_categories(models)
+    with metrics.stage('validate'):
+        normalized, error = validate_row(list(features[:5]) + [items[0]], countries, known_items)
+    if error:
+        raise ValueError(error)
+
+    base = normalized[:5]
+    keys = [(models.version, *base, item) for item in items]
+    generation = prediction_cache.generation
+    values = [prediction_cache.get(key) for key in keys]
+    missing = [i for i, value in enumerate(values) if value is None]
+    if missing:
+        columns = [[value] * len(missing) for value in base] + [[items[i] for i in missing]]
+        predictions, confidences = models.predict(models.encode_columns(columns))
+        for i, value, confidence in zip(missing, predictions.tolist(), confidences.tolist()):
+            values[i] = (float(value), float(confidence))
+            prediction_cache.put(keys[i], values[i], generation)
+    if drift_monitor is not None:
+        drift_monitor.observe_many([base + [item] for item in items], [value[0] for value in values])
+    return values
 
 # API endpoint for crop yield prediction
 @app.route('/predict', methods=['POST'])
@@ -77,119 +305,379 @@ def predict():
         return jsonify({'error': 'Expected 6 features: [year, rainfall, pesticides, avgTemp, country, item]'}), 400
 
     # Validate that we have both model and preprocessor
-    if not model or not preprocessor:
-        return jsonify({'error': 'Model or preprocessor not loaded'}), 500
+    models, error = require_models()
+    if error:
+        return error
 
     try:
         # Transform features using the preprocessor
         # Features order: [year, rainfall, pesticides, avgTemp, country, item]
-        processed_features = preprocessor.transform([features])
-        prediction = model.predict(processed_features)
-
-        # Calculate confidence based on model performance (you can adjust this)
-        confidence = 85  # You can implement a more sophisticated confidence calculation
+        # Confidence comes from the training data around the leaf reached (see confidence.py)
+        prediction, confidence = cached_predict(models, features)
 
         return jsonify({
-            'prediction': float(prediction[0]),
-            'confidence': confidence
+            'prediction': prediction,
+            'confidence': confidence,
+            'model_version': models.version
         })
     except Exception as e:
         return jsonify({'error': f'Prediction failed: {str(e)}'}), 400
 
+# Batch prediction endpoint: many rows, one transform and one predict call
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    # Accepts JSON {"rows": [[...], ...]}, JSON {"columns": {"year": [...], ...}}
+    # or a text/csv body with the same six columns
+    try:
+        if request.mimetype == 'text/csv':
+            rows = rows_from_csv(request.get_data(as_text=True))
+        else:
+            data = request.get_json(silent=True)
+            if not data:
+                return jsonify({'error': 'No data provided'}), 400
+            rows = rows_from_json(data)
+    except BatchFormatError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if not rows:
+        return jsonify({'error': 'No rows provided'}), 400
+    if len(rows) > BATCH_MAX_ROWS:
+        return jsonify({'error': f'Batch too large: {len(rows)} rows (max {BATCH_MAX_ROWS})'}), 413
+
+    models, error = require_models()
+    if error:
+        return error
+
+    try:
+        outcomes = predict_rows(models, rows,
+                                on_predicted=drift_monitor.observe_many if drift_monitor is not None else None)
+    except Exception as e:
+        return jsonify({'error': f'Batch prediction failed: {str(e)}'}), 400
+
+    results = []
+    failed = 0
+    for outcome in outcomes:
+        if isinstance(outcome, str):
+            results.append({'error': outcome})
+            failed += 1
+        else:
+            results.append({'prediction': outcome[0], 'confidence': outcome[1]})
+
+    return jsonify({
+        'results': results,
+        'succeeded': len(results) - failed,
+        'failed': failed,
+        'model_version': models.version
+    })
+
+# Scenario sweep: predictions over the grid of feature values, streamed as NDJSON
+# Body: {"fixed": {"year": 2013, "pesticides": 120, "country": "India", "item": "Maize"},
+#        "sweep": {"rainfall": {"start": 200, "stop": 2000, "step": 100}, "avgTemp": [10, 20, 30]},
+#        "aggregate": {"by": ["item"]}, "rows": true}
+# Lines: {"meta": ...}, one {<swept features>, "prediction"} per point, then {"summary": ...}
+@app.route('/predict/sweep', methods=['POST'])
+def predict_sweep():
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'error': 'No data provided'}), 400
+
+    models, error = require_models()
+    if error:
+        return error
+
+    try:
+        countries, items = model_categories(models)
+        sweep = Sweep(data, countries, items, SWEEP_MAX_POINTS)
+        aggregator = None
+        aggregate = data.get('aggregate')
+        if aggregate:
+            by = aggregate.get('by', ['item']) if isinstance(aggregate, dict) else ['item']
+            aggregator = Aggregator(sweep, by)
+        include_rows = data.get('rows', True) is not False
+    except SweepError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # A sweep is a synthetic grid: the drift monitor counts an even sample of at most 1% of a window
+    drift_rows = drift_monitor.window // 100 if drift_monitor is not None else 0
+
+    def generate():
+        yield app.json.dumps({'meta': dict(sweep.describe(), model_version=models.version)}) + '\n'
+        try:
+            for _, columns, predictions, confidences in run_sweep(models, sweep, SWEEP_CHUNK_SIZE, aggregator):
+                if drift_rows:
+                    drift_monitor.observe_columns(columns, predictions,
+                                                  -(-drift_rows * len(predictions) // sweep.total))
+                if not include_rows:
+                    continue
+                swept = [(name, columns[FEATURE_NAMES.index(name)].tolist()) for name in sweep.swept]
+                lines = []
+                for i, (prediction, confidence) in enumerate(zip(predictions.tolist(), confidences.tolist())):
+                    row = {name: values[i] for name, values in swept}
+                    row['prediction'] = prediction
+                    row['confidence'] = confidence
+                    lines.append(app.json.dumps(row))
+                yield '\n'.join(lines) + '\n'
+        except Exception as e:
+            yield app.json.dumps({'error': f'Sweep failed: {str(e)}'}) + '\n'
+            return
+        summary = {'points': sweep.total}
+        if aggregator is not None:
+            summary['aggregate'] = {'by': aggregator.by, 'groups': aggregator.result()}
+        yield app.json.dumps({'summary': summary}) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+# Prometheus metrics: request latency per endpoint and time per stage
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+# Prediction cache statistics
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'prediction_cache': prediction_cache.stats(),
+        'weather_cache': weather_service.stats(),
+        'predict_batching': predict_batcher.stats() if predict_batcher is not None else None
+    })
+
+# Drift of this worker's recent prediction inputs and predicted yields (every /predict*
+# endpoint; sweeps are sampled): PSI per feature against the training profile (see drift.py)
+@app.route('/drift', methods=['GET'])
+def get_drift():
+    if drift_monitor is None:
+        return jsonify({'error': 'Drift monitoring is disabled (DRIFT_ENABLED)'}), 404
+    return jsonify(drift_monitor.report())
+
+# Reload model files from disk (e.g. after retraining) and invalidate the cache
+# Body (optional): {"version": "..."} to switch to a registry version; it becomes ACTIVE
+# for every worker once it passes the self-test. Requests keep the old model meanwhile.
+@app.route('/model/reload', methods=['POST'])
+def reload_model():
+    version = (request.get_json(silent=True) or {}).get('version')
+    try:
+        loaded = model_store.activate(version) if version else model_store.load()
+    except ModelRegistryError as e:
+        return jsonify({'error': str(e)}), 400
+    if loaded is None:
+        return jsonify({'error': model_store.error or 'Model reload failed'}), 500
+    return jsonify({'success': True, 'model_version': loaded.version,
+                    'self_test': model_store.self_test, 'cache': prediction_cache.stats()})
+
+# Registered model versions and which one is active
+@app.route('/model/versions', methods=['GET'])
+def model_versions():
+    if model_store.registry is None:
+        return jsonify({'error': 'No model registry configured (MODEL_REGISTRY_DIR)'}), 404
+    current = model_store.get()
+    return jsonify({
+        'versions': model_store.registry.describe(),
+        'serving': current.version if current is not None else None
+    })
+
+# Readiness probe: 200 once the model is loaded, 503 while warming up or failed.
+# With STARTUP_MODE "lazy" the first probe starts a background load, since a worker
+# that fails its probe would never receive the request that loads it.
+@app.route('/ready', methods=['GET'])
+def ready():
+    if model_store.startup_mode == 'lazy' and not model_store.ready and model_store.error is None:
+        model_store.warm_up()
+    status = model_store.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+# Saved predictions: pooled WAL connections plus a group-commit writer thread
+prediction_db = PredictionDatabase(
+    path=PREDICTIONS_DB_PATH,
+    pool_size=DB_POOL_SIZE,
+    write_batch_size=DB_WRITE_BATCH_SIZE,
+    write_max_wait=DB_WRITE_MAX_WAIT_MS / 1000
+)
+
+# Rows moved out of the database by retention.py, read back for /history?archived=1
+prediction_archive = PredictionArchive(_local(ARCHIVE_DIR))
+
 # Database initialization
 def init_db():
-    conn = sqlite3.connect('predictions.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS predictions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            input_data TEXT,
-            prediction_result TEXT,
-            location_data TEXT,
-            user_id TEXT DEFAULT 'anonymous'
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    prediction_db.init_schema()
 
 # Weather API integration
+# Values come from WEATHER_PROVIDER for the centre of the grid cell containing the point
 @app.route('/weather/<lat>/<lon>', methods=['GET'])
 def get_weather(lat, lon):
     try:
-        # Mock weather data for demo - replace with actual API
-        weather_data = {
-            'temperature': 25 + (float(lat) / 10) % 15,
-            'humidity': 60 + (float(lon) / 10) % 30,
-            'rainfall': 800 + (float(lat) * float(lon)) % 1000,
+        weather_data = weather_service.get(*parse_coordinates(lat, lon))
+        weather_data.update({
             'location': f"Location {lat}, {lon}",
             'country': 'Unknown'
-        }
+        })
         return jsonify(weather_data)
     except Exception as e:
         return jsonify({'error': f'Weather fetch failed: {str(e)}'}), 400
 
+# Bulk weather lookup
+# Body: {"points": [[lat, lon], ...]} or {"points": [{"lat": ..., "lon": ...}, ...]}
+@app.route('/weather/batch', methods=['POST'])
+def get_weather_batch():
+    data = request.get_json(silent=True) or {}
+    points = data.get('points')
+    if not isinstance(points, list) or not points:
+        return jsonify({'error': 'Provide a non-empty "points" list'}), 400
+    if len(points) > WEATHER_BATCH_MAX_POINTS:
+        return jsonify({'error': f'Too many points (max {WEATHER_BATCH_MAX_POINTS})'}), 400
+
+    results = [None] * len(points)
+    valid = []
+    for i, point in enumerate(points):
+        if isinstance(point, dict) and 'lat' in point and 'lon' in point:
+            point = (point['lat'], point['lon'])
+        if not isinstance(point, (list, tuple)) or len(point) != 2:
+            results[i] = {'error': 'Invalid point: expected [lat, lon] or {"lat": ..., "lon": ...}'}
+            continue
+        try:
+            lat, lon = parse_coordinates(*point)
+            valid.append((i, lat, lon))
+        except Exception as e:
+            results[i] = {'error': f'Invalid point: {str(e)}'}
+
+    try:
+        weather = weather_service.get_many([(lat, lon) for _, lat, lon in valid])
+    except Exception as e:
+        return jsonify({'error': f'Weather fetch failed: {str(e)}'}), 500
+    for (i, lat, lon), weather_data in zip(valid, weather):
+        weather_data.update({'location': f"Location {lat}, {lon}", 'country': 'Unknown'})
+        results[i] = weather_data
+
+    return jsonify({'results': results, 'count': len(results)})
+
 # Save prediction to database
+# The model version is the top-level "model_version", else the one echoed inside "prediction",
+# else the version serving now
 @app.route('/save-prediction', methods=['POST'])
 def save_prediction():
     try:
         data = request.get_json()
-        conn = sqlite3.connect('predictions.db')
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            INSERT INTO predictions (input_data, prediction_result, location_data, user_id)
-            VALUES (?, ?, ?, ?)
-        ''', (
-            json.dumps(data.get('input_data', {})),
-            json.dumps(data.get('prediction', {})),
-            json.dumps(data.get('location', {})),
-            data.get('user_id', 'anonymous')
-        ))
-
-        conn.commit()
-        prediction_id = cursor.lastrowid
-        conn.close()
+        models = model_store.current
+        model_version = (extract_model_version(data)
+                         or extract_model_version(data.get('prediction'))
+                         or (models.version if models is not None else None))
+
+        prediction_id = prediction_db.save_prediction(
+            data.get('input_data', {}),
+            data.get('prediction', {}),
+            data.get('location', {}),
+            data.get('user_id', 'anonymous'),
+            model_version
+        )
 
         return jsonify({'success': True, 'id': prediction_id})
     except Exception as e:
         return jsonify({'error': f'Save failed: {str(e)}'}), 400
 
+def parse_history_date(value, end_of_day=False):
+    """Normalize a from/to query value to the stored 'YYYY-MM-DD HH:MM:SS' format"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if end_of_day and len(value) == 10:
+        parsed = parsed.replace(hour=23, minute=59, second=59)
+    if parsed.tzinfo is not None:
+        # Rows are stamped with CURRENT_TIMESTAMP, which is UTC
+        parsed = parsed.astimezone(timezone.utc)
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+def merge_archived_history(rows, next_cursor, user_id, limit, cursor=None, **filters):
+    """Merge one page of live history with the archived rows that belong on it"""
+    archived = prediction_archive.fetch_history(user_id, limit + 1,
+                                                decode_cursor(cursor) if cursor else None, **filters)
+    if not archived:
+        return rows, next_cursor
+    # A row archived just before a crash can still be in the database too
+    merged = {row[0]: row for row in archived}
+    merged.update((row[0], row) for row in rows)
+    rows = sorted(merged.values(), key=lambda row: (row[1], row[0]), reverse=True)
+    if next_cursor is not None or len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+    return rows, next_cursor
+
 # Get prediction history
+# Query: user_id, limit (max HISTORY_MAX_LIMIT), cursor (from next_cursor),
+# crop, country, from/to (ISO dates), raw=1 for undecoded JSON text,
+# archived=1 to include rows moved to ARCHIVE_DIR by retention.py (slower)
 @app.route('/history', methods=['GET'])
 def get_history():
     try:
         user_id = request.args.get('user_id', 'anonymous')
-        limit = int(request.args.get('limit', 50))
-
-        conn = sqlite3.connect('predictions.db')
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            SELECT id, timestamp, input_data, prediction_result, location_data
-            FROM predictions
-            WHERE user_id = ?
-            ORDER BY timestamp DESC
-            LIMIT ?
-        ''', (user_id, limit))
+        limit = min(max(int(request.args.get('limit', 50)), 1), HISTORY_MAX_LIMIT)
+        # raw=1 returns the stored JSON text as-is instead of decoding it
+        raw = request.args.get('raw', '').lower() in ('1', 'true', 'yes')
+        cursor = request.args.get('cursor')
+        filters = {
+            'crop': request.args.get('crop'),
+            'country': request.args.get('country'),
+            'since': parse_history_date(request.args.get('from')),
+            'until': parse_history_date(request.args.get('to'), end_of_day=True)
+        }
 
-        rows = cursor.fetchall()
-        conn.close()
+        rows, next_cursor = prediction_db.fetch_history(user_id, limit, cursor=cursor, **filters)
+        if request.args.get('archived', '').lower() in ('1', 'true', 'yes'):
+            rows, next_cursor = merge_archived_history(rows, next_cursor, user_id, limit, cursor, **filters)
 
-        history = []
-        for row in rows:
-            history.append({
+        if raw:
+            history = [{
                 'id': row[0],
                 'timestamp': row[1],
-                'input_data': json.loads(row[2]),
-                'prediction': json.loads(row[3]),
-                'location': json.loads(row[4]) if row[4] else None
-            })
-
-        return jsonify({'history': history})
+                'input_data': row[2],
+                'prediction': row[3],
+                'location': row[4] or None
+            } for row in rows]
+            return jsonify({'history': history, 'next_cursor': next_cursor})
+
+        # The stored columns are already JSON: splice them in instead of re-encoding them
+        dumps = app.json.dumps
+        body = ','.join(
+            f'{{"id":{dumps(row[0])},"input_data":{json_fragment(row[2])},'
+            f'"location":{json_fragment(row[4])},"prediction":{json_fragment(row[3])},'
+            f'"timestamp":{dumps(row[1])}}}'
+            for row in rows
+        )
+        return app.response_class(f'{{"history":[{body}],"next_cursor":{dumps(next_cursor)}}}\n',
+                                  mimetype=app.json.mimetype)
     except Exception as e:
         return jsonify({'error': f'History fetch failed: {str(e)}'}), 400
 
+def parse_month(value):
+    """Validate a YYYY-MM query value"""
+    if not value:
+        return None
+    return datetime.strptime(value, '%Y-%m').strftime('%Y-%m')
+
+# Prediction trends: monthly average/min/max predicted yield from the rollup table
+# Query: group_by (comma-separated: crop, country; empty for all rows), crop, country,
+# from/to (YYYY-MM months, inclusive)
+@app.route('/analytics/trends', methods=['GET'])
+def get_trends():
+    group_by = [key for key in request.args.get('group_by', 'crop').split(',') if key]
+    unknown = [key for key in group_by if key not in ('crop', 'country')]
+    if unknown:
+        return jsonify({'error': f'Cannot group by {", ".join(unknown)} (use crop and/or country)'}), 400
+    try:
+        since, until = parse_month(request.args.get('from')), parse_month(request.args.get('to'))
+    except ValueError:
+        return jsonify({'error': 'from/to must be months formatted YYYY-MM'}), 400
+
+    try:
+        trends = prediction_db.fetch_trends(
+            group_by,
+            crop=request.args.get('crop'),
+            country=request.args.get('country'),
+            since=since,
+            until=until
+        )
+        return jsonify({'trends': trends, 'group_by': group_by})
+    except Exception as e:
+        return jsonify({'error': f'Trends fetch failed: {str(e)}'}), 500
+
 # Enhanced prediction endpoint with anomaly detection
 @app.route('/predict-enhanced', methods=['POST'])
 def predict_enhanced():
@@ -202,89 +690,90 @@ def predict_enhanced():
     if len(features) != 6:
         return jsonify({'error': 'Expected 6 features: [year, rainfall, pesticides, avgTemp, country, item]'}), 400
 
-    if not model or not preprocessor:
-        return jsonify({'error': 'Model or preprocessor not loaded'}), 500
+    models, error = require_models()
+    if error:
+        return error
 
     try:
-        # Make prediction
-        processed_features = preprocessor.transform([features])
-        prediction = model.predict(processed_features)
+        # Make prediction and confidence
+        prediction, confidence = cached_predict(models, features)
 
-        # Calculate confidence
-        confidence = 85
-
-        # Anomaly detection
-        anomalies = detect_anomalies(features, float(prediction[0]))
-
-        # Generate recommendations
-        recommendations = generate_recommendations(features, float(prediction[0]))
+        # Anomalies, recommendations and input factors from rules.json
+        annotation = rule_store.get().annotate([features], [prediction])[0]
 
         result = {
-            'prediction': float(prediction[0]),
+            'prediction': prediction,
             'confidence': confidence,
-            'anomalies': anomalies,
-            'recommendations': recommendations,
-            'factors': {
-                'rainfall': 'High' if features[1] > 1000 else 'Medium' if features[1] > 500 else 'Low',
-                'temperature': 'High' if features[3] > 25 else 'Medium' if features[3] > 15 else 'Low',
-                'pesticides': 'High' if features[2] > 2 else 'Medium' if features[2] > 1 else 'Low'
-            }
+            'anomalies': annotation['anomalies'],
+            'recommendations': annotation['recommendations'],
+            'factors': annotation['factors'],
+            'model_version': models.version
         }
 
         return jsonify(result)
     except Exception as e:
         return jsonify({'error': f'Enhanced prediction failed: {str(e)}'}), 400
 
-def detect_anomalies(features, yield_value):
-    """Detect anomalies in prediction inputs and results"""
-    anomalies = []
-    year, rainfall, pesticides, temp, country, item = features
-
-    # Critical yield threshold
-    if yield_value < 1000:
-        anomalies.append({
-            'type': 'critical',
-            'message': 'Critically low yield predicted',
-            'reasons': ['Extreme weather conditions', 'Insufficient inputs']
-        })
+# Rank every crop the model knows for one location
+# Body: {"features": [year, rainfall, pesticides, avgTemp, country], "top_k": 3}
+@app.route('/predict/rank', methods=['POST'])
+def predict_rank():
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'error': 'No data provided'}), 400
 
-    # Environmental anomalies
-    if rainfall < 200:
-        anomalies.append({
-            'type': 'warning',
-            'message': 'Drought conditions detected',
-            'reasons': ['Very low rainfall']
-        })
+    features = data.get('features', [])
+    if not isinstance(features, list) or len(features) != 5:
+        return jsonify({'error': 'Expected 5 features: [year, rainfall, pesticides, avgTemp, country]'}), 400
+    top_k = data.get('top_k', 3)
+    if isinstance(top_k, bool) or not isinstance(top_k, int) or top_k < 0:
+        return jsonify({'error': 'top_k must be a non-negative integer'}), 400
 
-    if temp > 40:
-        anomalies.append({
-            'type': 'critical',
-            'message': 'Extreme heat conditions',
-            'reasons': ['Temperature exceeds crop tolerance']
-        })
+    models, error = require_models()
+    if error:
+        return error
 
-    return anomalies
+    try:
+        items = sorted(model_categories(models)[1])
+        outcomes = cached_predict_items(models, features, items)
+
+        # Highest yield first, ties in alphabetical order
+        ordered = sorted(zip(outcomes, items), key=lambda pair: (-pair[0][0], pair[1]))
+        ranking = [{'rank': rank, 'item': item, 'prediction': prediction, 'confidence': confidence}
+                   for rank, ((prediction, confidence), item) in enumerate(ordered, 1)]
+
+        # One vectorized rules pass for all of the top_k crops
+        top = ranking[:top_k]
+        if top:
+            rows = [list(features) + [entry['item']] for entry in top]
+            annotations = rule_store.get().annotate(rows, [entry['prediction'] for entry in top])
+            for entry, annotation in zip(top, annotations):
+                entry['anomalies'] = annotation['anomalies']
+                entry['recommendations'] = annotation['recommendations']
+
+        return jsonify({'ranking': ranking, 'count': len(ranking), 'model_version': models.version})
+    except Exception as e:
+        return jsonify({'error': f'Ranking failed: {str(e)}'}), 400
+
+def detect_anomalies(features, yield_value):
+    """Detect anomalies in prediction inputs and results"""
+    return rule_store.get().annotate([features], [yield_value])[0]['anomalies']
 
 def generate_recommendations(features, yield_value):
     """Generate farming recommendations based on inputs"""
-    recommendations = []
-    year, rainfall, pesticides, temp, country, item = features
-
-    if rainfall < 500:
-        recommendations.append({
-            'type': 'irrigation',
-            'title': 'Irrigation Required',
-            'description': 'Install drip irrigation system'
-        })
+    return rule_store.get().annotate([features], [yield_value])[0]['recommendations']
 
-    if yield_value < 3000:
-        recommendations.append({
-            'type': 'fertilizer',
-            'title': 'Soil Enhancement',
-            'description': 'Apply NPK fertilizer and organic compost'
-        })
+# Loaded rule names, file path and last reload
+@app.route('/rules', methods=['GET'])
+def rules_status():
+    return jsonify(rule_store.status())
 
-    return recommendations
+# Reload rules.json now instead of waiting for the file check
+@app.route('/rules/reload', methods=['POST'])
+def reload_rules():
+    if not rule_store.reload():
+        return jsonify({'error': rule_store.error}), 500
+    return jsonify({'success': True, 'rules': rule_store.status()})
 
 # AI Chatbot endpoint
 @app.route('/chat', methods=['POST'])
@@ -297,40 +786,11 @@ def chat():
         if not message:
             return jsonify({'error': 'No message provided'}), 400
 
+        ai_response = None
         if USE_OPENAI:
-            # Use OpenAI API
-            try:
-                # Prepare conversation context
-                messages = [
-                    {
-                        "role": "system",
-                        "content": SYSTEM_PROMPT
-                    }
-                ]
-
-                # Add recent conversation history
-                for msg in history[-5:]:  # Last 5 messages for context
-                    if msg['sender'] == 'user':
-                        messages.append({"role": "user", "content": msg['text']})
-                    else:
-                        messages.append({"role": "assistant", "content": msg['text']})
-
-                # Add current message
-                messages.append({"role": "user", "content": message})
-
-                response = client.chat.completions.create(
-                    model=OPENAI_MODEL,
-                    messages=messages,
-                    max_tokens=MAX_TOKENS,
-                    temperature=TEMPERATURE
-                )
-
-                ai_response = response.choices[0].message.content
-
-            except Exception as e:
-                print(f"OpenAI API error: {e}")
-                ai_response = get_fallback_response(message)
-        else:
+            # Use OpenAI API (None when busy, timed out or failed)
+            ai_response = chat_service.complete(build_messages(SYSTEM_PROMPT, message, history))
+        if ai_response is None:
             # Use fallback responses
             ai_response = get_fallback_response(message)
 
@@ -339,261 +799,60 @@ def chat():
     except Exception as e:
         return jsonify({'error': f'Chat failed: {str(e)}'}), 400
 
-def get_fallback_response(message):
-    """Provide intelligent fallback responses based on the specific question asked"""
-    message_lower = message.lower()
-
-    # Wheat-specific questions
-    if 'wheat' in message_lower:
-        if any(word in message_lower for word in ['time', 'when', 'plant', 'sow']):
-            return """🌾 **Best Time to Plant Wheat:**
-
-• **Winter Wheat:** Plant in fall (September-November) for spring harvest
-• **Spring Wheat:** Plant in early spring (March-May) after frost danger
-• **Soil Temperature:** Plant when soil reaches 50-60°F (10-15°C)
-• **Regional Timing:** Varies by climate zone and variety
-• **Weather Considerations:** Avoid planting before heavy rains
-
-**Planting Tips:**
-- Prepare seedbed 2-3 weeks before planting
-- Plant 1-2 inches deep in well-drained soil
-- Use certified seed for best results
-
-Would you like specific timing for your region?"""
-
-        elif any(word in message_lower for word in ['yield', 'improve', 'increase', 'production']):
-            return """� **How to Improve Wheat Yield:**
-
-• **Variety Selection:** Choose high-yielding varieties adapted to your area
-• **Soil Preparation:** Deep tillage and proper seedbed preparation
-• **Seeding Rate:** 90-120 lbs/acre depending on conditions
-• **Fertilization:** Apply nitrogen in split applications (base + top-dress)
-• **Weed Control:** Early season weed management is critical
-
-**Key Growth Stages:**
-- Tillering: Ensure adequate nitrogen and moisture
-- Jointing: Side-dress with nitrogen fertilizer
-- Heading: Monitor for diseases and pests
-- Grain filling: Maintain soil moisture
-
-Expected yield: 40-80 bushels/acre with good management."""
-
-        elif any(word in message_lower for word in ['fertilizer', 'nutrition', 'nutrients']):
-            return """🌾 **Wheat Fertilizer Recommendations:**
-
-• **Nitrogen:** 80-120 lbs/acre (split application recommended)
-  - 40-60 lbs at planting
-  - 40-60 lbs at tillering/jointing
-• **Phosphorus:** 30-50 lbs P2O5/acre based on soil test
-• **Potassium:** 40-80 lbs K2O/acre if soil levels are low
-• **Sulfur:** 10-20 lbs/acre, especially on sandy soils
-
-**Application Timing:**
-- Base fertilizer at planting
-- Top-dress nitrogen at tillering (4-6 weeks after emergence)
-- Foliar feeding for micronutrients if needed"""
+def sse_event(payload, event=None):
+    """Format one server-sent event"""
+    prefix = f'event: {event}\n' if event else ''
+    return f'{prefix}data: {app.json.dumps(payload)}\n\n'
 
-        else:
-            return """🌾 **Wheat Cultivation Guide:**
-
-• **Varieties:** Choose winter or spring wheat based on your climate
-• **Soil Requirements:** Well-drained, fertile soil with pH 6.0-7.5
-• **Planting:** 1-2 inch depth, 90-120 lbs seed/acre
-• **Growth Period:** 120-150 days from planting to harvest
-• **Water Needs:** 20-25 inches total (including rainfall)
-
-**Common Issues:**
-- Rust diseases: Use resistant varieties
-- Aphids: Monitor and treat if necessary
-- Lodging: Avoid over-fertilization with nitrogen
-
-What specific aspect of wheat growing interests you?"""
-
-    # Corn-specific questions
-    elif any(word in message_lower for word in ['corn', 'maize']):
-        if any(word in message_lower for word in ['fertilizer', 'nutrition']):
-            return """🌽 **Corn Fertilizer Recommendations:**
-
-• **Nitrogen:** 150-200 lbs/acre (most critical nutrient)
-  - 30-50 lbs at planting
-  - 100-150 lbs side-dress at V6-V8 stage
-• **Phosphorus:** 40-80 lbs P2O5/acre based on soil test
-• **Potassium:** 60-120 lbs K2O/acre depending on soil levels
-• **Zinc:** 1-2 lbs/acre if soil is deficient
-
-**Application Strategy:**
-- Starter fertilizer (10-34-0) at planting
-- Side-dress nitrogen when corn is knee-high
-- Foliar micronutrients during rapid growth"""
-
-        elif any(word in message_lower for word in ['plant', 'planting', 'when', 'time']):
-            return """� **Corn Planting Guide:**
-
-• **Timing:** Plant when soil temperature reaches 60°F (16°C)
-• **Season:** Late April to early June in most regions
-• **Depth:** 1.5-2 inches deep in good conditions
-• **Spacing:** 30-36 inch rows, 28,000-35,000 plants/acre
-• **Soil Conditions:** Well-drained, avoid wet or compacted soil
-
-**Planting Tips:**
-- Test soil temperature at 4-inch depth
-- Ensure good seed-to-soil contact
-- Consider treated seed for disease protection
-- Plant in straight rows for easier cultivation"""
+# Streaming chat endpoint (server-sent events)
+# Emits {"token": ...} events as the reply arrives, then an "event: done"
+# carrying the full response and whether it came from OpenAI or the fallback
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    data = request.get_json(silent=True) or {}
+    message = data.get('message', '')
+    history = data.get('history', [])
 
-        else:
-            return """� **Corn Growing Essentials:**
-
-• **Soil:** Rich, well-drained soil with pH 6.0-6.8
-• **Water:** 20-30 inches during growing season
-• **Temperature:** Warm season crop, needs 2500+ heat units
-• **Spacing:** 30-inch rows, 30,000 plants/acre typical
-• **Growth Period:** 90-120 days depending on variety
-
-**Key Growth Stages:**
-- V6: Side-dress nitrogen application
-- VT (tasseling): Critical water period begins
-- R1 (silking): Pollination occurs
-- R6 (maturity): Ready for harvest
-
-What specific corn growing question do you have?"""
-
-    # Rice-specific questions
-    elif 'rice' in message_lower:
-        return """🌾 **Rice Cultivation Guide:**
-
-• **Field Preparation:** Level fields and create bunds for water control
-• **Transplanting:** 20-25 day old seedlings, 20cm x 15cm spacing
-• **Water Management:** Maintain 2-5cm water depth throughout season
-• **Fertilization:** 120:60:40 NPK kg/ha in split applications
-• **Weed Control:** Pre-emergence herbicides + hand weeding
-
-**Growth Stages:**
-- Tillering: 15-45 days after transplanting
-- Panicle initiation: 45-65 days
-- Flowering: 65-75 days
-- Maturity: 110-130 days
-
-**Water Requirements:**
-- Continuous flooding from transplanting to 2 weeks before harvest
-- Drain field for harvest operations"""
-
-    # Tomato-specific questions
-    elif 'tomato' in message_lower:
-        if any(word in message_lower for word in ['plant', 'when', 'time']):
-            return """🍅 **When to Plant Tomatoes:**
-
-• **Indoor Start:** 6-8 weeks before last frost date
-• **Transplant:** 2-3 weeks after last frost when soil is 60°F+
-• **Direct Seed:** Only in warm climates with long seasons
-• **Soil Temperature:** Wait until soil reaches 60-65°F (16-18°C)
-
-**Regional Timing:**
-- Northern regions: May-June transplanting
-- Southern regions: March-April and August-September
-- Greenhouse: Year-round with climate control
-
-**Transplanting Tips:**
-- Harden off seedlings for 7-10 days
-- Plant deep, burying 2/3 of stem
-- Space 18-36 inches apart depending on variety"""
+    if not message:
+        return jsonify({'error': 'No message provided'}), 400
 
-        else:
-            return """🍅 **Tomato Growing Guide:**
-
-• **Varieties:** Determinate (bush) or indeterminate (vining)
-• **Soil:** Well-drained, pH 6.0-6.8, rich in organic matter
-• **Support:** Stakes, cages, or trellises for most varieties
-• **Water:** 1-2 inches per week, consistent moisture
-• **Fertilization:** Balanced fertilizer, avoid excess nitrogen
-
-**Common Problems:**
-- Blossom end rot: Consistent watering + calcium
-- Cracking: Avoid irregular watering
-- Diseases: Good air circulation and crop rotation
-
-**Harvest:** Pick when fruits show color but are still firm."""
-
-    # General farming questions
-    elif any(word in message_lower for word in ['soil', 'fertilizer', 'nutrients']):
-        return """🌱 **Soil & Fertilizer Management:**
-
-• **Soil Testing:** Test pH and nutrients every 2-3 years
-• **pH Management:** Most crops prefer 6.0-7.0 pH range
-• **Organic Matter:** Add compost to improve soil structure
-• **NPK Balance:** Nitrogen for growth, Phosphorus for roots, Potassium for disease resistance
-• **Micronutrients:** Iron, zinc, manganese often deficient
-
-**Fertilizer Application:**
-- Apply based on soil test recommendations
-- Split nitrogen applications for better efficiency
-- Consider slow-release fertilizers for consistent feeding"""
-
-    elif any(word in message_lower for word in ['pest', 'disease', 'insect']):
-        return """🐛 **Pest & Disease Management:**
-
-• **Integrated Pest Management (IPM):** Combine multiple control methods
-• **Prevention:** Crop rotation, resistant varieties, sanitation
-• **Monitoring:** Regular scouting for early detection
-• **Biological Control:** Beneficial insects, parasites, predators
-• **Chemical Control:** Use pesticides as last resort
-
-**Common Pests:**
-- Aphids: Use beneficial insects or insecticidal soap
-- Caterpillars: Bt (Bacillus thuringiensis) spray
-- Fungal diseases: Improve air circulation, fungicides if severe"""
-
-    elif any(word in message_lower for word in ['water', 'irrigation', 'drought']):
-        return """💧 **Water Management:**
-
-• **Irrigation Systems:** Drip irrigation most efficient (90-95% efficiency)
-• **Timing:** Water early morning to reduce evaporation
-• **Soil Moisture:** Check 6-8 inches deep before watering
-• **Mulching:** Reduces water loss by 50-70%
-• **Drought Tolerance:** Deep, infrequent watering builds strong roots
-
-**Water Requirements by Crop:**
-- Vegetables: 1-2 inches per week
-- Grains: 20-30 inches per season
-- Fruit trees: Deep watering 1-2 times per week"""
-
-    elif any(word in message_lower for word in ['organic', 'sustainable']):
-        return """🌿 **Sustainable Farming Practices:**
-
-• **Crop Rotation:** 3-4 year rotation prevents soil depletion
-• **Cover Crops:** Legumes fix nitrogen, grasses prevent erosion
-• **Composting:** Recycle organic matter into valuable fertilizer
-• **Beneficial Insects:** Plant flowers to attract pollinators
-• **Reduced Tillage:** Preserves soil structure and organic matter
-
-**Organic Certification:**
-- 3-year transition period required
-- No synthetic pesticides or fertilizers
-- Detailed record keeping mandatory
-- Annual inspections required"""
-
-    else:
-        # Default response for unrecognized questions
-        return f"""🌾 **Agricultural AI Assistant**
-
-I understand you're asking about: "{message}"
-
-I can provide specific guidance on:
-
-• **Crop-Specific Advice:** Wheat, corn, rice, tomatoes, vegetables
-• **Soil Management:** Testing, fertilization, pH adjustment
-• **Pest Control:** Integrated pest management strategies
-• **Water Management:** Irrigation systems and scheduling
-• **Sustainable Practices:** Organic farming and conservation
-• **Timing:** When to plant, fertilize, and harvest
-
-Could you be more specific about what aspect you'd like to know? For example:
-- "When to plant wheat in my area?"
-- "Best fertilizer for corn?"
-- "How to control tomato diseases?"
-
-I'm here to help with your farming questions!"""
+    try:
+        messages = build_messages(SYSTEM_PROMPT, message, history)
+    except Exception as e:
+        return jsonify({'error': f'Chat failed: {str(e)}'}), 400
+
+    def generate():
+        sent = []
+        source = 'openai'
+        if USE_OPENAI:
+            try:
+                for token in chat_service.stream(messages):
+                    sent.append(token)
+                    yield sse_event({'token': token})
+            except ChatUnavailable as e:
+                if sent:
+                    # Part of the answer is already out; report instead of mixing in a fallback
+                    yield sse_event({'error': str(e)}, event='error')
+                    return
+        if not sent:
+            source = 'fallback'
+            sent.append(get_fallback_response(message))
+            yield sse_event({'token': sent[0]})
+        yield sse_event({'response': ''.join(sent), 'source': source}, event='done')
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Chat upstream statistics
+@app.route('/chat/stats', methods=['GET'])
+def chat_stats():
+    return jsonify({'openai_enabled': USE_OPENAI, 'upstream': chat_service.stats()})
+
+def get_fallback_response(message):
+    """Provide intelligent fallback responses based on the specific question asked"""
+    return intent_engine.respond(message)
 
 if __name__ == '__main__':
+    # Development server; use serve.py for production
     init_db()
-    app.run(debug=True)
\ No newline at end of file
+    app.run(host=HOST, port=PORT, debug=DEBUG_MODE)
\ No newline at end of file
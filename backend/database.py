@@ -0,0 +1,686 @@
+"""SQLite persistence for saved predictions
+
+Connections come from a small bounded pool instead of being opened per
+request, every connection runs in WAL mode with tuned pragmas, and inserts
+go through a single writer thread that commits whatever has queued up in
+one transaction (group commit), so concurrent savers stop fighting over
+the write lock.
+
+Schema changes are applied by numbered migrations tracked in
+``PRAGMA user_version``.
+
+``prediction_rollups`` holds count/sum/min/max of the predicted yield per
+month, crop and country. A trigger updates it in the same transaction as
+each insert, so analytics queries read a table whose size depends on the
+number of months and categories, not on the number of saved predictions.
+"""
+import atexit
+import base64
+import json
+import math
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from metrics import stage
+
+PRAGMAS = (
+    # Must precede journal_mode on a new file; existing files switch on their next VACUUM
+    'PRAGMA auto_vacuum=INCREMENTAL',
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-8000',
+    'PRAGMA mmap_size=67108864',
+)
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS predictions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        input_data TEXT,
+        prediction_result TEXT,
+        location_data TEXT,
+        user_id TEXT DEFAULT 'anonymous'
+    )
+'''
+
+
+def extract_fields(input_data):
+    """Pull (crop, country) out of a saved input payload
+
+    Accepts the form payload ``{"item": ..., "country": ...}`` (``crop`` is
+    accepted for ``item``) or ``{"features": [year, ..., country, item]}``.
+    """
+    if isinstance(input_data, str):
+        try:
+            input_data = json.loads(input_data)
+        except ValueError:
+            return None, None
+    if not isinstance(input_data, dict):
+        return None, None
+    features = input_data.get('features')
+    if isinstance(features, list) and len(features) == 6:
+        return _text(features[5]), _text(features[4])
+    return _text(input_data.get('item', input_data.get('crop'))), _text(input_data.get('country'))
+
+
+def extract_model_version(prediction):
+    """The ``model_version`` a saved prediction payload was tagged with, or None"""
+    if isinstance(prediction, str):
+        try:
+            prediction = json.loads(prediction)
+        except ValueError:
+            return None
+    if not isinstance(prediction, dict):
+        return None
+    return _text(prediction.get('model_version'))
+
+
+def _text(value):
+    return value if isinstance(value, str) and value else None
+
+
+def _finite(value):
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(item) for item in value]
+    return value
+
+
+def to_json(value):
+    """Strict JSON text for a stored column, with NaN and ±Infinity written as null
+
+    ``/history`` splices stored columns into its response unchanged, so they
+    must never hold the ``NaN`` tokens the stdlib encoder emits by default.
+    """
+    try:
+        return json.dumps(value, allow_nan=False)
+    except ValueError:
+        return json.dumps(_finite(value), allow_nan=False)
+
+
+def strict_json(text):
+    """Stored column text rewritten by ``to_json``; empty text becomes NULL"""
+    if not text:
+        return None
+    try:
+        return to_json(json.loads(text))
+    except ValueError:
+        # Not JSON at all: keep it, as a JSON string
+        return json.dumps(text)
+
+
+def _migrate_extracted_columns(conn):
+    """v1: crop/country columns backfilled from input_data, history index"""
+    conn.execute('ALTER TABLE predictions ADD COLUMN crop TEXT')
+    conn.execute('ALTER TABLE predictions ADD COLUMN country TEXT')
+    conn.create_function('extract_crop', 1, lambda text: extract_fields(text)[0], deterministic=True)
+    conn.create_function('extract_country', 1, lambda text: extract_fields(text)[1], deterministic=True)
+    conn.execute('UPDATE predictions SET crop = extract_crop(input_data), country = extract_country(input_data)')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_predictions_user_time
+        ON predictions (user_id, timestamp, id)
+    ''')
+
+
+def _migrate_model_version(conn):
+    """v2: model_version column, backfilled where the saved prediction was tagged"""
+    conn.execute('ALTER TABLE predictions ADD COLUMN model_version TEXT')
+    conn.create_function('extract_model_version', 1, extract_model_version, deterministic=True)
+    conn.execute('''
+        UPDATE predictions SET model_version = extract_model_version(prediction_result)
+        WHERE prediction_result LIKE '%"model_version"%'
+    ''')
+
+
+ROLLUP_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS prediction_rollups (
+        month TEXT NOT NULL,
+        crop TEXT NOT NULL,
+        country TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        yield_sum REAL NOT NULL,
+        yield_min REAL NOT NULL,
+        yield_max REAL NOT NULL,
+        confidence_sum REAL NOT NULL,
+        confidence_count INTEGER NOT NULL,
+        PRIMARY KEY (month, crop, country)
+    ) WITHOUT ROWID
+'''
+
+# The predicted yield of a row, NULL unless prediction_result holds a number
+_ROLLUP_VALUE = '''
+    CASE WHEN json_valid({row}.prediction_result)
+              AND json_type({row}.prediction_result, '$.prediction') IN ('integer', 'real')
+         THEN json_extract({row}.prediction_result, '$.prediction') END
+'''
+_ROLLUP_CONFIDENCE = '''
+    CASE WHEN json_valid({row}.prediction_result)
+              AND json_type({row}.prediction_result, '$.confidence') IN ('integer', 'real')
+         THEN json_extract({row}.prediction_result, '$.confidence') END
+'''
+
+ROLLUP_TRIGGER = f'''
+    CREATE TRIGGER IF NOT EXISTS predictions_rollup AFTER INSERT ON predictions
+    WHEN {_ROLLUP_VALUE.format(row='NEW')} IS NOT NULL
+    BEGIN
+        INSERT INTO prediction_rollups
+        VALUES (substr(NEW.timestamp, 1, 7), coalesce(NEW.crop, ''), coalesce(NEW.country, ''), 1,
+                {_ROLLUP_VALUE.format(row='NEW')}, {_ROLLUP_VALUE.format(row='NEW')},
+                {_ROLLUP_VALUE.format(row='NEW')}, coalesce({_ROLLUP_CONFIDENCE.format(row='NEW')}, 0),
+                {_ROLLUP_CONFIDENCE.format(row='NEW')} IS NOT NULL)
+        ON CONFLICT (month, crop, country) DO UPDATE SET
+            count = count + 1,
+            yield_sum = yield_sum + excluded.yield_sum,
+            yield_min = min(yield_min, excluded.yield_min),
+            yield_max = max(yield_max, excluded.yield_max),
+            confidence_sum = confidence_sum + excluded.confidence_sum,
+            confidence_count = confidence_count + excluded.confidence_count;
+    END
+'''
+
+
+def rebuild_rollups(conn, since=None):
+    """Recompute ``prediction_rollups`` from the predictions table (run inside a transaction)
+
+    Only months that still have rows in ``predictions`` (from ``since``, a
+    ``YYYY-MM`` month, when given) are replaced, so months moved out by
+    retention.py keep their totals. A month split by the archive cutoff is
+    recomputed from its remaining rows alone; pass the month after it as
+    ``since`` to leave it untouched.
+    """
+    since = since or ''
+    conn.execute('''
+        DELETE FROM prediction_rollups
+        WHERE month >= ? AND month IN (SELECT DISTINCT substr(timestamp, 1, 7) FROM predictions)
+    ''', (since,))
+    conn.execute(f'''
+        INSERT INTO prediction_rollups
+        SELECT substr(timestamp, 1, 7), coalesce(crop, ''), coalesce(country, ''), count(*),
+               sum(value), min(value), max(value), coalesce(sum(confidence), 0), count(confidence)
+        FROM (SELECT timestamp, crop, country, {_ROLLUP_VALUE.format(row='predictions')} AS value,
+                     {_ROLLUP_CONFIDENCE.format(row='predictions')} AS confidence
+              FROM predictions)
+        WHERE value IS NOT NULL AND substr(timestamp, 1, 7) >= ?
+        GROUP BY 1, 2, 3
+    ''', (since,))
+
+
+def _migrate_rollups(conn):
+    """v3: monthly per-crop/country rollups, kept current by an insert trigger"""
+    conn.execute(ROLLUP_SCHEMA)
+    conn.execute(ROLLUP_TRIGGER)
+    rebuild_rollups(conn)
+
+
+def _migrate_time_index(conn):
+    """v4: index for finding the oldest rows to archive"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_predictions_time ON predictions (timestamp, id)')
+
+
+def _migrate_strict_json(conn):
+    """v5: stored JSON made strict (NaN/Infinity as null), so /history can splice it as-is"""
+    conn.create_function('strict_json', 1, strict_json, deterministic=True)
+    rewritten = {}
+    for column in ('input_data', 'prediction_result', 'location_data'):
+        rewritten[column] = conn.execute(f'''
+            UPDATE predictions SET {column} = strict_json({column})
+            WHERE {column} = '' OR {column} GLOB '*NaN*' OR {column} GLOB '*Infinity*'
+        ''').rowcount
+    if rewritten['prediction_result']:
+        # Rows whose prediction_result was invalid JSON were left out of the rollups
+        rebuild_rollups(conn)
+
+
+# (schema version, migration) pairs, each applied in its own transaction
+MIGRATIONS = [
+    (1, _migrate_extracted_columns),
+    (2, _migrate_model_version),
+    (3, _migrate_rollups),
+    (4, _migrate_time_index),
+    (5, _migrate_strict_json),
+]
+
+
+def migrate(conn):
+    """Bring the schema up to the latest version; safe to run from many processes"""
+    for version, migration in MIGRATIONS:
+        if conn.execute('PRAGMA user_version').fetchone()[0] >= version:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Another process may have migrated while we waited for the lock
+            if conn.execute('PRAGMA user_version').fetchone()[0] < version:
+                migration(conn)
+                conn.execute(f'PRAGMA user_version={version}')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+
+def encode_cursor(timestamp, row_id):
+    """Opaque keyset cursor for the row a history page ended on"""
+    return base64.urlsafe_b64encode(f'{timestamp}|{row_id}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Inverse of ``encode_cursor``; raises ValueError for malformed cursors"""
+    try:
+        timestamp, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+        return timestamp, int(row_id)
+    except Exception:
+        raise ValueError('Invalid cursor') from None
+
+
+def connect(path, busy_timeout=5.0):
+    """Open a connection in autocommit mode with the standard pragmas applied"""
+    conn = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None,
+                           check_same_thread=False)
+    conn.execute(f'PRAGMA busy_timeout={int(busy_timeout * 1000)}')
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections, each used by one thread at a time"""
+
+    def __init__(self, path, size=8, busy_timeout=5.0):
+        self.path = path
+        self.size = size
+        self.busy_timeout = busy_timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self._idle.put(conn)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return connect(self.path, self.busy_timeout)
+        return self._idle.get(timeout=self.busy_timeout)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class GroupCommitWriter:
+    """Single writer thread that commits queued inserts in batches
+
+    Each ``submit()`` returns a Future resolved with the row id once the
+    transaction holding it has committed. The writer never waits for a batch
+    to fill: whatever queued up during the previous commit goes into the
+    next one, optionally lingering ``max_wait`` seconds for stragglers.
+    """
+
+    _STOP = object()
+
+    def __init__(self, path, batch_size=128, max_wait=0.0, busy_timeout=5.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.busy_timeout = busy_timeout
+        self.batches = 0
+        self.rows = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='prediction-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, sql, params):
+        future = Future()
+        self._queue.put((sql, params, future))
+        return future
+
+    def close(self, timeout=5.0):
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        conn = connect(self.path, self.busy_timeout)
+        try:
+            while True:
+                item = self._queue.get()
+                if item is self._STOP:
+                    return
+                batch = [item]
+                stop = self._fill(batch)
+                self._commit(conn, batch)
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _fill(self, batch):
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                return False
+            if item is self._STOP:
+                return True
+            batch.append(item)
+        return False
+
+    def _commit(self, conn, batch):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            ids = [conn.execute(sql, params).lastrowid for sql, params, _ in batch]
+            conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            if len(batch) == 1:
+                batch[0][2].set_exception(e)
+                return
+            # Retry one by one so a single bad row does not fail its neighbours
+            for item in batch:
+                self._commit(conn, [item])
+            return
+
+        self.batches += 1
+        self.rows += len(batch)
+        for (_, _, future), row_id in zip(batch, ids):
+            future.set_result(row_id)
+
+
+class PredictionDatabase:
+    """Pooled readers plus a group-commit writer for the predictions table
+
+    Pool and writer are created lazily and re-created after ``fork()``, so
+    a database object built before a prefork server starts its workers is
+    safe to use in every worker.
+    """
+
+    def __init__(self, path='predictions.db', pool_size=8, write_batch_size=128,
+                 write_max_wait=0.0, busy_timeout=5.0, write_timeout=10.0):
+        self.path = path
+        self.pool_size = pool_size
+        self.write_batch_size = write_batch_size
+        self.write_max_wait = write_max_wait
+        self.busy_timeout = busy_timeout
+        self.write_timeout = write_timeout
+        self._pid = None
+        self._pool = None
+        self._writer = None
+        self._schema_ready = False
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _ensure(self):
+        if self._pid == os.getpid() and self._pool is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._pool is not None:
+                return
+            self._pid = os.getpid()
+            self._pool = ConnectionPool(self.path, self.pool_size, self.busy_timeout)
+            self._writer = None
+            if not self._schema_ready:
+                with self._pool.connection() as conn:
+                    self._create_schema(conn)
+                self._schema_ready = True
+
+    def _create_schema(self, conn):
+        conn.execute(SCHEMA)
+        migrate(conn)
+
+    def init_schema(self):
+        self._ensure()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection (autocommit mode)"""
+        self._ensure()
+        with self._pool.connection() as conn:
+            yield conn
+
+    def _get_writer(self):
+        self._ensure()
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = GroupCommitWriter(self.path, self.write_batch_size,
+                                                     self.write_max_wait, self.busy_timeout)
+        return self._writer
+
+    def save_prediction(self, input_data, prediction, location, user_id, model_version=None):
+        """Queue one prediction, made by ``model_version``, and return its id once committed"""
+        crop, country = extract_fields(input_data)
+        future = self._get_writer().submit('''
+            INSERT INTO predictions
+            (input_data, prediction_result, location_data, user_id, crop, country, model_version)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (to_json(input_data), to_json(prediction), to_json(location), user_id, crop, country,
+              model_version))
+        with stage('db_write'):
+            return future.result(timeout=self.write_timeout)
+
+    def save_many(self, records):
+        """Insert ``(input_data, prediction, location, user_id, model_version)`` records in one transaction
+
+        Used for bulk loads, which would only queue behind each other in the
+        group-commit writer. Returns the number of rows inserted.
+        """
+        params = []
+        for input_data, prediction, location, user_id, model_version in records:
+            crop, country = extract_fields(input_data)
+            params.append((to_json(input_data), to_json(prediction), to_json(location),
+                           user_id, crop, country, model_version))
+        with stage('db_write'), self.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany('''
+                INSERT INTO predictions
+                (input_data, prediction_result, location_data, user_id, crop, country, model_version)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', params)
+            conn.execute('COMMIT')
+        return len(params)
+
+    def fetch_history(self, user_id, limit, cursor=None, crop=None, country=None,
+                      since=None, until=None):
+        """One page of a user's history, newest first, plus the cursor for the next page
+
+        Pages are keyset-paginated on ``(timestamp, id)`` so every page is an
+        index range scan, however deep the client has scrolled.
+        """
+        clauses = ['user_id = ?']
+        params = [user_id]
+        if cursor:
+            timestamp, row_id = decode_cursor(cursor)
+            clauses.append('(timestamp, id) < (?, ?)')
+            params.extend([timestamp, row_id])
+        if crop:
+            clauses.append('crop = ?')
+            params.append(crop)
+        if country:
+            clauses.append('country = ?')
+            params.append(country)
+        if since:
+            clauses.append('timestamp >= ?')
+            params.append(since)
+        if until:
+            clauses.append('timestamp <= ?')
+            params.append(until)
+        params.append(limit + 1)
+
+        with stage('db_read'), self.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT id, timestamp, input_data, prediction_result, location_data
+                FROM predictions
+                WHERE {' AND '.join(clauses)}
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?
+            ''', params).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+        return rows, next_cursor
+
+    def fetch_trends(self, group_by=('crop',), crop=None, country=None, since=None, until=None):
+        """Monthly prediction aggregates from the rollup table
+
+        ``group_by`` is a subset of ``("crop", "country")``; ``since``/``until``
+        are ``YYYY-MM`` months (inclusive). Rows are dicts ordered by month.
+        """
+        keys = [key for key in ('crop', 'country') if key in group_by]
+        clauses = []
+        params = []
+        for column, value in (('crop', crop), ('country', country)):
+            if value:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        if since:
+            clauses.append('month >= ?')
+            params.append(since)
+        if until:
+            clauses.append('month <= ?')
+            params.append(until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        columns = ', '.join(['month'] + keys)
+
+        with stage('db_read'), self.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT {columns}, sum(count), sum(yield_sum), min(yield_min), max(yield_max),
+                       sum(confidence_sum), sum(confidence_count)
+                FROM prediction_rollups
+                {where}
+                GROUP BY {columns}
+                ORDER BY {columns}
+            ''', params).fetchall()
+
+        trends = []
+        for row in rows:
+            count, total, low, high, confidence_sum, confidence_count = row[-6:]
+            trend = dict(zip(['month'] + keys, (value or None for value in row[:-6])))
+            trend.update({
+                'count': count,
+                'avg_yield': total / count,
+                'min_yield': low,
+                'max_yield': high,
+                'avg_confidence': confidence_sum / confidence_count if confidence_count else None
+            })
+            trends.append(trend)
+        return trends
+
+    def fetch_archivable(self, cutoff, limit):
+        """Up to ``limit`` of the oldest rows saved before ``cutoff``, as dicts of every column"""
+        with stage('db_read'), self.connection() as conn:
+            cursor = conn.execute('''
+                SELECT id, timestamp, input_data, prediction_result, location_data, user_id,
+                       crop, country, model_version
+                FROM predictions
+                WHERE timestamp < ?
+                ORDER BY timestamp, id
+                LIMIT ?
+            ''', (cutoff, limit))
+            names = [column[0] for column in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def delete_ids(self, ids):
+        """Delete rows by id in one short write transaction; returns the number deleted"""
+        deleted = 0
+        with stage('db_write'), self.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Stay below SQLite's bound-parameter limit
+                for start in range(0, len(ids), 500):
+                    chunk = ids[start:start + 500]
+                    deleted += conn.execute(
+                        f"DELETE FROM predictions WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                    ).rowcount
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return deleted
+
+    def incremental_vacuum(self, pages_per_step=1000):
+        """Return free pages to the filesystem a step at a time; returns pages freed
+
+        Each step holds the write lock only briefly. Does nothing unless the
+        database uses ``auto_vacuum=INCREMENTAL`` (the default for databases
+        created by this module; see ``retention.py --enable-incremental-vacuum``).
+        """
+        freed = 0
+        with self.connection() as conn:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                return 0
+            while True:
+                free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                if free == 0:
+                    return freed
+                conn.execute(f'PRAGMA incremental_vacuum({min(free, pages_per_step)})').fetchall()
+                remaining = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                if remaining >= free:
+                    return freed
+                freed += free - remaining
+
+    def rebuild_rollups(self, since=None):
+        """Recompute the rollups of months with live rows, e.g. after editing rows by hand
+
+        Archived months are kept; see ``rebuild_rollups()`` for the month the
+        archive cutoff splits.
+        """
+        with self.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                rebuild_rollups(conn, since)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def stats(self):
+        writer = self._writer
+        return {
+            'path': self.path,
+            'pool_size': self.pool_size,
+            'write_batches': writer.batches if writer else 0,
+            'write_rows': writer.rows if writer else 0
+        }
+
+    def close(self):
+        if self._pid != os.getpid():
+            return
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
@@ -0,0 +1,397 @@
+"""Streaming drift monitor for the model inputs and the predicted yield
+
+    python drift.py reference yield_df.csv            # writes DRIFT_REFERENCE_PATH
+
+``DriftMonitor`` counts every scored row into a fixed histogram per
+feature: the four numeric inputs, country, crop item and the predicted
+yield. Memory does not grow with traffic and an observation is a handful of
+``bisect`` calls under a lock (``sample_rate`` thins it further). Counts are
+kept for the current and the previous window of ``window`` rows;
+``report()`` compares both together with a reference distribution using the
+population stability index (PSI: below 0.1 stable, above 0.25 a significant
+shift) and estimates quantiles from the same bins.
+
+The reference for each feature comes from, in order:
+
+* the file written by ``python drift.py reference`` from the training CSV
+  (quantile bins and proportions of every input)
+* the loaded model: the tree's leaf values weighted by their training
+  sample counts are the training distribution of the predicted yield, and
+  the fitted scaler's training mean and std place the numeric inputs' bins
+  at normal quantiles, each bin holding ``1 / NUMERIC_BINS`` of the training
+  rows under that approximation (``scaler_normal``; coarse for skewed or
+  whole-number inputs such as pesticides and year). The mean and std also
+  give ``mean_shift`` in training standard deviations
+* for anything still without proportions (country and crop item when there
+  is no reference file), the first full window of traffic (``live_traffic``,
+  listed under ``live_baselines`` in the report: drift that was already
+  present at startup is not flagged for those)
+
+A new model resets the monitor. Every worker process monitors its own traffic.
+"""
+import argparse
+import bisect
+import json
+import math
+import os
+import random
+import sys
+import threading
+from statistics import NormalDist
+
+import numpy as np
+
+from inference import FEATURE_NAMES, NUMERIC_FEATURES, model_categories, validate_row
+
+try:
+    from config import DRIFT_REFERENCE_PATH
+except ImportError:
+    DRIFT_REFERENCE_PATH = "drift_reference.json"
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PREDICTION = 'prediction'
+FEATURES = FEATURE_NAMES + [PREDICTION]
+NUMERIC_BINS = 20  # Bins per numeric feature and for the prediction
+PSI_WARN = 0.1
+PSI_ALERT = 0.25
+MIN_COUNT = 100  # Rows needed before a feature is scored
+STATUSES = ('ok', 'warn', 'drift')
+_EPSILON = 1e-4  # Floor for empty bins in the PSI
+
+
+def _local(path):
+    """Resolve a configured relative path against the backend directory"""
+    return path if os.path.isabs(path) or os.path.exists(path) else os.path.join(BASE_DIR, path)
+
+
+class FeatureProfile:
+    """Bins of one feature and, once known, their reference proportions
+
+    Numeric features have sorted ``edges`` (``len(edges) + 1`` bins);
+    categorical ones have ``categories`` plus a last bin for anything else.
+    """
+
+    def __init__(self, name, edges=None, categories=None, proportions=None, mean=None, std=None,
+                 source=None):
+        self.name = name
+        self.edges = [float(edge) for edge in edges] if edges is not None else None
+        self.labels = list(categories) if categories is not None else None
+        self.categories = {category: i for i, category in enumerate(self.labels or ())}
+        self.proportions = [float(p) for p in proportions] if proportions is not None else None
+        self.mean = mean
+        self.std = std
+        self.source = source if proportions is not None else None
+
+    @property
+    def size(self):
+        return len(self.edges) + 1 if self.edges is not None else len(self.labels) + 1
+
+    def bin(self, value):
+        if self.edges is not None:
+            return bisect.bisect_right(self.edges, value)
+        return self.categories.get(value, len(self.labels))
+
+    @classmethod
+    def from_dict(cls, name, data, source):
+        return cls(name, data.get('edges'), data.get('categories'), data.get('proportions'),
+                   data.get('mean'), data.get('std'), source)
+
+    def to_dict(self):
+        data = {'edges': self.edges} if self.edges is not None else {'categories': self.labels}
+        data.update({'proportions': self.proportions, 'mean': self.mean, 'std': self.std})
+        return data
+
+
+def numeric_profile(name, values, weights=None, source='training_data'):
+    """Quantile bins and proportions of a sample (optionally weighted)"""
+    values = np.asarray(values, dtype=np.float64)
+    weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=np.float64)
+    order = np.argsort(values, kind='stable')
+    values, weights = values[order], weights[order]
+    total = weights.sum()
+    cumulative = np.cumsum(weights) / total
+    cuts = np.searchsorted(cumulative, np.arange(1, NUMERIC_BINS) / NUMERIC_BINS)
+    edges = np.unique(values[np.minimum(cuts, len(values) - 1)])
+    bins = np.searchsorted(edges, values, side='right')
+    proportions = np.bincount(bins, weights=weights, minlength=len(edges) + 1) / total
+    mean = float(np.dot(values, weights) / total)
+    std = float(math.sqrt(np.dot((values - mean) ** 2, weights) / total))
+    return FeatureProfile(name, edges.tolist(), proportions=proportions.tolist(), mean=mean, std=std,
+                          source=source)
+
+
+def scaler_stats(models):
+    """{input column: (training mean, training std)} from the fitted scaler"""
+    if models.encoder is not None:
+        return models.encoder.numeric_stats()
+    for _, transformer, columns in models.preprocessor.transformers_:
+        if hasattr(transformer, 'mean_') and hasattr(transformer, 'scale_'):
+            return {col: (float(mean), float(scale))
+                    for col, mean, scale in zip(columns, transformer.mean_, transformer.scale_)}
+    return {}
+
+
+def model_profile(models):
+    """Profiles of every feature derivable from a ``LoadedModels`` snapshot alone"""
+    stats = scaler_stats(models)
+    normal = NormalDist()
+    cuts = [normal.inv_cdf(k / NUMERIC_BINS) for k in range(1, NUMERIC_BINS)]
+    profiles = {}
+    for col, name in enumerate(NUMERIC_FEATURES):
+        mean, std = stats.get(col, (None, None))
+        if mean is None:
+            profiles[name] = FeatureProfile(name, [])
+            continue
+        profiles[name] = FeatureProfile(name, [mean + std * z for z in cuts],
+                                        proportions=[1.0 / NUMERIC_BINS] * NUMERIC_BINS,
+                                        mean=mean, std=std, source='scaler_normal')
+
+    countries, items = model_categories(models)
+    profiles['country'] = FeatureProfile('country', categories=sorted(countries or ()))
+    profiles['item'] = FeatureProfile('item', categories=sorted(items or ()))
+
+    if models.node_values is not None and models.leaf_samples is not None:
+        samples = np.asarray(models.leaf_samples)
+        leaves = samples > 0
+        profiles[PREDICTION] = numeric_profile(PREDICTION, np.asarray(models.node_values)[leaves],
+                                               samples[leaves], source='model')
+    else:
+        profiles[PREDICTION] = FeatureProfile(PREDICTION, [])
+    return profiles
+
+
+def build_profile(models, reference_path=None):
+    """Profiles in ``FEATURES`` order: the model's, overridden by the reference file"""
+    profiles = model_profile(models)
+    if reference_path and os.path.exists(reference_path):
+        try:
+            with open(reference_path, 'r', encoding='utf-8') as f:
+                reference = json.load(f)
+            for name, data in reference['features'].items():
+                if name in profiles:
+                    profiles[name] = FeatureProfile.from_dict(name, data, 'training_data')
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"⚠️  Drift reference {reference_path} ignored: {e}")
+    return [profiles[name] for name in FEATURES]
+
+
+def population_stability_index(expected, counts):
+    """PSI between reference proportions and observed bin counts"""
+    total = sum(counts)
+    psi = 0.0
+    for p, count in zip(expected, counts):
+        p = max(p, _EPSILON)
+        q = max(count / total, _EPSILON)
+        psi += (q - p) * math.log(q / p)
+    return psi
+
+
+def histogram_quantile(edges, counts, low, high, q):
+    """Quantile ``q`` interpolated linearly within the bin that holds it"""
+    target = q * sum(counts)
+    seen = 0
+    for i, count in enumerate(counts):
+        if count and seen + count >= target:
+            left = max(edges[i - 1], low) if i > 0 else low
+            right = min(edges[i], high) if i < len(edges) else high
+            return left + (right - left) * (target - seen) / count
+        seen += count
+    return high
+
+
+class _Window:
+    """Bin counts, sums and ranges of one window of rows"""
+
+    __slots__ = ('rows', 'counts', 'sums', 'low', 'high')
+
+    def __init__(self, profiles):
+        self.rows = 0
+        self.counts = [[0] * profile.size for profile in profiles]
+        self.sums = [0.0] * len(profiles)
+        self.low = [math.inf] * len(profiles)
+        self.high = [-math.inf] * len(profiles)
+
+
+class DriftMonitor:
+    """Histograms of recent traffic per feature, compared to a reference profile"""
+
+    def __init__(self, window=10000, sample_rate=1.0):
+        self.window = max(int(window), MIN_COUNT)
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        self.reset([])
+
+    def reset(self, profiles, model_version=None):
+        """Start over against ``profiles`` (from ``build_profile()``)"""
+        with self._lock:
+            self._profiles = profiles
+            self._numeric = [i for i, profile in enumerate(profiles) if profile.edges is not None]
+            self._current = _Window(profiles)
+            self._previous = None
+            self.model_version = model_version
+            self.observed = 0
+
+    def observe(self, row, prediction):
+        """Count one validated row and its predicted yield"""
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        with self._lock:
+            self._add(list(row) + [prediction])
+
+    def observe_many(self, rows, predictions):
+        """Count validated rows and their predictions under one lock acquisition"""
+        with self._lock:
+            for row, prediction in zip(rows, predictions):
+                if self.sample_rate >= 1.0 or random.random() < self.sample_rate:
+                    self._add(list(row) + [prediction])
+
+    def observe_columns(self, columns, predictions, limit):
+        """Count at most ``limit`` evenly spaced rows of column-wise input (six sequences)"""
+        n = len(predictions)
+        if not n or limit <= 0:
+            return
+        picked = np.arange(0, n, max(1, n // limit))[:limit]
+        values = [np.asarray(column)[picked].tolist() for column in columns]
+        self.observe_many(zip(*values), np.asarray(predictions)[picked].tolist())
+
+    def _add(self, values):
+        window = self._current
+        counts = window.counts
+        for i, profile in enumerate(self._profiles):
+            counts[i][profile.bin(values[i])] += 1
+        for i in self._numeric:
+            value = values[i]
+            window.sums[i] += value
+            if value < window.low[i]:
+                window.low[i] = value
+            if value > window.high[i]:
+                window.high[i] = value
+        window.rows += 1
+        self.observed += 1
+        if window.rows >= self.window:
+            self._rotate()
+
+    def _rotate(self):
+        full = self._current
+        for i, profile in enumerate(self._profiles):
+            if profile.proportions is None:
+                profile.proportions = [count / full.rows for count in full.counts[i]]
+                profile.source = 'live_traffic'
+        self._previous = full
+        self._current = _Window(self._profiles)
+
+    def report(self):
+        """PSI, status and summary statistics per feature for the last one to two windows"""
+        with self._lock:
+            windows = [w for w in (self._previous, self._current) if w is not None]
+            features = {}
+            for i, profile in enumerate(self._profiles):
+                counts = [sum(column) for column in zip(*(w.counts[i] for w in windows))]
+                features[profile.name] = self._feature_report(
+                    profile, counts, sum(w.sums[i] for w in windows),
+                    min(w.low[i] for w in windows), max(w.high[i] for w in windows))
+            rows = sum(w.rows for w in windows)
+            observed, version = self.observed, self.model_version
+
+        scores = [entry['psi'] for entry in features.values() if entry['psi'] is not None]
+        statuses = [entry['status'] for entry in features.values() if entry['status'] in STATUSES]
+        return {
+            'model_version': version,
+            'observed': observed,
+            'rows': rows,
+            'window': self.window,
+            'sample_rate': self.sample_rate,
+            'score': max(scores) if scores else None,
+            'status': max(statuses, key=STATUSES.index) if statuses else 'insufficient_data',
+            'thresholds': {'warn': PSI_WARN, 'drift': PSI_ALERT},
+            # Compared with early traffic, not training data: drift present at startup is not flagged
+            'live_baselines': [name for name, entry in features.items()
+                               if entry['reference'] in ('live_traffic', None)],
+            'features': features
+        }
+
+    def _feature_report(self, profile, counts, total, low, high):
+        n = sum(counts)
+        entry = {'count': n, 'reference': profile.source, 'psi': None}
+        if profile.proportions is None:
+            entry['status'] = 'awaiting_reference'
+        elif n < MIN_COUNT:
+            entry['status'] = 'insufficient_data'
+        else:
+            psi = population_stability_index(profile.proportions, counts)
+            entry['psi'] = round(psi, 4)
+            entry['status'] = 'drift' if psi >= PSI_ALERT else 'warn' if psi >= PSI_WARN else 'ok'
+
+        if profile.edges is not None:
+            mean = total / n if n else None
+            entry['mean'] = mean
+            entry['reference_mean'] = profile.mean
+            entry['mean_shift'] = ((mean - profile.mean) / profile.std
+                                   if n and profile.mean is not None and profile.std else None)
+            entry['quantiles'] = {f'p{int(q * 100)}': histogram_quantile(profile.edges, counts, low, high, q)
+                                  for q in (0.1, 0.5, 0.9)} if n else None
+        elif n and profile.proportions is not None:
+            # Categories whose share moved the most
+            labels = profile.labels + ['(other)']
+            shifts = sorted(range(len(counts)),
+                            key=lambda k: -abs(counts[k] / n - profile.proportions[k]))[:3]
+            entry['top_shifts'] = [{'category': labels[k], 'share': counts[k] / n,
+                                    'reference_share': profile.proportions[k]} for k in shifts]
+        return entry
+
+
+def training_reference(path, chunk_size=50000):
+    """Reference profiles of the six inputs from a training CSV; returns (profiles, rows, skipped)"""
+    from score import feature_positions, read_csv
+
+    numbers = [[] for _ in NUMERIC_FEATURES]
+    counters = [{}, {}]
+    rows = skipped = 0
+    for header, chunk in read_csv(path, chunk_size):
+        positions = feature_positions(header)
+        for raw in chunk:
+            normalized = None
+            if len(raw) > max(positions):
+                normalized, _ = validate_row([raw[p] for p in positions])
+            if normalized is None:
+                skipped += 1
+                continue
+            rows += 1
+            for column, value in zip(numbers, normalized[:4]):
+                column.append(value)
+            for counter, category in zip(counters, normalized[4:]):
+                counter[category] = counter.get(category, 0) + 1
+    if not rows:
+        raise ValueError(f'No valid rows in {path}')
+
+    profiles = {name: numeric_profile(name, values) for name, values in zip(NUMERIC_FEATURES, numbers)}
+    for name, counter in zip(FEATURE_NAMES[4:], counters):
+        categories = sorted(counter)
+        profiles[name] = FeatureProfile(name, categories=categories,
+                                        proportions=[counter[c] / rows for c in categories] + [0.0],
+                                        source='training_data')
+    return profiles, rows, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the drift reference profile from training data')
+    parser.add_argument('command', choices=['reference'])
+    parser.add_argument('input', help='Training CSV (API or training-data column names)')
+    parser.add_argument('-o', '--output', default=_local(DRIFT_REFERENCE_PATH))
+    args = parser.parse_args(argv)
+
+    try:
+        profiles, rows, skipped = training_reference(args.input)
+    except (OSError, ValueError) as e:
+        print(f'❌ {e}', file=sys.stderr)
+        return 1
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'source': os.path.basename(args.input), 'rows': rows,
+                   'features': {name: profile.to_dict() for name, profile in profiles.items()}}, f, indent=2)
+    print(f'✅ Wrote drift reference from {rows} rows to {args.output}'
+          + (f' ({skipped} invalid rows skipped)' if skipped else ''))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
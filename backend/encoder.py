@@ -0,0 +1,189 @@
+"""Fast-path replacement for ``preprocessor.transform`` on raw feature rows
+
+The pickled ColumnTransformer builds an object array, validates it and runs
+every sub-transformer for each call. ``FastEncoder`` reads the fitted scaler
+parameters and one-hot category maps once and writes rows straight into a
+dense float64 buffer that matches ``preprocessor.transform(rows).toarray()``
+exactly.
+"""
+import threading
+
+import numpy as np
+
+from inference import FEATURE_NAMES
+
+
+class UnknownCategoryError(ValueError):
+    """Raised for a country or crop the fitted encoder has never seen"""
+
+
+# Friendly names for the categorical input columns
+CATEGORY_LABELS = {4: 'country', 5: 'crop item'}
+
+
+class FastEncoder:
+    """Encode raw ``[year, rainfall, pesticides, avgTemp, country, item]`` rows"""
+
+    def __init__(self, preprocessor=None):
+        self._local = threading.local()
+        if preprocessor is None:
+            return
+        self.n_features_out = sum(
+            s.stop - s.start for s in preprocessor.output_indices_.values())
+        self._numeric = []      # (input column, output column, mean, scale)
+        self._passthrough = []  # (input column, output column)
+        self._categories = {}   # input column -> {category: output column or None}
+
+        for name, transformer, columns in preprocessor.transformers_:
+            if (isinstance(transformer, str) and transformer == 'drop') or not len(columns):
+                continue
+            offset = preprocessor.output_indices_[name].start
+            if isinstance(transformer, str) and transformer == 'passthrough':
+                self._passthrough.extend((col, offset + i) for i, col in enumerate(columns))
+            elif hasattr(transformer, 'scale_') and hasattr(transformer, 'mean_'):
+                self._add_scaler(transformer, columns, offset)
+            elif hasattr(transformer, 'categories_'):
+                self._add_one_hot(transformer, columns, offset)
+            else:
+                raise ValueError(f'Unsupported transformer {name!r} for the fast encoder')
+
+    @classmethod
+    def from_state(cls, state):
+        """Rebuild an encoder from ``to_state()`` output without scikit-learn"""
+        encoder = cls()
+        encoder.n_features_out = state['n_features_out']
+        encoder._numeric = [tuple(entry) for entry in state['numeric']]
+        encoder._passthrough = [tuple(entry) for entry in state['passthrough']]
+        encoder._categories = {int(col): dict(mapping) for col, mapping in state['categories']}
+        return encoder
+
+    def to_state(self):
+        """Plain-Python parameters, enough to encode without the pickled preprocessor"""
+        return {
+            'n_features_out': self.n_features_out,
+            'numeric': list(self._numeric),
+            'passthrough': list(self._passthrough),
+            'categories': [(col, dict(mapping)) for col, mapping in self._categories.items()]
+        }
+
+    def _add_scaler(self, scaler, columns, offset):
+        for i, col in enumerate(columns):
+            mean = float(scaler.mean_[i]) if scaler.with_mean else 0.0
+            scale = float(scaler.scale_[i]) if scaler.with_std else 1.0
+            self._numeric.append((col, offset + i, mean, scale))
+
+    def _add_one_hot(self, encoder, columns, offset):
+        if getattr(encoder, '_infrequent_enabled', False):
+            raise ValueError('Infrequent category grouping is not supported by the fast encoder')
+        drop_idx = encoder.drop_idx_
+        position = offset
+        for i, (col, categories) in enumerate(zip(columns, encoder.categories_)):
+            dropped = None if drop_idx is None else drop_idx[i]
+            mapping = {}
+            for k, category in enumerate(categories.tolist()):
+                if dropped is not None and k == dropped:
+                    mapping[category] = None
+                else:
+                    mapping[category] = position
+                    position += 1
+            self._categories[col] = mapping
+
+    def numeric_stats(self):
+        """{input column: (mean, scale)} of the fitted scaler"""
+        return {col: (mean, scale) for col, _, mean, scale in self._numeric}
+
+    def categories(self, column):
+        """Known categories for an input column (4 = country, 5 = item)"""
+        return set(self._categories.get(column, ()))
+
+    def _fill(self, out, row):
+        for col, target, mean, scale in self._numeric:
+            out[target] = (float(row[col]) - mean) / scale
+        for col, target in self._passthrough:
+            out[target] = float(row[col])
+        for col, mapping in self._categories.items():
+            value = row[col]
+            try:
+                target = mapping[value]
+            except (KeyError, TypeError):
+                label = CATEGORY_LABELS.get(col, FEATURE_NAMES[col])
+                raise UnknownCategoryError(f'Unknown {label}: {value}') from None
+            if target is not None:
+                out[target] = 1.0
+
+    def encode_one(self, row):
+        """Encode one row into this thread's reusable (1, n) buffer
+
+        The returned array is overwritten by the next call on the same
+        thread, so copy it if it has to outlive the prediction.
+        """
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            buffer = self._local.buffer = np.zeros((1, self.n_features_out), dtype=np.float64)
+        else:
+            buffer.fill(0.0)
+        self._fill(buffer[0], row)
+        return buffer
+
+    def encode(self, rows):
+        """Encode many rows into one freshly allocated (n, n_features_out) array"""
+        out = np.zeros((len(rows), self.n_features_out), dtype=np.float64)
+        for i, row in enumerate(rows):
+            self._fill(out[i], row)
+        return out
+
+    def encode_columns(self, columns):
+        """Encode six equal-length columns (numeric arrays, category sequences) at once"""
+        n = len(columns[0])
+        out = np.zeros((n, self.n_features_out), dtype=np.float64)
+        for col, target, mean, scale in self._numeric:
+            out[:, target] = (np.asarray(columns[col], dtype=np.float64) - mean) / scale
+        for col, target in self._passthrough:
+            out[:, target] = np.asarray(columns[col], dtype=np.float64)
+        for col, mapping in self._categories.items():
+            values, inverse = np.unique(np.asarray(columns[col], dtype=object), return_inverse=True)
+            targets = np.empty(len(values), dtype=np.intp)
+            for k, value in enumerate(values.tolist()):
+                try:
+                    target = mapping[value]
+                except (KeyError, TypeError):
+                    label = CATEGORY_LABELS.get(col, FEATURE_NAMES[col])
+                    raise UnknownCategoryError(f'Unknown {label}: {value}') from None
+                targets[k] = -1 if target is None else target
+            targets = targets[inverse.reshape(-1)]
+            hot = np.flatnonzero(targets >= 0)
+            out[hot, targets[hot]] = 1.0
+        return out
+
+
+def check_encoder(preprocessor, encoder, rows):
+    """Return the number of rows the encoder encodes differently from ``preprocessor``"""
+    expected = preprocessor.transform(rows)
+    expected = expected.toarray() if hasattr(expected, 'toarray') else np.asarray(expected)
+    actual = encoder.encode(rows)
+    mismatches = int(np.count_nonzero((actual != expected).any(axis=1)))
+    columns = [[row[col] for row in rows] for col in range(len(FEATURE_NAMES))]
+    mismatches += int(np.count_nonzero((encoder.encode_columns(columns) != expected).any(axis=1)))
+    for i in range(0, len(rows), max(1, len(rows) // 500)):
+        if not np.array_equal(encoder.encode_one(rows[i])[0], expected[i]):
+            mismatches += 1
+    return mismatches
+
+
+if __name__ == '__main__':
+    import pickle
+    import time
+    import warnings
+
+    from inference import domain_rows
+
+    warnings.filterwarnings('ignore')
+    with open('preprocesser.pkl', 'rb') as f:
+        preprocessor = pickle.load(f)
+
+    encoder = FastEncoder(preprocessor)
+    rows = domain_rows(preprocessor)
+    start = time.perf_counter()
+    mismatches = check_encoder(preprocessor, encoder, rows)
+    status = '✅' if mismatches == 0 else '❌'
+    print(f'{status} {len(rows)} rows, {mismatches} mismatches ({time.perf_counter() - start:.2f}s)')
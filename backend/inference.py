@@ -0,0 +1,175 @@
+"""Vectorized validation, preprocessing and inference shared by the prediction endpoints"""
+import csv
+import io
+import math
+
+import numpy as np
+
+from metrics import stage
+
+FEATURE_NAMES = ['year', 'rainfall', 'pesticides', 'avgTemp', 'country', 'item']
+NUMERIC_FEATURES = FEATURE_NAMES[:4]
+FEATURE_ERROR = 'Expected 6 features: [year, rainfall, pesticides, avgTemp, country, item]'
+
+
+class BatchFormatError(ValueError):
+    """Raised when a batch body cannot be parsed into rows at all"""
+
+
+def known_categories(preprocessor):
+    """Return the (countries, items) the fitted one-hot encoder accepts"""
+    for _, transformer, _ in preprocessor.transformers_:
+        categories = getattr(transformer, 'categories_', None)
+        if categories is not None and len(categories) == 2:
+            return set(categories[0]), set(categories[1])
+    return None, None
+
+
+def model_categories(models):
+    """(countries, items) accepted by a ``LoadedModels`` snapshot"""
+    if models.encoder is not None:
+        return models.encoder.categories(4), models.encoder.categories(5)
+    return known_categories(models.preprocessor)
+
+
+def domain_rows(preprocessor, numeric_steps=5, spread=3.0):
+    """Raw rows covering every country/crop pair over the numeric range
+
+    Numeric features sweep ``mean +/- spread * std`` of the fitted scaler so
+    the grid spans the data the model was trained on.
+    """
+    scaler = next(t for _, t, _ in preprocessor.transformers_ if hasattr(t, 'mean_'))
+    countries, items = known_categories(preprocessor)
+    axes = [np.linspace(m - spread * s, m + spread * s, numeric_steps)
+            for m, s in zip(scaler.mean_, scaler.scale_)]
+    grid = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, len(axes))
+
+    return [list(numbers) + [country, item]
+            for country in sorted(countries)
+            for item in sorted(items)
+            for numbers in grid.tolist()]
+
+
+def validate_row(row, countries=None, items=None):
+    """Normalize one feature row, returning (row, None) or (None, error message)"""
+    if not isinstance(row, (list, tuple)) or len(row) != 6:
+        return None, FEATURE_ERROR
+
+    normalized = []
+    for name, value in zip(NUMERIC_FEATURES, row[:4]):
+        if isinstance(value, bool):
+            return None, f'{name} must be a number'
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            return None, f'{name} must be a number'
+        if not math.isfinite(number):
+            return None, f'{name} must be a finite number'
+        normalized.append(number)
+
+    country, item = row[4], row[5]
+    if not isinstance(country, str) or not country:
+        return None, 'country must be a non-empty string'
+    if not isinstance(item, str) or not item:
+        return None, 'item must be a non-empty string'
+    if countries is not None and country not in countries:
+        return None, f'Unknown country: {country}'
+    if items is not None and item not in items:
+        return None, f'Unknown crop item: {item}'
+    normalized.extend([country, item])
+
+    return normalized, None
+
+
+def predict_rows(models, rows, on_predicted=None):
+    """Validate and score many rows with one transform and one predict call
+
+    ``models`` is a ``model_store.LoadedModels`` snapshot. Returns a list
+    aligned with ``rows`` holding either a ``(prediction, confidence)``
+    pair or an error string for rows that failed validation.
+    ``on_predicted(valid_rows, predictions)`` is called once scoring is done.
+    """
+    countries, items = model_categories(models)
+    results = [None] * len(rows)
+    valid_rows = []
+    valid_index = []
+
+    with stage('validate'):
+        for i, row in enumerate(rows):
+            normalized, error = validate_row(row, countries, items)
+            if error:
+                results[i] = error
+            else:
+                valid_rows.append(normalized)
+                valid_index.append(i)
+
+    if valid_rows:
+        predictions, confidences = models.predict(models.encode_rows(valid_rows))
+        predictions = predictions.tolist()
+        for i, value, confidence in zip(valid_index, predictions, confidences.tolist()):
+            results[i] = (float(value), float(confidence))
+        if on_predicted is not None:
+            on_predicted(valid_rows, predictions)
+
+    return results
+
+
+def rows_from_json(data):
+    """Extract rows from a JSON batch body (row-wise ``rows`` or ``columns``)"""
+    if not isinstance(data, dict):
+        raise BatchFormatError('Expected a JSON object with "rows" or "columns"')
+
+    if 'rows' in data:
+        rows = data['rows']
+        if not isinstance(rows, list):
+            raise BatchFormatError('"rows" must be a list of feature rows')
+        return rows
+
+    if 'columns' in data:
+        columns = data['columns']
+        if not isinstance(columns, dict):
+            raise BatchFormatError('"columns" must be an object of feature lists')
+        missing = [name for name in FEATURE_NAMES if name not in columns]
+        if missing:
+            raise BatchFormatError(f'Missing columns: {", ".join(missing)}')
+        series = [columns[name] for name in FEATURE_NAMES]
+        if not all(isinstance(s, list) for s in series):
+            raise BatchFormatError('Every column must be a list')
+        if len({len(s) for s in series}) != 1:
+            raise BatchFormatError('All columns must have the same length')
+        return [list(row) for row in zip(*series)]
+
+    raise BatchFormatError('Expected a JSON object with "rows" or "columns"')
+
+
+def rows_from_csv(text):
+    """Extract rows from a CSV body, with or without a header line"""
+    reader = csv.reader(io.StringIO(text))
+    rows = [row for row in reader if row]
+    if not rows:
+        return []
+
+    order = list(range(6))
+    header = [cell.strip() for cell in rows[0]]
+    if header and header[0] and not _is_number(header[0]):
+        missing = [name for name in FEATURE_NAMES if name not in header]
+        if missing:
+            raise BatchFormatError(f'Missing CSV columns: {", ".join(missing)}')
+        order = [header.index(name) for name in FEATURE_NAMES]
+        rows = rows[1:]
+
+    parsed = []
+    for row in rows:
+        if max(order) >= len(row):
+            parsed.append(row)
+            continue
+        parsed.append([row[i].strip() for i in order])
+    return parsed
+
+
+def _is_number(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
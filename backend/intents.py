@@ -0,0 +1,176 @@
+"""Keyword-intent engine behind the chatbot's fallback answers
+
+Intents and their responses live in ``intents.json``, in priority order.
+Each intent lists keyword groups; it matches when the message contains at
+least one keyword (as a substring, case-insensitive) from every group, and
+the first matching intent wins. Messages matching nothing get ``default``,
+where ``{message}`` is replaced by the question.
+
+All keywords are compiled once into a single prefix-trie regex, so finding
+every keyword in a message is one scan whose cost depends on the message
+length, not on how many intents or keywords exist. Intents are indexed by
+the keywords of their first group, so only intents that can possibly match
+are checked.
+"""
+import json
+import os
+import re
+
+DEFAULT_INTENTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intents.json')
+
+_END = ''
+
+
+class Intent:
+    """One fallback answer and the keyword groups that select it"""
+
+    def __init__(self, name, keywords, response):
+        self.name = name
+        self.groups = [frozenset(word.lower() for word in group) for group in keywords]
+        self.response = '\n'.join(response) if isinstance(response, list) else response
+        if not self.groups or not all(self.groups):
+            raise ValueError(f'Intent {name!r} needs at least one non-empty keyword group')
+
+    def matches(self, found):
+        return all(not group.isdisjoint(found) for group in self.groups)
+
+
+def _trie_pattern(words):
+    """Regex matching the longest of ``words`` at a position, factored as a trie"""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[_END] = True
+
+    def build(node):
+        branches = [re.escape(ch) + build(child)
+                    for ch, child in sorted(node.items()) if ch != _END]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # Greedy optional: prefer the longer keyword when a shorter one also ends here
+        return f'(?:{body})?' if _END in node else body
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """Finds which of a fixed set of keywords occur anywhere in a text"""
+
+    def __init__(self, keywords):
+        keywords = sorted({word.lower() for word in keywords if word})
+        # Zero-width lookahead so overlapping keywords are all seen
+        self._regex = re.compile(f'(?=({_trie_pattern(keywords)}))') if keywords else None
+        # The regex reports the longest keyword starting at each position;
+        # every keyword contained in it is present too
+        known = set(keywords)
+        self._implied = {
+            word: frozenset(word[i:j] for i in range(len(word))
+                            for j in range(i + 1, len(word) + 1) if word[i:j] in known)
+            for word in keywords
+        }
+
+    def find(self, text):
+        """Set of keywords occurring in ``text`` (already lower-cased)"""
+        found = set()
+        if self._regex is None:
+            return found
+        for hit in self._regex.finditer(text):
+            word = hit.group(1)
+            if word not in found:
+                found.update(self._implied[word])
+        return found
+
+
+class IntentEngine:
+    """Picks the fallback answer for a chat message"""
+
+    def __init__(self, intents, default):
+        self.intents = list(intents)
+        self.default = '\n'.join(default) if isinstance(default, list) else default
+        self._by_keyword = {}
+        for index, intent in enumerate(self.intents):
+            for word in intent.groups[0]:
+                self._by_keyword.setdefault(word, []).append(index)
+        self.matcher = KeywordMatcher(
+            word for intent in self.intents for group in intent.groups for word in group)
+
+    @classmethod
+    def from_file(cls, path=None):
+        """Load intents from a JSON file (relative paths fall back to this directory)"""
+        path = path or DEFAULT_INTENTS_PATH
+        if not os.path.isabs(path) and not os.path.exists(path):
+            path = os.path.join(os.path.dirname(DEFAULT_INTENTS_PATH), path)
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        intents = [Intent(entry['name'], entry['keywords'], entry['response'])
+                   for entry in data['intents']]
+        return cls(intents, data['default'])
+
+    def match(self, message):
+        """First intent matching ``message``, or None"""
+        found = self.matcher.find(message.lower())
+        candidates = set()
+        for word in found:
+            candidates.update(self._by_keyword.get(word, ()))
+        for index in sorted(candidates):
+            if self.intents[index].matches(found):
+                return self.intents[index]
+        return None
+
+    def respond(self, message):
+        intent = self.match(message)
+        if intent is None:
+            return self.default.replace('{message}', message)
+        return intent.response
+
+
+if __name__ == '__main__':
+    import random
+    import string
+    import time
+
+    engine = IntentEngine.from_file()
+    messages = [
+        'When is the best time to plant wheat in Punjab?',
+        'How can I increase my maize production this season?',
+        'What fertilizer should I use for tomatoes grown in sandy soil?',
+        'My rice field has standing water after the monsoon, is that a problem?',
+        'Tell me about market costs for cotton next year',
+    ]
+    for message in messages:
+        intent = engine.match(message)
+        print(f'{intent.name if intent else "default":<18} {message}')
+
+    def naive_respond(intents, message):
+        # What the old if/elif chain did: substring scans per intent, per keyword
+        message_lower = message.lower()
+        for intent in intents:
+            if all(any(word in message_lower for word in group) for group in intent.groups):
+                return intent.response
+        return None
+
+    def per_message(fn, repeat=2000):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for message in messages:
+                fn(message)
+        return (time.perf_counter() - start) / (repeat * len(messages)) * 1e6
+
+    rng = random.Random(0)
+
+    def word():
+        return ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 10)))
+
+    print(f'\n{"intents":>8} {"keywords":>9} {"engine µs/msg":>14} {"if/elif µs/msg":>15}')
+    for count in (len(engine.intents), 100, 1000, 10000):
+        intents = list(engine.intents)
+        while len(intents) < count:
+            intents.append(Intent(f'synthetic_{len(intents)}',
+                                  [[word() for _ in range(3)], [word() for _ in range(4)]], 'x'))
+        scaled = IntentEngine(intents, engine.default)
+        keywords = sum(len(group) for intent in intents for group in intent.groups)
+        print(f'{count:>8} {keywords:>9} {per_message(scaled.respond):>14.1f} '
+              f'{per_message(lambda m: naive_respond(intents, m), 20):>15.1f}')
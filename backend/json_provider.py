@@ -0,0 +1,103 @@
+"""JSON encoding for Flask responses
+
+``FastJSONProvider`` uses orjson when it is installed: responses are
+encoded straight to bytes, and NumPy scalars and arrays (as returned by
+``model.predict``) are serialized natively instead of failing in the
+stdlib encoder. ``StdlibJSONProvider`` keeps Flask's encoder but also
+accepts NumPy values. Both follow Flask's ``sort_keys`` and ``compact``
+settings, so switching provider does not change the response shape.
+"""
+import importlib
+
+from flask.json.provider import DefaultJSONProvider, _default
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _numpy_default(o):
+    # np.generic and np.ndarray both have tolist(); anything else goes to Flask
+    if hasattr(o, 'tolist') and type(o).__module__ == 'numpy':
+        return o.tolist()
+    return _default(o)
+
+
+class StdlibJSONProvider(DefaultJSONProvider):
+    """Flask's default provider, extended to NumPy scalars and arrays"""
+
+    default = staticmethod(_numpy_default)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """orjson-backed provider; falls back to the stdlib for what orjson rejects"""
+
+    default = staticmethod(_numpy_default)
+
+    def _options(self, indent):
+        # Datetimes go through default() so they stay HTTP dates, as in Flask
+        options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps_bytes(self, obj, indent=False):
+        try:
+            return orjson.dumps(obj, default=self.default, option=self._options(indent))
+        except TypeError:
+            # e.g. integers beyond 64 bits
+            return super().dumps(obj, indent=2 if indent else None).encode()
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+        body = self.dumps_bytes(obj, indent) + b'\n'
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def json_fragment(text):
+    """Stored JSON text, ready to splice into a response as-is
+
+    Columns are written as strict JSON (see ``database.to_json``), so only
+    NULL or empty text needs replacing, with ``null``.
+    """
+    return text or 'null'
+
+
+PROVIDERS = {
+    'fast': FastJSONProvider,
+    'stdlib': StdlibJSONProvider,
+    'default': DefaultJSONProvider,
+}
+
+
+def make_json_provider(name, app):
+    """Instantiate a registered provider, or one given as ``module:Class``
+
+    ``"fast"`` needs orjson; without it the stdlib provider is used.
+    """
+    if name in PROVIDERS:
+        cls = PROVIDERS[name]
+    elif ':' in name:
+        module, attr = name.split(':', 1)
+        cls = getattr(importlib.import_module(module), attr)
+    else:
+        raise ValueError(f'Unknown JSON provider: {name}')
+    if cls is FastJSONProvider and orjson is None:
+        print("⚠️  orjson not installed (pip install orjson); using the stdlib JSON encoder")
+        cls = StdlibJSONProvider
+    return cls(app)
+
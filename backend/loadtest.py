@@ -0,0 +1,135 @@
+"""Load test: /predict throughput as the number of server workers grows
+
+    python loadtest.py                          # 1, 2 and 4 workers, 10 s each
+    python loadtest.py --workers 1 2 4 8 --concurrency 32 --duration 20
+
+For each worker count a fresh ``serve.py`` is started on ``--port``, and
+once ``/ready`` answers, ``--concurrency`` client processes send
+keep-alive ``/predict`` requests for ``--duration`` seconds. Rows are
+random (seeded) so most requests miss the prediction cache. Client
+processes share the machine with the server, so run it on a host with
+spare cores to see the server's own scaling.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+COUNTRIES = ['India', 'Brazil', 'Kenya', 'Mexico', 'Pakistan', 'Turkey', 'Japan', 'Australia']
+ITEMS = ['Maize', 'Potatoes', 'Rice, paddy', 'Wheat', 'Sorghum', 'Soybeans', 'Cassava']
+
+
+def payloads(seed, count=1000):
+    rng = random.Random(seed)
+    return [json.dumps({'features': [
+        rng.randint(1990, 2013), round(rng.uniform(50, 3000), 1), round(rng.uniform(0, 300000), 1),
+        round(rng.uniform(1, 35), 2), rng.choice(COUNTRIES), rng.choice(ITEMS)
+    ]}).encode() for _ in range(count)]
+
+
+def client(args):
+    """Send requests until the deadline; returns (latencies, errors)"""
+    host, port, deadline, seed = args
+    bodies = payloads(seed)
+    headers = {'Content-Type': 'application/json'}
+    latencies = []
+    errors = 0
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    i = 0
+    while time.time() < deadline:
+        start = time.perf_counter()
+        try:
+            conn.request('POST', '/predict', bodies[i % len(bodies)], headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+        i += 1
+    conn.close()
+    return latencies, errors
+
+
+def wait_ready(host, port, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=2)
+            conn.request('GET', '/ready')
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run(workers, host, port, concurrency, duration, threads):
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(BASE_DIR, 'serve.py'), '--host', host, '--port', str(port),
+         '--workers', str(workers), '--threads', str(threads)],
+        cwd=BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_ready(host, port):
+            raise RuntimeError(f'Server with {workers} workers did not become ready')
+        deadline = time.time() + duration
+        with multiprocessing.Pool(concurrency) as pool:
+            results = pool.map(client, [(host, port, deadline, seed) for seed in range(concurrency)])
+    finally:
+        server.terminate()
+        server.wait(30)
+
+    latencies = [value for values, _ in results for value in values]
+    return {
+        'workers': workers,
+        'requests': len(latencies),
+        'errors': sum(errors for _, errors in results),
+        'rps': len(latencies) / duration,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure /predict throughput per worker count')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, default=1, help='Threads per server worker')
+    parser.add_argument('--concurrency', type=int, default=16, help='Client processes')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per worker count')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5055)
+    args = parser.parse_args(argv)
+
+    print(f'{"workers":>8} {"requests":>9} {"errors":>7} {"req/s":>9} {"p50 ms":>8} '
+          f'{"p99 ms":>8} {"scaling":>8}')
+    baseline = None
+    for workers in args.workers:
+        result = run(workers, args.host, args.port, args.concurrency, args.duration, args.threads)
+        baseline = baseline or result['rps'] or None
+        scaling = result['rps'] / baseline if baseline else 0.0
+        print(f'{result["workers"]:>8} {result["requests"]:>9} {result["errors"]:>7} '
+              f'{result["rps"]:>9.0f} {result["p50_ms"]:>8.1f} {result["p99_ms"]:>8.1f} '
+              f'{scaling:>7.2f}x')
+
+
+if __name__ == '__main__':
+    main()
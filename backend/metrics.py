@@ -0,0 +1,270 @@
+"""Request and hot-path latency metrics in the Prometheus text format
+
+``registry`` is the process-wide ``Metrics`` instance. Code on the hot path
+times a stage with ``with stage('predict'): ...``; when metrics are
+disabled that is a shared no-op context manager, so the cost is one call.
+``init_app()`` adds per-endpoint request latency to a Flask app.
+
+Exported series:
+
+* ``cropcast_request_duration_seconds{endpoint,method}`` - histogram, time
+  until the view returns (a streamed body continues after that)
+* ``cropcast_requests_total{endpoint,method,status}`` - counter
+* ``cropcast_stage_duration_seconds{stage}`` - histogram for ``validate``,
+  ``transform``, ``predict``, ``db_read``, ``db_write``, ``llm`` (a whole
+  reply) and ``llm_stream`` (until the upstream stream starts)
+* ``cropcast_predict_batch_size`` and
+  ``cropcast_predict_batch_wait_seconds`` - histograms of micro-batched
+  ``/predict`` calls (rows per batch, time a row queued before its batch ran)
+
+Every worker process has its own counts. When ``directory`` is set, each
+process also writes a snapshot there every ``flush_interval`` seconds and
+``render()`` sums all snapshots, so any worker can answer a scrape for the
+whole server.
+"""
+import atexit
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Histograms that do not measure seconds
+BUCKETS = {
+    'cropcast_predict_batch_size': (1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+}
+
+HELP = {
+    'cropcast_request_duration_seconds': 'Time spent handling a request, by endpoint',
+    'cropcast_requests_total': 'Requests handled, by endpoint and status code',
+    'cropcast_stage_duration_seconds': 'Time spent in one stage of request handling',
+    'cropcast_predict_batch_size': 'Rows per micro-batched prediction',
+    'cropcast_predict_batch_wait_seconds': 'Time a row waited for its micro-batch to run',
+}
+
+_NULL = contextlib.nullcontext()
+
+
+class _Muted(threading.local):
+    active = False
+
+
+class _Timer:
+    __slots__ = ('metrics', 'name', 'labels', 'start')
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, self.labels, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """Histograms and counters keyed by ``(name, labels)``; labels are tuples of pairs"""
+
+    def __init__(self, enabled=True, buckets=DEFAULT_BUCKETS, directory=None, flush_interval=5.0):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._dirty = False
+        self._muted = _Muted()
+
+    def configure(self, enabled=True, directory=None, flush_interval=5.0):
+        self.enabled = enabled
+        self.directory = directory
+        self.flush_interval = flush_interval
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def stage(self, name):
+        """Context manager timing one stage; a no-op when disabled"""
+        if not self.enabled or self._muted.active:
+            return _NULL
+        return _Timer(self, 'cropcast_stage_duration_seconds', (('stage', name),))
+
+    @contextlib.contextmanager
+    def muted(self):
+        """Skip stage timing on the current thread only, e.g. for synthetic traffic"""
+        previous = self._muted.active
+        self._muted.active = True
+        try:
+            yield
+        finally:
+            self._muted.active = previous
+
+    def observe(self, name, labels, value):
+        buckets = BUCKETS.get(name, self.buckets)
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[(name, labels)] = [0] * (len(buckets) + 1) + [0.0]
+            histogram[bisect.bisect_left(buckets, value)] += 1
+            histogram[-1] += value
+            self._dirty = True
+        self._check_process()
+
+    def inc(self, name, labels, amount=1):
+        with self._lock:
+            self._counters[(name, labels)] = self._counters.get((name, labels), 0) + amount
+            self._dirty = True
+
+    def observe_request(self, endpoint, method, status, seconds):
+        labels = (('endpoint', endpoint), ('method', method))
+        self.observe('cropcast_request_duration_seconds', labels, seconds)
+        self.inc('cropcast_requests_total', labels + (('status', str(status)),))
+
+    def reset(self):
+        """Forget all counts, and remove other processes' snapshots"""
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._dirty = False
+        if self.directory and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.json'):
+                    os.remove(os.path.join(self.directory, name))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'histograms': [[name, labels, list(values)]
+                               for (name, labels), values in self._histograms.items()],
+                'counters': [[name, labels, value] for (name, labels), value in self._counters.items()]
+            }
+
+    # Snapshots shared between worker processes
+
+    def _check_process(self):
+        # A flusher thread per process, started lazily so forked workers get their own
+        if self.directory and self._pid != os.getpid():
+            with self._lock:
+                if self._pid == os.getpid():
+                    return
+                self._pid = os.getpid()
+            threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+            atexit.register(self.flush)
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.flush_interval)
+            if self._dirty:
+                self.flush()
+
+    def _snapshot_path(self, pid=None):
+        return os.path.join(self.directory, f'{pid or os.getpid()}.json')
+
+    def flush(self):
+        """Write this process's counts to ``directory`` (atomically)"""
+        if not self.directory:
+            return
+        self._dirty = False
+        path = self._snapshot_path()
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+
+    def _collect(self):
+        """Histograms and counters summed over every process's snapshot"""
+        snapshots = [self.snapshot()]
+        if self.directory and os.path.isdir(self.directory):
+            own = os.path.basename(self._snapshot_path())
+            for name in os.listdir(self.directory):
+                if not name.endswith('.json') or name == own:
+                    continue
+                try:
+                    with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+
+        histograms = {}
+        counters = {}
+        for snapshot in snapshots:
+            for name, labels, values in snapshot['histograms']:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                total = histograms.get(key)
+                histograms[key] = values if total is None else [a + b for a, b in zip(total, values)]
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                counters[key] = counters.get(key, 0) + value
+        return histograms, counters
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        histograms, counters = self._collect()
+        lines = []
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f'# HELP {name} {HELP.get(name, name)}')
+            lines.append(f'# TYPE {name} histogram')
+            bounds = tuple(BUCKETS.get(name, self.buckets)) + (float('inf'),)
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(bounds, values[:-1]):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", le),))} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {values[-1]}')
+                lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f'# HELP {name} {HELP.get(name, name)}')
+            lines.append(f'# TYPE {name} counter')
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+registry = Metrics()
+
+
+def stage(name):
+    """Time a stage on the process-wide registry"""
+    return registry.stage(name)
+
+
+def init_app(app, metrics=None):
+    """Record each request's latency and status on ``metrics`` (default: ``registry``)"""
+    from flask import g, request
+
+    metrics = metrics or registry
+
+    @app.before_request
+    def _start_request_timer():
+        if metrics.enabled:
+            g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop('_metrics_start', None)
+        if start is not None:
+            metrics.observe_request(request.endpoint or 'not_found', request.method,
+                                    response.status_code, time.perf_counter() - start)
+        return response
@@ -0,0 +1,147 @@
+"""Micro-batching of concurrent single-row predictions
+
+Each ``/predict`` call on its own pays the full encode and predict
+overhead for one row. ``MicroBatcher`` queues validated rows from
+concurrent requests and a single worker thread runs whatever has queued
+up as one vectorized ``encode_rows`` + ``predict``, lingering up to
+``max_wait`` seconds after the first row for more to arrive. Callers block
+on a Future for their own (prediction, confidence).
+
+Batch sizes and queue waits are recorded on the metrics registry
+(``cropcast_predict_batch_size``, ``cropcast_predict_batch_wait_seconds``)
+so ``max_batch_size`` and ``max_wait`` can be tuned against tail latency.
+With a single request thread per process nothing is ever concurrent, so
+batching only adds ``max_wait``; enable it with threaded workers.
+
+A caller whose row is not done within ``timeout`` seconds predicts it
+directly instead. An error in one batch fails only that batch's rows, and a
+worker thread that dies anyway is restarted by the next ``submit()``.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import metrics
+
+
+class MicroBatcher:
+    """Runs queued single-row predictions in batches on one worker thread
+
+    The worker is started on first use in each process, so a batcher
+    created before a prefork server forks its workers still works in them.
+    """
+
+    def __init__(self, max_batch_size=32, max_wait=0.002, registry=None, timeout=1.0):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.registry = registry or metrics.registry
+        self.timeout = timeout
+        self.batches = 0
+        self.rows = 0
+        self.timeouts = 0
+        self.failed_batches = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+
+    def submit(self, models, row):
+        """Queue one validated row; the Future resolves to (prediction, confidence)"""
+        future = Future()
+        self._get_queue().put((models, row, future, time.perf_counter()))
+        return future
+
+    def predict(self, models, row):
+        """(prediction, confidence) for one row, predicted directly if its batch takes too long"""
+        future = self.submit(models, row)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # Request threads time out concurrently; the other counters have one writer, the worker
+            with self._lock:
+                self.timeouts += 1
+            predictions, confidences = models.predict(models.encode_row(row))
+            return float(predictions[0]), float(confidences[0])
+
+    def _get_queue(self):
+        thread = self._thread
+        if self._pid != os.getpid() or thread is None or not thread.is_alive():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    self._thread = None
+                    self._pid = os.getpid()
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, args=(self._queue,),
+                                                    name='predict-batcher', daemon=True)
+                    self._thread.start()
+        return self._queue
+
+    def _run(self, pending):
+        while True:
+            batch = [pending.get()]
+            try:
+                self._fill(pending, batch)
+                self._record(batch)
+                # A reload can swap the models between requests; run each snapshot separately
+                groups = {}
+                for item in batch:
+                    groups.setdefault(id(item[0]), []).append(item)
+                for group in groups.values():
+                    self._predict(group)
+            except Exception as e:
+                # Keep the worker alive: fail what this batch left unresolved and carry on
+                self.failed_batches += 1
+                for item in batch:
+                    if not item[2].done():
+                        item[2].set_exception(e)
+
+    def _fill(self, pending, batch):
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(pending.get(timeout=remaining))
+                else:
+                    batch.append(pending.get_nowait())
+            except queue.Empty:
+                return
+
+    def _record(self, batch):
+        self.batches += 1
+        self.rows += len(batch)
+        if not self.registry.enabled:
+            return
+        now = time.perf_counter()
+        self.registry.observe('cropcast_predict_batch_size', (), len(batch))
+        for item in batch:
+            self.registry.observe('cropcast_predict_batch_wait_seconds', (), now - item[3])
+
+    def _predict(self, group):
+        models = group[0][0]
+        try:
+            predictions, confidences = models.predict(models.encode_rows([item[1] for item in group]))
+        except Exception as e:
+            if len(group) == 1:
+                group[0][2].set_exception(e)
+                return
+            # Retry one by one so a single bad row does not fail its neighbours
+            for item in group:
+                self._predict([item])
+            return
+        for item, prediction, confidence in zip(group, predictions.tolist(), confidences.tolist()):
+            item[2].set_result((float(prediction), float(confidence)))
+
+    def stats(self):
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'batches': self.batches,
+            'rows': self.rows,
+            'timeouts': self.timeouts,
+            'failed_batches': self.failed_batches,
+            'mean_batch_size': round(self.rows / self.batches, 2) if self.batches else 0.0
+        }
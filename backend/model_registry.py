@@ -0,0 +1,268 @@
+"""Versioned model/preprocessor pairs, checked by checksum
+
+A registry is a directory with one sub-directory per version::
+
+    models/
+        ACTIVE                  name of the version workers should serve
+        2024-06-01/
+            dtr.pkl
+            preprocesser.pkl
+            manifest.json       sha256 of both files, creation time
+            dtr.joblib          memory-mapped bundle, written on first use
+
+``ModelStore`` loads the version named in ``ACTIVE`` (or a pinned one),
+verifies both files against the manifest before unpickling anything, and
+runs ``self_test()`` on a new version before swapping it in. Writing a new
+``ACTIVE`` (``python model_registry.py activate <version>``) makes every
+worker process warm and swap to that version on its own.
+
+Without a registry, ``unversioned_source()`` names the loose
+``dtr.pkl``/``preprocesser.pkl`` pair after its checksum.
+"""
+import hashlib
+import json
+import os
+import random
+import shutil
+import time
+
+import numpy as np
+
+from metrics import registry as metrics_registry
+
+MODEL_FILE = 'dtr.pkl'
+PREPROCESSOR_FILE = 'preprocesser.pkl'
+ARRAYS_FILE = 'dtr.joblib'
+MANIFEST_FILE = 'manifest.json'
+ACTIVE_FILE = 'ACTIVE'
+
+
+class ModelRegistryError(Exception):
+    """Raised for an unknown version, a checksum mismatch or a failed self-test"""
+
+
+def file_checksum(path):
+    """sha256 hex digest of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def checksum_version(model_sha256):
+    """Version name for an unregistered model file"""
+    return f'sha256-{model_sha256[:12]}'
+
+
+class ModelSource:
+    """Where one model version's files are, and the checksums they must have"""
+
+    def __init__(self, version, model_path, preprocessor_path, arrays_path, checksums=None):
+        self.version = version
+        self.model_path = model_path
+        self.preprocessor_path = preprocessor_path
+        self.arrays_path = arrays_path
+        self.checksums = checksums or {}
+
+    def verify(self):
+        """Check the files against the expected checksums (files that are missing are skipped)"""
+        for key, path in (('model', self.model_path), ('preprocessor', self.preprocessor_path)):
+            expected = self.checksums.get(key)
+            if expected is None or not os.path.exists(path):
+                continue
+            actual = file_checksum(path)
+            if actual != expected:
+                raise ModelRegistryError(
+                    f'{os.path.basename(path)} of model version {self.version} does not match '
+                    f'its checksum (expected {expected[:12]}, found {actual[:12]})')
+
+
+def unversioned_source(model_path, preprocessor_path, arrays_path):
+    """A source for loose model files, versioned by the model file's checksum"""
+    checksums = {}
+    for key, path in (('model', model_path), ('preprocessor', preprocessor_path)):
+        if os.path.exists(path):
+            checksums[key] = file_checksum(path)
+    version = checksum_version(checksums['model']) if 'model' in checksums else None
+    return ModelSource(version, model_path, preprocessor_path, arrays_path, checksums)
+
+
+def _check_name(version):
+    if (not isinstance(version, str) or not version or version.startswith('.') or version == ACTIVE_FILE
+            or '/' in version or os.sep in version):
+        raise ModelRegistryError(f'Invalid model version name: {version!r}')
+
+
+class ModelRegistry:
+    """Versions stored under ``directory``; see the module docstring for the layout"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def manifest(self, version):
+        _check_name(version)
+        try:
+            with open(self._path(version, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise ModelRegistryError(f'Unknown model version: {version}') from None
+
+    def versions(self):
+        """Registered versions, oldest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        manifests = []
+        for name in os.listdir(self.directory):
+            if os.path.isfile(self._path(name, MANIFEST_FILE)):
+                manifests.append(self.manifest(name))
+        manifests.sort(key=lambda manifest: (manifest.get('created', 0), manifest['version']))
+        return [manifest['version'] for manifest in manifests]
+
+    def source(self, version):
+        manifest = self.manifest(version)
+        return ModelSource(version, self._path(version, MODEL_FILE),
+                           self._path(version, PREPROCESSOR_FILE), self._path(version, ARRAYS_FILE),
+                           {'model': manifest['model_sha256'],
+                            'preprocessor': manifest['preprocessor_sha256']})
+
+    def active(self):
+        """The version named in ``ACTIVE``, else the newest registered one (None if empty)"""
+        try:
+            with open(self._path(ACTIVE_FILE), 'r', encoding='utf-8') as f:
+                version = f.read().strip()
+            if version:
+                return version
+        except FileNotFoundError:
+            pass
+        versions = self.versions()
+        return versions[-1] if versions else None
+
+    def active_stamp(self):
+        """Changes whenever ``ACTIVE`` is rewritten; cheap enough to poll"""
+        try:
+            return os.stat(self._path(ACTIVE_FILE)).st_mtime_ns
+        except OSError:
+            return None
+
+    def set_active(self, version):
+        """Point ``ACTIVE`` at a registered version (atomically)"""
+        self.manifest(version)
+        path = self._path(ACTIVE_FILE)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(version + '\n')
+        os.replace(tmp, path)
+
+    def register(self, version, model_path, preprocessor_path):
+        """Copy a model/preprocessor pair in as ``version`` and write its manifest"""
+        _check_name(version)
+        target = self._path(version)
+        if os.path.exists(target):
+            raise ModelRegistryError(f'Model version already registered: {version}')
+        os.makedirs(target)
+        shutil.copyfile(model_path, os.path.join(target, MODEL_FILE))
+        shutil.copyfile(preprocessor_path, os.path.join(target, PREPROCESSOR_FILE))
+        manifest = {
+            'version': version,
+            'created': time.time(),
+            'model_sha256': file_checksum(os.path.join(target, MODEL_FILE)),
+            'preprocessor_sha256': file_checksum(os.path.join(target, PREPROCESSOR_FILE))
+        }
+        with open(os.path.join(target, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+    def describe(self):
+        active = self.active()
+        return [dict(self.manifest(version), active=version == active) for version in self.versions()]
+
+
+def sample_rows(models, count=256, seed=0):
+    """Random raw rows over every known country and crop, for self-tests"""
+    from inference import model_categories
+
+    countries, items = model_categories(models)
+    countries, items = sorted(countries), sorted(items)
+    rng = random.Random(seed)
+    return [[rng.randint(1990, 2013), round(rng.uniform(50, 3000), 1),
+             round(rng.uniform(0, 300000), 1), round(rng.uniform(1, 35), 2),
+             rng.choice(countries), rng.choice(items)] for _ in range(count)]
+
+
+def self_test(models, max_ms=None, rows=256, iterations=200):
+    """Check a freshly loaded ``LoadedModels`` before it serves traffic
+
+    Parity: the serving path (fast encoder, compiled tree) must reproduce
+    the pickled preprocessor + estimator on sample rows, when those are
+    loaded. Sanity: predictions and confidences are finite. Latency: the
+    median single-row encode + predict must be within ``max_ms``.
+    Returns a report; raises ``ModelRegistryError`` on failure.
+    """
+    # Synthetic rows must not reach the serving latency histograms; other threads keep timing
+    with metrics_registry.muted():
+        sample = sample_rows(models, rows)
+        predictions, confidences = models.predict(models.encode_rows(sample))
+        if len(predictions) != len(sample):
+            raise ModelRegistryError(f'Self-test: {len(predictions)} predictions for {len(sample)} rows')
+        if not (np.all(np.isfinite(predictions)) and np.all(np.isfinite(confidences))):
+            raise ModelRegistryError('Self-test: non-finite predictions or confidences')
+
+        mismatches = 0
+        if models.model is not None and models.preprocessor is not None:
+            expected = np.asarray(models.model.predict(models.preprocessor.transform(sample)),
+                                  dtype=np.float64).reshape(-1)
+            mismatches = int(np.count_nonzero(~np.isclose(predictions, expected, rtol=1e-9, atol=1e-9)))
+            if mismatches:
+                raise ModelRegistryError(f'Self-test: serving path disagrees with the model on '
+                                         f'{mismatches} of {len(sample)} rows')
+
+        timings = []
+        for i in range(iterations):
+            start = time.perf_counter()
+            models.predict(models.encode_row(sample[i % len(sample)]))
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        p50_ms = timings[len(timings) // 2] * 1000
+        if max_ms is not None and p50_ms > max_ms:
+            raise ModelRegistryError(f'Self-test: single-row latency {p50_ms:.2f}ms exceeds {max_ms}ms')
+        return {'rows': len(sample), 'parity_checked': models.model is not None,
+                'p50_ms': round(p50_ms, 4), 'p99_ms': round(timings[int(len(timings) * 0.99)] * 1000, 4)}
+
+
+if __name__ == '__main__':
+    import sys
+
+    usage = ('Usage: python model_registry.py list [dir]\n'
+             '       python model_registry.py register <version> <dtr.pkl> <preprocesser.pkl> [dir]\n'
+             '       python model_registry.py activate <version> [dir]')
+    try:
+        from config import MODEL_REGISTRY_DIR
+    except ImportError:
+        MODEL_REGISTRY_DIR = None
+    default_dir = MODEL_REGISTRY_DIR or 'models'
+    args = sys.argv[1:]
+    try:
+        if args[:1] == ['list'] and len(args) <= 2:
+            registry = ModelRegistry(args[1] if len(args) > 1 else default_dir)
+            for manifest in registry.describe():
+                flag = ' (active)' if manifest['active'] else ''
+                print(f"{manifest['version']}{flag}  model {manifest['model_sha256'][:12]}  "
+                      f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(manifest['created']))}")
+        elif args[:1] == ['register'] and len(args) in (4, 5):
+            registry = ModelRegistry(args[4] if len(args) > 4 else default_dir)
+            manifest = registry.register(args[1], args[2], args[3])
+            print(f"✅ Registered {manifest['version']} (model {manifest['model_sha256'][:12]})")
+        elif args[:1] == ['activate'] and len(args) in (2, 3):
+            registry = ModelRegistry(args[2] if len(args) > 2 else default_dir)
+            registry.set_active(args[1])
+            print(f'✅ {args[1]} is now active; running servers switch over within the check interval')
+        else:
+            print(usage)
+            sys.exit(2)
+    except (ModelRegistryError, OSError) as e:
+        print(f'❌ {e}')
+        sys.exit(1)
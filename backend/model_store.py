@@ -0,0 +1,400 @@
+"""Loading, lazy warm-up and readiness of the prediction model files
+
+``ModelStore`` owns the model, preprocessor and the fast-path objects built
+from them. Everything is published as one immutable ``LoadedModels`` snapshot,
+so a request always sees a consistent set even while a reload is running.
+Unpickling (and therefore importing scikit-learn) only happens when
+``load()`` runs: at import time, on first use, or in a warm-up thread.
+
+With a ``ModelRegistry`` the files come from a versioned directory: the
+store follows the registry's ``ACTIVE`` version, warming a new one in a
+background thread and swapping it in once it passes ``self_test()``, while
+requests keep using the previous snapshot.
+"""
+import os
+import pickle
+import threading
+import time
+
+import numpy as np
+
+from confidence import DEFAULT_CONFIDENCE, leaf_samples, tree_confidence
+from inference import domain_rows
+from metrics import stage
+from model_registry import ModelRegistryError, checksum_version, self_test, unversioned_source
+
+
+class LoadedModels:
+    """A consistent set of model objects; replaced as a whole, never mutated"""
+
+    def __init__(self, model, preprocessor, predictor, encoder, node_values=None, confidence=None,
+                 version=None, leaf_samples=None):
+        self.model = model                # fitted sklearn estimator, None when memory-mapped
+        self.preprocessor = preprocessor  # fitted ColumnTransformer
+        self.predictor = predictor        # predict() over transformed rows
+        self.encoder = encoder            # FastEncoder, or None to use the preprocessor
+        self.node_values = node_values    # prediction per tree node
+        self.confidence = confidence      # confidence (%) per tree node, or None
+        self.version = version            # model version these objects were loaded from
+        self.leaf_samples = leaf_samples  # training rows per leaf (0 for other nodes), or None
+
+    def predict(self, X):
+        """Predictions and confidences (%) for transformed rows
+
+        With per-node confidence available, one ``apply()`` finds the leaves
+        and both results are array lookups.
+        """
+        with stage('predict'):
+            if self.confidence is None:
+                predictions = np.asarray(self.predictor.predict(X), dtype=np.float64).reshape(-1)
+                return predictions, np.full(len(predictions), float(DEFAULT_CONFIDENCE))
+            leaves = self.predictor.apply(X)
+            return self.node_values[leaves], self.confidence[leaves]
+
+    def encode_row(self, row):
+        """Transform one validated row with the fast encoder or the preprocessor"""
+        with stage('transform'):
+            if self.encoder is not None:
+                return self.encoder.encode_one(row)
+            return self.preprocessor.transform([row])
+
+    def encode_rows(self, rows):
+        """Transform many validated rows with the fast encoder or the preprocessor"""
+        with stage('transform'):
+            if self.encoder is not None:
+                return self.encoder.encode(rows)
+            return self.preprocessor.transform(rows)
+
+    def encode_columns(self, columns):
+        """Transform column-wise input (six equal-length sequences)"""
+        with stage('transform'):
+            if self.encoder is not None:
+                return self.encoder.encode_columns(columns)
+            columns = [column.tolist() if hasattr(column, 'tolist') else list(column)
+                       for column in columns]
+            return self.preprocessor.transform([list(row) for row in zip(*columns)])
+
+
+class ModelStore:
+    """Loads model files according to the configured startup mode
+
+    ``startup_mode`` is ``"eager"`` (load in ``start()``), ``"lazy"`` (load
+    on the first ``get()``) or ``"background"`` (load in a warm-up thread
+    started by ``start()``; ``get()`` returns None until it finishes).
+    ``model_format`` is ``"pickle"`` for ``dtr.pkl`` or ``"mmap"`` for the
+    bundle written by ``export_bundle()``: flat tree arrays memory-mapped so
+    worker processes share the pages, plus the fast encoder parameters so
+    neither pickle (nor scikit-learn) has to be loaded at all.
+
+    With ``registry`` set, the three paths come from the registry version
+    ``version`` (None follows ``ACTIVE``, checked every ``check_interval``
+    seconds). A version replacing a loaded one must pass ``self_test()``
+    with a median single-row latency within ``self_test_max_ms``.
+    """
+
+    def __init__(self, model_path='dtr.pkl', preprocessor_path='preprocesser.pkl',
+                 arrays_path='dtr.joblib', startup_mode='eager', model_format='pickle',
+                 inference_engine='sklearn', feature_encoder='fast', on_load=None,
+                 confidence_min_samples=10, confidence_tolerance=0.2, registry=None,
+                 version=None, check_interval=5.0, self_test_max_ms=None):
+        self.model_path = model_path
+        self.preprocessor_path = preprocessor_path
+        self.arrays_path = arrays_path
+        self.startup_mode = startup_mode
+        self.model_format = model_format
+        self.inference_engine = inference_engine
+        self.feature_encoder = feature_encoder
+        self.on_load = on_load
+        self.confidence_params = [confidence_min_samples, confidence_tolerance]
+        self.registry = registry
+        self.version = version
+        self.check_interval = check_interval
+        self.self_test_max_ms = self_test_max_ms
+
+        self.current = None
+        self.error = None
+        self.load_seconds = None
+        self.self_test = None
+        self._active_stamp = None
+        self._checked = time.monotonic()
+        self._loading = False
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Apply the startup mode: load now, warm up in the background, or wait"""
+        if self.startup_mode == 'eager':
+            self.load()
+        elif self.startup_mode == 'background':
+            self.warm_up()
+
+    def warm_up(self, version=None):
+        """Load the models in a daemon thread unless already loading"""
+        if self._thread is not None and self._thread.is_alive():
+            return self._thread
+        self._thread = threading.Thread(target=self.load, args=(version,), name='model-warm-up',
+                                        daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def wait(self):
+        """Block until the models are loaded, loading them now if nothing else is"""
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+        return self.current or self.load()
+
+    def get(self):
+        """Return the current ``LoadedModels`` or None if not (yet) available"""
+        if self.registry is not None and time.monotonic() - self._checked >= self.check_interval:
+            self._check_active()
+        current = self.current
+        if current is None and self.startup_mode == 'lazy' and self.error is None:
+            with self._lock:
+                if self.current is None:
+                    self._load_locked()
+            current = self.current
+        return current
+
+    @property
+    def ready(self):
+        return self.current is not None
+
+    @property
+    def loading(self):
+        return self._loading
+
+    def load(self, version=None):
+        """(Re)load everything from disk and publish it atomically"""
+        with self._lock:
+            return self._load_locked(version)
+
+    def activate(self, version):
+        """Load and swap in a registry version now, and make it the registry's ``ACTIVE`` one"""
+        if self.registry is None:
+            raise ModelRegistryError('No model registry configured')
+        self.registry.manifest(version)
+        loaded = self.load(version)
+        if loaded is not None:
+            self.registry.set_active(version)
+            # Other workers follow ACTIVE; this one already serves it
+            self._active_stamp = self.registry.active_stamp()
+        return loaded
+
+    def _check_active(self):
+        """Warm up the registry's ``ACTIVE`` version if it changed since the last check"""
+        self._checked = time.monotonic()
+        if self.version is not None:
+            return
+        stamp = self.registry.active_stamp()
+        if stamp == self._active_stamp or self.loading:
+            return
+        self._active_stamp = stamp
+        current = self.current
+        if current is None or self.registry.active() != current.version:
+            self.warm_up()
+
+    def _source(self, version):
+        if self.registry is None:
+            if version is not None:
+                raise ModelRegistryError('No model registry configured')
+            return unversioned_source(self.model_path, self.preprocessor_path, self.arrays_path)
+        version = version or self.version
+        if version is None:
+            self._active_stamp = self.registry.active_stamp()
+            version = self.registry.active()
+        if version is None:
+            raise ModelRegistryError(f'No model versions registered in {self.registry.directory}')
+        return self.registry.source(version)
+
+    def _load_locked(self, version=None):
+        self._loading = True
+        start = time.perf_counter()
+        try:
+            source = self._source(version)
+            source.verify()
+            if self.model_format == 'mmap':
+                loaded = self._load_bundle(source)
+            else:
+                loaded = self._load_pickles(source)
+            if loaded is None:
+                self.error = 'Model or preprocessor not loaded'
+                return None
+
+            # A version replacing a serving one must also be fast enough
+            report = self_test(loaded, self.self_test_max_ms if self.current is not None else None)
+            self.current = loaded
+            self.error = None
+            self.self_test = report
+            self.load_seconds = round(time.perf_counter() - start, 3)
+            if self.on_load is not None:
+                self.on_load()
+            print(f"✅ Model {loaded.version} loaded in {self.load_seconds}s ({self.model_format})")
+            return loaded
+        except Exception as e:
+            self.error = f'Model load failed: {str(e)}'
+            if self.current is not None:
+                self.error += f' (still serving {self.current.version})'
+            print(f"❌ {self.error}")
+            return None
+        finally:
+            self._loading = False
+
+    def _unpickle(self, path):
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def _load_pickles(self, source):
+        preprocessor = self._unpickle(source.preprocessor_path)
+        model = self._unpickle(source.model_path)
+        if preprocessor is None or model is None:
+            return None
+        node_values, confidence = self._build_confidence(model)
+        return LoadedModels(model, preprocessor, self._build_predictor(model),
+                            self._build_encoder(preprocessor), node_values, confidence,
+                            source.version, leaf_samples(model) if node_values is not None else None)
+
+    def _load_bundle(self, source):
+        import joblib
+        from encoder import FastEncoder
+        from tree_engine import CompiledTree
+
+        bundle = None
+        if os.path.exists(source.arrays_path):
+            bundle = joblib.load(source.arrays_path, mmap_mode='r')
+        stale = bundle is not None and (
+            bundle.get('confidence_params') != self.confidence_params
+            or bundle.get('model_sha256') != source.checksums.get('model'))
+        if bundle is None or (stale and os.path.exists(source.model_path)):
+            model = self._unpickle(source.model_path)
+            preprocessor = self._unpickle(source.preprocessor_path)
+            if model is None or preprocessor is None:
+                return None
+            export_bundle(model, preprocessor, source.arrays_path, *self.confidence_params,
+                          model_sha256=source.checksums.get('model'))
+            print(f"🌳 Exported model bundle to {source.arrays_path}")
+            bundle = joblib.load(source.arrays_path, mmap_mode='r')
+
+        predictor = CompiledTree.from_state(bundle['tree'])
+        confidence = bundle.get('confidence')
+        samples = bundle.get('leaf_samples')
+        version = source.version
+        if version is None and bundle.get('model_sha256'):
+            version = checksum_version(bundle['model_sha256'])
+        if self.feature_encoder == 'fast':
+            return LoadedModels(None, None, predictor, FastEncoder.from_state(bundle['encoder']),
+                                predictor.value, confidence, version, samples)
+        preprocessor = self._unpickle(source.preprocessor_path)
+        if preprocessor is None:
+            return None
+        return LoadedModels(None, preprocessor, predictor, None, predictor.value, confidence, version,
+                            samples)
+
+    def _build_confidence(self, estimator):
+        """Per-node values and confidence, or (None, None) for non-tree models"""
+        try:
+            return (estimator.tree_.value[:, 0, 0].astype(np.float64),
+                    tree_confidence(estimator, *self.confidence_params))
+        except Exception as e:
+            print(f"⚠️  Model confidence unavailable, using {DEFAULT_CONFIDENCE}%: {e}")
+            return None, None
+
+    def _build_predictor(self, estimator):
+        """Pick the inference engine configured by ``inference_engine``"""
+        if estimator is None or self.inference_engine != 'compiled':
+            return estimator
+        from tree_engine import CompiledTree, check_parity, threshold_matrix
+
+        try:
+            compiled = CompiledTree(estimator)
+            mismatches = check_parity(estimator, compiled, threshold_matrix(compiled))
+        except Exception as e:
+            print(f"❌ Compiled inference engine unavailable: {e}")
+            return estimator
+        if mismatches:
+            print(f"⚠️  Compiled tree disagrees with the model on {mismatches} rows, using sklearn")
+            return estimator
+        print(f"🌳 Using compiled inference engine ({compiled.node_count} nodes)")
+        return compiled
+
+    def _build_encoder(self, preprocessor):
+        """Build the fast feature encoder configured by ``feature_encoder``"""
+        if self.feature_encoder != 'fast':
+            return None
+        from encoder import FastEncoder, check_encoder
+
+        try:
+            fast = FastEncoder(preprocessor)
+            mismatches = check_encoder(preprocessor, fast, domain_rows(preprocessor, 2))
+        except Exception as e:
+            print(f"❌ Fast feature encoder unavailable: {e}")
+            return None
+        if mismatches:
+            print(f"⚠️  Fast encoder disagrees with the preprocessor on {mismatches} rows, using sklearn")
+            return None
+        print(f"⚡ Using fast feature encoder ({fast.n_features_out} columns)")
+        return fast
+
+    def status(self):
+        current = self.current
+        return {
+            'ready': self.ready,
+            'loading': self.loading,
+            'startup_mode': self.startup_mode,
+            'model_format': self.model_format,
+            'model_version': current.version if current is not None else None,
+            'registry': self.registry.directory if self.registry is not None else None,
+            'load_seconds': self.load_seconds,
+            'self_test': self.self_test,
+            'error': self.error
+        }
+
+
+def export_bundle(model, preprocessor, path, confidence_min_samples=10, confidence_tolerance=0.2,
+                  model_sha256=None):
+    """Write the memory-mappable model bundle used by ``model_format="mmap"``
+
+    Both halves are checked against the pickled objects before writing. The
+    per-node confidence is stored with the parameters it was computed with,
+    and the model file's checksum so a bundle from another model is rebuilt.
+    """
+    import joblib
+    from encoder import FastEncoder, check_encoder
+    from tree_engine import CompiledTree, check_parity, threshold_matrix
+
+    compiled = CompiledTree(model)
+    if check_parity(model, compiled, threshold_matrix(compiled)):
+        raise ValueError('Compiled tree does not match the model')
+    encoder = FastEncoder(preprocessor)
+    if check_encoder(preprocessor, encoder, domain_rows(preprocessor, 2)):
+        raise ValueError('Fast encoder does not match the preprocessor')
+    # Uncompressed so joblib can memory-map the arrays on load
+    joblib.dump({
+        'tree': compiled.to_state(),
+        'encoder': encoder.to_state(),
+        'confidence': tree_confidence(model, confidence_min_samples, confidence_tolerance),
+        'confidence_params': [confidence_min_samples, confidence_tolerance],
+        'leaf_samples': leaf_samples(model),
+        'model_sha256': model_sha256
+    }, path)
+
+
+if __name__ == '__main__':
+    import sys
+    import warnings
+
+    from model_registry import file_checksum
+
+    warnings.filterwarnings('ignore')
+    if len(sys.argv) < 2 or sys.argv[1] != 'export':
+        print('Usage: python model_store.py export [dtr.joblib]')
+        sys.exit(2)
+    path = sys.argv[2] if len(sys.argv) > 2 else 'dtr.joblib'
+    with open('dtr.pkl', 'rb') as f:
+        model = pickle.load(f)
+    with open('preprocesser.pkl', 'rb') as f:
+        preprocessor = pickle.load(f)
+    export_bundle(model, preprocessor, path, model_sha256=file_checksum('dtr.pkl'))
+    print(f'✅ Wrote {path}')
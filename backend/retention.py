@@ -0,0 +1,285 @@
+"""Retention for predictions.db: archive old rows to gzip NDJSON, then compact
+
+    python retention.py                          # archive rows older than RETENTION_DAYS
+    python retention.py --days 90 --dry-run      # how many rows would move
+    python retention.py --enable-incremental-vacuum   # one-time, for databases made before this
+
+Rows saved more than ``RETENTION_DAYS`` ago are moved, oldest first and
+``ARCHIVE_BATCH_SIZE`` at a time, into one gzip file of JSON lines per day
+under ``ARCHIVE_DIR`` (``2024/03/predictions-2024-03-14.ndjson.gz``). Each
+batch is appended to its archive files and flushed to disk before it is
+deleted from the database in a short transaction, so saves are never
+blocked for long and a crash can at worst archive a row twice (readers
+skip the duplicate). Freed pages are then returned to the filesystem with
+``PRAGMA incremental_vacuum`` in small steps. Monthly rollups are not
+touched, so ``/analytics/trends`` still covers archived rows, and
+``PredictionDatabase.rebuild_rollups()`` only replaces months that still
+have live rows (the month split by the cutoff is recomputed from its live
+rows unless ``since`` skips it).
+
+Run it from cron (e.g. nightly). ``PredictionArchive.fetch_history()``
+serves archived rows to ``/history?archived=1``; ``index.json`` in the
+archive lists the days holding each user's rows, so a request only opens
+those day files.
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from database import strict_json
+
+try:
+    from config import PREDICTIONS_DB_PATH, ARCHIVE_DIR, RETENTION_DAYS, ARCHIVE_BATCH_SIZE
+except ImportError:
+    PREDICTIONS_DB_PATH = "predictions.db"
+    ARCHIVE_DIR = "archive"
+    RETENTION_DAYS = 365
+    ARCHIVE_BATCH_SIZE = 2000
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FILE_PREFIX = 'predictions-'
+FILE_SUFFIX = '.ndjson.gz'
+INDEX_NAME = 'index.json'
+
+
+def _local(path):
+    """Resolve a configured relative path against the backend directory"""
+    return path if os.path.isabs(path) or os.path.exists(path) else os.path.join(BASE_DIR, path)
+
+
+class PredictionArchive:
+    """Day-partitioned gzip NDJSON files of archived prediction rows"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._index = None  # (index.json mtime, {user_id: days})
+
+    def _path(self, day):
+        return os.path.join(self.directory, day[:4], day[5:7], f'{FILE_PREFIX}{day}{FILE_SUFFIX}')
+
+    def days(self):
+        """Archived days (``YYYY-MM-DD``), newest first"""
+        days = []
+        if not os.path.isdir(self.directory):
+            return days
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.startswith(FILE_PREFIX) and name.endswith(FILE_SUFFIX):
+                    days.append(name[len(FILE_PREFIX):-len(FILE_SUFFIX)])
+        return sorted(days, reverse=True)
+
+    def load_index(self):
+        """{user_id: set of archived days}, rebuilt from the day files if index.json is missing"""
+        path = os.path.join(self.directory, INDEX_NAME)
+        try:
+            stamp = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            if not self.days():
+                return {}
+            index = self.build_index()
+            self._write_index(index)
+            return index
+        cached = self._index
+        if cached is None or cached[0] != stamp:
+            with open(path, 'r', encoding='utf-8') as f:
+                cached = self._index = (stamp, {user: set(days) for user, days in json.load(f).items()})
+        return cached[1]
+
+    def build_index(self):
+        """Scan every day file for the users it holds (for archives written before the index)"""
+        index = {}
+        for day in self.days():
+            for row in self.read_day(day):
+                index.setdefault(row['user_id'], set()).add(day)
+        return index
+
+    def _write_index(self, index):
+        path = os.path.join(self.directory, INDEX_NAME)
+        temp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump({user: sorted(days) for user, days in index.items()}, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
+
+    def append(self, rows):
+        """Append rows (dicts from ``fetch_archivable``) to their day files, durably"""
+        by_day = {}
+        for row in rows:
+            by_day.setdefault(str(row['timestamp'])[:10], []).append(row)
+        index = {user: set(days) for user, days in self.load_index().items()}
+        for day, day_rows in by_day.items():
+            path = self._path(day)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            lines = ''.join(json.dumps(row, separators=(',', ':')) + '\n' for row in day_rows)
+            # Each append is a new gzip member; gzip readers concatenate them
+            with open(path, 'ab') as f:
+                f.write(gzip.compress(lines.encode('utf-8')))
+                f.flush()
+                os.fsync(f.fileno())
+            for row in day_rows:
+                index.setdefault(row['user_id'], set()).add(day)
+        # Written after the day files: rows are only deleted from the database once both exist
+        self._write_index(index)
+
+    def read_day(self, day):
+        """Rows archived for one day, de-duplicated by id"""
+        path = self._path(day)
+        rows = {}
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        row = json.loads(line)
+                        rows[row['id']] = row
+        except FileNotFoundError:
+            pass
+        return list(rows.values())
+
+    def fetch_history(self, user_id, limit, cursor=None, crop=None, country=None,
+                      since=None, until=None):
+        """Archived rows in ``PredictionDatabase.fetch_history`` order and row shape
+
+        ``cursor`` is a decoded ``(timestamp, id)`` bound. Only the day files
+        the index lists for ``user_id`` are read, newest first, skipping those
+        outside the range, until ``limit`` rows are found.
+        """
+        upper = min(bound for bound in (until, cursor[0] if cursor else None, '9999') if bound)
+        found = []
+        for day in sorted(self.load_index().get(user_id, ()), reverse=True):
+            if day > upper[:10]:
+                continue
+            if since and day < since[:10]:
+                break
+            for row in self.read_day(day):
+                if row['user_id'] != user_id:
+                    continue
+                if crop and row['crop'] != crop or country and row['country'] != country:
+                    continue
+                key = (row['timestamp'], row['id'])
+                if cursor and key >= tuple(cursor):
+                    continue
+                if since and row['timestamp'] < since or until and row['timestamp'] > until:
+                    continue
+                # Files archived before schema v5 may still hold NaN, which /history cannot splice
+                found.append((row['id'], row['timestamp'], strict_json(row['input_data']),
+                              strict_json(row['prediction_result']), strict_json(row['location_data'])))
+            if len(found) >= limit:
+                break
+        found.sort(key=lambda row: (row[1], row[0]), reverse=True)
+        return found[:limit]
+
+
+@contextmanager
+def _exclusive(directory):
+    """Hold a lock so two archive runs never write the same files"""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, '.lock'), 'w') as f:
+        if fcntl is not None:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                raise RuntimeError(f'Another archive run is using {directory}') from None
+        yield
+
+
+def cutoff_timestamp(days, now=None):
+    """Stored-format timestamp ``days`` before ``now`` (UTC, like CURRENT_TIMESTAMP)"""
+    now = now or datetime.now(timezone.utc)
+    return (now - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def archive_predictions(database, archive, days, batch_size=2000, dry_run=False, pause=0.0):
+    """Move rows older than ``days`` into ``archive``; returns a summary dict"""
+    cutoff = cutoff_timestamp(days)
+    moved = 0
+    if dry_run:
+        with database.connection() as conn:
+            pending = conn.execute('SELECT count(*) FROM predictions WHERE timestamp < ?',
+                                   (cutoff,)).fetchone()[0]
+        return {'cutoff': cutoff, 'archived': 0, 'pending': pending, 'pages_freed': 0}
+
+    with _exclusive(archive.directory):
+        while True:
+            rows = database.fetch_archivable(cutoff, batch_size)
+            if not rows:
+                break
+            archive.append(rows)
+            moved += database.delete_ids([row['id'] for row in rows])
+            if pause:
+                # Leave room for other writers between batches
+                time.sleep(pause)
+        pages = database.incremental_vacuum()
+    return {'cutoff': cutoff, 'archived': moved, 'pending': 0, 'pages_freed': pages}
+
+
+def enable_incremental_vacuum(path):
+    """Switch an existing database to incremental auto-vacuum (a full VACUUM, run once offline)"""
+    from database import connect
+
+    conn = connect(path)
+    try:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            return False
+        # connect() already requested incremental mode; VACUUM applies it
+        conn.execute('VACUUM')
+        return True
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    from database import PredictionDatabase
+
+    parser = argparse.ArgumentParser(description='Archive old predictions and compact predictions.db')
+    parser.add_argument('--db', default=_local(PREDICTIONS_DB_PATH))
+    parser.add_argument('--archive-dir', default=_local(ARCHIVE_DIR))
+    parser.add_argument('--days', type=float, default=RETENTION_DAYS,
+                        help='Keep rows saved within this many days in the database')
+    parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument('--pause', type=float, default=0.05, help='Seconds to yield between batches')
+    parser.add_argument('--dry-run', action='store_true', help='Only count the rows that would move')
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help='One-time VACUUM so freed pages can later be released incrementally')
+    args = parser.parse_args(argv)
+    if args.days < 0 or args.batch_size < 1:
+        parser.error('--days must not be negative and --batch-size must be positive')
+
+    if args.enable_incremental_vacuum:
+        changed = enable_incremental_vacuum(args.db)
+        print('✅ Incremental vacuum enabled' if changed else 'ℹ️  Incremental vacuum already enabled')
+        return 0
+
+    database = PredictionDatabase(args.db)
+    start = time.perf_counter()
+    try:
+        database.init_schema()
+        result = archive_predictions(database, PredictionArchive(args.archive_dir), args.days,
+                                     args.batch_size, args.dry_run, args.pause)
+    except (RuntimeError, OSError) as e:
+        print(f'❌ {e}', file=sys.stderr)
+        return 1
+    finally:
+        database.close()
+    if args.dry_run:
+        print(f"🗄️  {result['pending']} rows saved before {result['cutoff']} would be archived")
+    else:
+        print(f"✅ Archived {result['archived']} rows saved before {result['cutoff']} to "
+              f"{args.archive_dir}, freed {result['pages_freed']} pages "
+              f"in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
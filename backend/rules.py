@@ -0,0 +1,260 @@
+"""Declarative anomaly, recommendation and factor rules evaluated on NumPy arrays
+
+``rules.json`` lists the rules in output order. Each anomaly or
+recommendation has a ``when`` list of conditions that must all hold
+(``{"field": ..., "op": ..., "value": ...}``), and the remaining keys are
+the payload returned when it fires. A factor maps a field to the label of
+the first level whose threshold the value exceeds, or ``default``.
+
+Rules are compiled once into predicates over whole columns, so one request
+and a million stored rows go through the same code. ``RuleStore``
+re-reads the file when its modification time changes, without a restart.
+"""
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from inference import FEATURE_NAMES, NUMERIC_FEATURES
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules.json')
+
+FIELDS = FEATURE_NAMES + ['prediction']
+NUMERIC_FIELDS = NUMERIC_FEATURES + ['prediction']
+
+OPERATORS = {
+    '<': np.less,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '==': np.equal,
+    '!=': np.not_equal,
+}
+
+
+class RuleError(ValueError):
+    """Raised for a rules file that cannot be compiled"""
+
+
+def _condition(spec):
+    field, op, value = spec.get('field'), spec.get('op'), spec.get('value')
+    if field not in FIELDS:
+        raise RuleError(f'Unknown rule field: {field}')
+    if op in ('in', 'not in'):
+        values = np.array(value if isinstance(value, list) else [value], dtype=object)
+        invert = op == 'not in'
+        return field, lambda column: np.isin(column, values, invert=invert)
+    if op not in OPERATORS:
+        raise RuleError(f'Unknown rule operator: {op}')
+    if field in NUMERIC_FIELDS:
+        value = float(value)
+    compare = OPERATORS[op]
+    return field, lambda column: compare(column, value)
+
+
+class Rule:
+    """Conditions plus the payload returned for rows where all of them hold"""
+
+    def __init__(self, spec):
+        self.name = spec.get('name')
+        when = spec.get('when', [])
+        when = [when] if isinstance(when, dict) else when
+        if not when:
+            raise RuleError(f'Rule {self.name!r} has no conditions')
+        self.conditions = [_condition(condition) for condition in when]
+        self.payload = {key: value for key, value in spec.items() if key not in ('name', 'when')}
+
+    def mask(self, columns):
+        result = None
+        for field, predicate in self.conditions:
+            hits = predicate(columns[field])
+            result = hits if result is None else result & hits
+        return result
+
+
+class Factor:
+    """Label a numeric field by the first threshold it exceeds"""
+
+    def __init__(self, spec):
+        self.field = spec['field']
+        if self.field not in NUMERIC_FIELDS:
+            raise RuleError(f'Factor field must be numeric: {self.field}')
+        self.thresholds = [float(threshold) for threshold, _ in spec['levels']]
+        self.labels = [label for _, label in spec['levels']]
+        self.default = spec.get('default')
+
+    def labels_for(self, columns):
+        column = columns[self.field]
+        return np.select([column > threshold for threshold in self.thresholds],
+                         self.labels, self.default)
+
+    def label_for(self, value):
+        for threshold, label in zip(self.thresholds, self.labels):
+            if value > threshold:
+                return label
+        return self.default
+
+
+class RuleSet:
+    """Compiled rules; evaluates whole columns at once"""
+
+    def __init__(self, spec):
+        self.anomalies = [Rule(rule) for rule in spec.get('anomalies', [])]
+        self.recommendations = [Rule(rule) for rule in spec.get('recommendations', [])]
+        self.factors = {name: Factor(factor) for name, factor in spec.get('factors', {}).items()}
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    @staticmethod
+    def columns(rows, predictions):
+        """Column arrays from feature rows and their predictions"""
+        columns = {name: np.array([row[i] for row in rows],
+                                  dtype=np.float64 if name in NUMERIC_FEATURES else object)
+                   for i, name in enumerate(FEATURE_NAMES)}
+        columns['prediction'] = np.asarray(predictions, dtype=np.float64).reshape(-1)
+        return columns
+
+    def evaluate(self, columns):
+        """Masks of shape (rules, rows) for anomalies and recommendations, labels per factor"""
+        n = len(columns['prediction'])
+        return {
+            'anomalies': self._masks(self.anomalies, columns, n),
+            'recommendations': self._masks(self.recommendations, columns, n),
+            'factors': {name: factor.labels_for(columns) for name, factor in self.factors.items()}
+        }
+
+    @staticmethod
+    def _masks(rules, columns, n):
+        if not rules:
+            return np.zeros((0, n), dtype=bool)
+        return np.vstack([np.broadcast_to(rule.mask(columns), (n,)) for rule in rules])
+
+    def summarize(self, columns):
+        """How many rows each rule fires for, e.g. over the whole history"""
+        result = self.evaluate(columns)
+        return {
+            'rows': len(columns['prediction']),
+            'anomalies': {rule.name: int(count) for rule, count
+                          in zip(self.anomalies, result['anomalies'].sum(axis=1))},
+            'recommendations': {rule.name: int(count) for rule, count
+                                in zip(self.recommendations, result['recommendations'].sum(axis=1))}
+        }
+
+    def annotate(self, rows, predictions):
+        """Per-row ``{'anomalies', 'recommendations', 'factors'}`` in the API's format"""
+        if len(rows) == 1:
+            return [self._annotate_one(rows[0], predictions[0])]
+        result = self.evaluate(self.columns(rows, predictions))
+        factor_labels = {name: labels.tolist() for name, labels in result['factors'].items()}
+        annotated = []
+        for i in range(len(rows)):
+            annotated.append({
+                'anomalies': [dict(rule.payload) for rule, hit
+                              in zip(self.anomalies, result['anomalies'][:, i]) if hit],
+                'recommendations': [dict(rule.payload) for rule, hit
+                                    in zip(self.recommendations, result['recommendations'][:, i]) if hit],
+                'factors': {name: labels[i] for name, labels in factor_labels.items()}
+            })
+        return annotated
+
+    def _annotate_one(self, row, prediction):
+        # Same compiled predicates on scalars: array set-up would dominate one row
+        values = {name: float(row[i]) if name in NUMERIC_FEATURES else row[i]
+                  for i, name in enumerate(FEATURE_NAMES)}
+        values['prediction'] = float(prediction)
+        return {
+            'anomalies': [dict(rule.payload) for rule in self.anomalies if rule.mask(values)],
+            'recommendations': [dict(rule.payload) for rule in self.recommendations
+                                if rule.mask(values)],
+            'factors': {name: factor.label_for(values[factor.field])
+                        for name, factor in self.factors.items()}
+        }
+
+
+class RuleStore:
+    """Holds the current ``RuleSet`` and reloads it when the file changes
+
+    The file's modification time is checked at most every ``check_interval``
+    seconds. A file that fails to load is reported and the previous rules
+    stay in force.
+    """
+
+    def __init__(self, path=None, check_interval=2.0):
+        path = path or DEFAULT_RULES_PATH
+        if not os.path.isabs(path) and not os.path.exists(path):
+            path = os.path.join(os.path.dirname(DEFAULT_RULES_PATH), path)
+        self.path = path
+        self.check_interval = check_interval
+        self.error = None
+        self.loaded_at = None
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.current = None
+        self.reload()
+        if self.current is None:
+            raise RuleError(self.error)
+
+    def reload(self):
+        """Load the rules file now; returns True when the new rules are in force"""
+        with self._lock:
+            self._checked = time.monotonic()
+            try:
+                # Remembered even if loading fails, so a broken file is reported once
+                self._mtime = os.stat(self.path).st_mtime_ns
+                rules = RuleSet.from_file(self.path)
+            except Exception as e:
+                self.error = f'Rules not reloaded from {self.path}: {e}'
+                print(f"❌ {self.error}")
+                return False
+            self.current = rules
+            self.error = None
+            self.loaded_at = time.time()
+            return True
+
+    def get(self):
+        """Current rules, reloading first if the file changed"""
+        if time.monotonic() - self._checked >= self.check_interval:
+            self._checked = time.monotonic()
+            try:
+                changed = os.stat(self.path).st_mtime_ns != self._mtime
+            except OSError:
+                changed = False
+            if changed and self.reload():
+                print(f"📏 Reloaded rules from {self.path}")
+        return self.current
+
+    def status(self):
+        rules = self.current
+        return {
+            'path': self.path,
+            'loaded_at': self.loaded_at,
+            'error': self.error,
+            'anomalies': [rule.name for rule in rules.anomalies],
+            'recommendations': [rule.name for rule in rules.recommendations],
+            'factors': sorted(rules.factors)
+        }
+
+
+if __name__ == '__main__':
+    rules = RuleSet.from_file(DEFAULT_RULES_PATH)
+    rng = np.random.default_rng(0)
+    n = 1000000
+    columns = {
+        'year': rng.integers(1990, 2014, n).astype(np.float64),
+        'rainfall': rng.uniform(50, 3000, n),
+        'pesticides': rng.uniform(0, 5, n),
+        'avgTemp': rng.uniform(0, 45, n),
+        'country': np.full(n, 'India', dtype=object),
+        'item': np.full(n, 'Maize', dtype=object),
+        'prediction': rng.uniform(0, 100000, n),
+    }
+    start = time.perf_counter()
+    summary = rules.summarize(columns)
+    print(f'{n} rows in {time.perf_counter() - start:.3f}s')
+    print(json.dumps(summary, indent=2))
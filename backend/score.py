@@ -0,0 +1,415 @@
+"""Offline bulk scoring of CSV or Parquet files
+
+    python score.py yield_df.csv -o scored.csv
+    python score.py national.parquet -o scored.parquet --workers 4
+    python score.py national.csv --db predictions.db --user-id nightly
+
+The input needs the six feature columns, named either as the API names
+them (year, rainfall, pesticides, avgTemp, country, item) or as in the
+training data (Year, average_rain_fall_mm_per_year, pesticides_tonnes,
+avg_temp, Area, Item). Rows are read, scored and written ``chunk_size`` at
+a time, so memory stays flat whatever the file size; with ``--workers``
+chunks are scored in a process pool and still written in input order.
+
+Every input column is passed through and ``prediction``, ``confidence``,
+``anomalies`` (rule names from rules.json, ``;``-separated) and ``error``
+are appended. With ``--db`` the results are inserted into the predictions
+table instead, one transaction per chunk, tagged with the model version.
+Parquet needs ``pyarrow``.
+"""
+import argparse
+import contextlib
+import csv
+import itertools
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from inference import FEATURE_NAMES, NUMERIC_FEATURES, model_categories, validate_row
+from model_registry import ModelRegistry
+from model_store import ModelStore
+from rules import RuleError, RuleStore
+
+try:
+    from config import INFERENCE_ENGINE, FEATURE_ENCODER, MODEL_FORMAT, MODEL_ARRAYS_PATH
+    from config import CONFIDENCE_MIN_SAMPLES, CONFIDENCE_TOLERANCE, RULES_PATH
+    from config import PREDICTIONS_DB_PATH, SCORE_CHUNK_SIZE, SCORE_WORKERS
+    from config import MODEL_REGISTRY_DIR, MODEL_VERSION
+except ImportError:
+    INFERENCE_ENGINE = "sklearn"
+    FEATURE_ENCODER = "fast"
+    MODEL_FORMAT = "pickle"
+    MODEL_ARRAYS_PATH = "dtr.joblib"
+    CONFIDENCE_MIN_SAMPLES = 10
+    CONFIDENCE_TOLERANCE = 0.2
+    RULES_PATH = "rules.json"
+    PREDICTIONS_DB_PATH = "predictions.db"
+    SCORE_CHUNK_SIZE = 50000
+    SCORE_WORKERS = 1
+    MODEL_REGISTRY_DIR = None
+    MODEL_VERSION = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Training-data column names accepted for each feature
+COLUMN_ALIASES = {
+    'year': ['year', 'Year'],
+    'rainfall': ['rainfall', 'average_rain_fall_mm_per_year'],
+    'pesticides': ['pesticides', 'pesticides_tonnes'],
+    'avgTemp': ['avgTemp', 'avg_temp'],
+    'country': ['country', 'Area'],
+    'item': ['item', 'Item'],
+}
+
+OUTPUT_COLUMNS = ['prediction', 'confidence', 'anomalies', 'error']
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+DATABASE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+
+
+class ScoreError(ValueError):
+    """Raised for input that cannot be scored at all"""
+
+
+def _local(path):
+    """Resolve a configured relative path against the backend directory"""
+    return path if os.path.isabs(path) or os.path.exists(path) else os.path.join(BASE_DIR, path)
+
+
+def feature_positions(header):
+    """Index of each feature's column in ``header``"""
+    positions = []
+    for name in FEATURE_NAMES:
+        found = [header.index(alias) for alias in COLUMN_ALIASES[name] if alias in header]
+        if not found:
+            raise ScoreError(f'Missing input column: {name} '
+                             f'(or {" / ".join(COLUMN_ALIASES[name][1:])})')
+        positions.append(found[0])
+    return positions
+
+
+# Readers yield (header, rows) chunks of plain Python lists
+
+def read_csv(path, chunk_size):
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        header = [cell.strip() for cell in header]
+        while True:
+            chunk = list(itertools.islice(reader, chunk_size))
+            if not chunk:
+                return
+            rows = [row for row in chunk if row]
+            if rows:
+                yield header, rows
+
+
+def read_parquet(path, chunk_size):
+    pq = _pyarrow_parquet()
+    parquet = pq.ParquetFile(path)
+    header = parquet.schema_arrow.names
+    for batch in parquet.iter_batches(batch_size=chunk_size):
+        columns = [column.to_pylist() for column in batch.columns]
+        yield header, [list(row) for row in zip(*columns)]
+
+
+def _pyarrow_parquet():
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ScoreError('Parquet files need pyarrow: pip install pyarrow') from None
+    return pq
+
+
+# Writers take (header, rows, results) chunks and write them as they arrive
+
+def _fit(row, width):
+    """Pad or cut a row to the header width so result columns line up"""
+    return row[:width] if len(row) >= width else row + [None] * (width - len(row))
+
+
+class CsvWriter:
+    def __init__(self, path):
+        self.file = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.header_written = False
+
+    def write(self, header, rows, results):
+        if not self.header_written:
+            self.writer.writerow(header + OUTPUT_COLUMNS)
+            self.header_written = True
+        width = len(header)
+        self.writer.writerows(_fit(row, width) + list(result) for row, result in zip(rows, results))
+        self.file.flush()
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+class ParquetWriter:
+    def __init__(self, path):
+        self.pq = _pyarrow_parquet()
+        self.path = path
+        self.writer = None
+
+    def write(self, header, rows, results):
+        import pyarrow as pa
+
+        width = len(header)
+        columns = [list(column) for column in zip(*(_fit(row, width) for row in rows))]
+        columns += [list(column) for column in zip(*results)]
+        if self.writer is None:
+            # Input columns keep the types of the first chunk (all strings for CSV)
+            types = [pa.array(column).type for column in columns[:len(header)]]
+            types = [pa.string() if pa.types.is_null(t) else t for t in types]
+            self.schema = pa.schema(
+                list(zip(header, types)) +
+                [('prediction', pa.float64()), ('confidence', pa.float64()),
+                 ('anomalies', pa.string()), ('error', pa.string())])
+            self.writer = self.pq.ParquetWriter(self.path, self.schema)
+        arrays = [pa.array(column, field.type) for column, field in zip(columns, self.schema)]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class DatabaseWriter:
+    def __init__(self, path, user_id):
+        from database import PredictionDatabase
+
+        self.database = PredictionDatabase(path)
+        self.user_id = user_id
+        self.model_version = None
+
+    def write(self, header, rows, results):
+        positions = feature_positions(header)
+        records = []
+        for row, (prediction, confidence, anomalies, error) in zip(rows, results):
+            if error:
+                continue
+            features = [row[i].strip() if isinstance(row[i], str) else row[i] for i in positions]
+            features[:4] = [float(value) for value in features[:4]]
+            result = {'prediction': prediction, 'confidence': confidence,
+                      'anomalies': anomalies.split(';') if anomalies else [],
+                      'model_version': self.model_version}
+            records.append(({'features': features}, result, {}, self.user_id, self.model_version))
+        if records:
+            self.database.save_many(records)
+
+    def close(self):
+        self.database.close()
+
+
+def open_reader(path, chunk_size):
+    if path.lower().endswith(PARQUET_EXTENSIONS):
+        return read_parquet(path, chunk_size)
+    return read_csv(path, chunk_size)
+
+
+def open_writer(path, database=None, user_id='batch'):
+    if database:
+        return DatabaseWriter(database, user_id)
+    if path.lower().endswith(DATABASE_EXTENSIONS):
+        return DatabaseWriter(path, user_id)
+    if path.lower().endswith(PARQUET_EXTENSIONS):
+        return ParquetWriter(path)
+    return CsvWriter(path)
+
+
+def load_models():
+    """Load the model and rules the way the API does, from the configured files"""
+    # Load banners go to stderr so CSV written to stdout stays clean
+    with contextlib.redirect_stdout(sys.stderr):
+        return _load_models()
+
+
+def _load_models():
+    store = ModelStore(
+        model_path=_local('dtr.pkl'),
+        preprocessor_path=_local('preprocesser.pkl'),
+        arrays_path=_local(MODEL_ARRAYS_PATH),
+        model_format=MODEL_FORMAT,
+        inference_engine=INFERENCE_ENGINE,
+        feature_encoder=FEATURE_ENCODER,
+        confidence_min_samples=CONFIDENCE_MIN_SAMPLES,
+        confidence_tolerance=CONFIDENCE_TOLERANCE,
+        registry=ModelRegistry(_local(MODEL_REGISTRY_DIR)) if MODEL_REGISTRY_DIR else None,
+        version=MODEL_VERSION
+    )
+    store.start()
+    models = store.get()
+    if models is None:
+        raise ScoreError(f'Model not loaded: {store.error}')
+    return models, RuleStore(RULES_PATH, check_interval=float('inf')).get()
+
+
+def score_chunk(models, rules, header, rows):
+    """``(prediction, confidence, anomalies, error)`` for every row of one chunk
+
+    Columns are converted and checked with NumPy and encoded in one call;
+    only rows that fail are re-validated one by one for their error message.
+    """
+    positions = feature_positions(header)
+    countries, items = model_categories(models)
+    width = max(positions) + 1
+    results = [None] * len(rows)
+    index = []
+    for i, row in enumerate(rows):
+        if len(row) < width:
+            results[i] = (None, None, None, 'Row has too few columns')
+        else:
+            index.append(i)
+    if not index:
+        return results
+
+    valid = np.ones(len(index), dtype=bool)
+    columns = []
+    for name, p in zip(FEATURE_NAMES, positions):
+        values = [rows[i][p] for i in index]
+        if name in NUMERIC_FEATURES:
+            column = _numbers(values)
+            valid &= np.isfinite(column)
+        else:
+            column = np.array([v.strip() if isinstance(v, str) else v for v in values], dtype=object)
+            known = countries if name == 'country' else items
+            if known is not None:
+                valid &= np.fromiter((v in known for v in column.tolist()), bool, len(column))
+            else:
+                valid &= np.fromiter((isinstance(v, str) and v != '' for v in column.tolist()),
+                                     bool, len(column))
+        columns.append(column)
+
+    for j in np.flatnonzero(~valid).tolist():
+        features = [column[j] for column in columns]
+        features[:4] = [rows[index[j]][p] for p in positions[:4]]
+        _, error = validate_row(features, countries, items)
+        results[index[j]] = (None, None, None, error or 'Invalid row')
+
+    ok = np.flatnonzero(valid)
+    if len(ok):
+        columns = [column[ok] for column in columns]
+        predictions, confidences = models.predict(models.encode_columns(columns))
+        values = dict(zip(FEATURE_NAMES, columns), prediction=np.asarray(predictions, dtype=np.float64))
+        fired = rules.evaluate(values)['anomalies'].T.tolist()
+        names = [rule.name for rule in rules.anomalies]
+        for i, prediction, confidence, hits in zip(ok.tolist(), predictions.tolist(),
+                                                   confidences.tolist(), fired):
+            anomalies = ';'.join(itertools.compress(names, hits))
+            results[index[i]] = (float(prediction), float(confidence), anomalies, None)
+    return results
+
+
+def _numbers(values):
+    """Float array for a numeric column, NaN where a value is not a number"""
+    if bool not in set(map(type, values)):
+        try:
+            return np.asarray(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            pass
+    column = np.full(len(values), np.nan)
+    for k, value in enumerate(values):
+        if isinstance(value, bool):
+            continue
+        try:
+            column[k] = float(value)
+        except (TypeError, ValueError):
+            pass
+    return column
+
+
+# Forked workers inherit the parent's loaded model; spawned ones load their own
+_worker_state = None
+
+
+def _init_worker():
+    global _worker_state
+    if _worker_state is None:
+        _worker_state = load_models()
+
+
+def _score_in_worker(header, rows):
+    models, rules = _worker_state
+    return score_chunk(models, rules, header, rows)
+
+
+def score_file(input_path, output_path='-', database=None, user_id='batch',
+               chunk_size=SCORE_CHUNK_SIZE, workers=SCORE_WORKERS):
+    """Score ``input_path`` chunk by chunk; returns ``(rows, failed)`` counts"""
+    if not os.path.isfile(input_path):
+        raise ScoreError(f'Input file not found: {input_path}')
+    reader = open_reader(input_path, chunk_size)
+    writer = open_writer(output_path, database, user_id)
+    total = failed = 0
+    try:
+        models, rules = load_models()
+        if isinstance(writer, DatabaseWriter):
+            writer.model_version = models.version
+        if workers > 1:
+            chunks = _score_parallel(reader, workers, (models, rules))
+        else:
+            chunks = ((header, rows, score_chunk(models, rules, header, rows))
+                      for header, rows in reader)
+        for header, rows, results in chunks:
+            writer.write(header, rows, results)
+            total += len(rows)
+            failed += sum(1 for result in results if result[3])
+    finally:
+        writer.close()
+    return total, failed
+
+
+def _score_parallel(reader, workers, state):
+    global _worker_state
+    _worker_state = state
+    # At most two chunks per worker are in flight, so memory stays bounded
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        pending = deque()
+        for header, rows in reader:
+            feature_positions(header)
+            pending.append((header, rows, pool.submit(_score_in_worker, header, rows)))
+            if len(pending) >= workers * 2:
+                header, rows, future = pending.popleft()
+                yield header, rows, future.result()
+        while pending:
+            header, rows, future = pending.popleft()
+            yield header, rows, future.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Score a CSV or Parquet file of crop features')
+    parser.add_argument('input', help='CSV or Parquet (.parquet/.pq) file')
+    parser.add_argument('-o', '--output', default='-',
+                        help='CSV, Parquet or SQLite (.db) output; "-" writes CSV to stdout')
+    parser.add_argument('--db', nargs='?', const=_local(PREDICTIONS_DB_PATH), default=None,
+                        help=f'Insert into a predictions database (default {PREDICTIONS_DB_PATH})')
+    parser.add_argument('--user-id', default='batch', help='user_id stored with database rows')
+    parser.add_argument('--chunk-size', type=int, default=SCORE_CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=SCORE_WORKERS,
+                        help='Processes scoring chunks in parallel (1 = in this process)')
+    args = parser.parse_args(argv)
+    if args.chunk_size < 1 or args.workers < 1:
+        parser.error('--chunk-size and --workers must be positive')
+
+    start = time.perf_counter()
+    try:
+        total, failed = score_file(args.input, args.output, args.db, args.user_id,
+                                   args.chunk_size, args.workers)
+    except (ScoreError, RuleError, OSError) as e:
+        print(f'❌ {e}', file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - start
+    print(f'✅ Scored {total} rows ({failed} failed) in {elapsed:.1f}s '
+          f'({total / elapsed if elapsed else 0:.0f} rows/s)', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
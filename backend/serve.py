@@ -0,0 +1,103 @@
+"""Production server: the Flask app under gunicorn's prefork workers
+
+    python serve.py                      # HOST, PORT, SERVER_* from config.py
+    python serve.py --workers 4 --host 0.0.0.0 --port 8000
+
+The app is imported, the database migrated and the model loaded once in
+the master process before the workers are forked (gunicorn's
+``preload_app``), so all workers share the model's memory copy-on-write
+instead of each loading a copy. ``gc.freeze()`` runs just before the fork
+so the garbage collector does not write to, and thereby copy, those pages.
+
+Workers are gunicorn ``gthread`` workers: ``SERVER_WORKERS`` processes for
+CPU-bound predictions, ``SERVER_THREADS`` threads each so chat calls and
+streams do not block a whole process. Without gunicorn (e.g. on Windows)
+the app falls back to Flask's threaded server in a single process.
+"""
+import argparse
+import gc
+import importlib.util
+import os
+import tempfile
+
+try:
+    from config import HOST, PORT, SERVER_WORKERS, SERVER_THREADS, SERVER_TIMEOUT
+except ImportError:
+    HOST = "127.0.0.1"
+    PORT = 5000
+    SERVER_WORKERS = 0
+    SERVER_THREADS = 4
+    SERVER_TIMEOUT = 60
+
+
+def server_options(host, port, workers, threads, timeout):
+    """gunicorn settings for the given worker layout"""
+    return {
+        'bind': f'{host}:{port}',
+        'workers': workers or os.cpu_count() or 1,
+        'worker_class': 'gthread',
+        'threads': threads,
+        'timeout': timeout,
+        'preload_app': True,
+        'accesslog': None,
+        'errorlog': '-',
+    }
+
+
+def load_app():
+    """Import the app and finish all one-time start-up work in this process"""
+    import crop
+    import metrics
+
+    crop.init_db()
+    crop.model_store.wait()
+    registry = metrics.registry
+    if registry.enabled:
+        # Workers share snapshots so a scrape of any worker covers them all
+        if not registry.directory:
+            registry.configure(True, tempfile.mkdtemp(prefix='cropcast-metrics-'),
+                               registry.flush_interval)
+        registry.reset()
+    return crop.app
+
+
+def run_gunicorn(app, options):
+    from gunicorn.app.base import BaseApplication
+
+    class CropCastServer(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    print(f"🚀 Serving on http://{options['bind']} with {options['workers']} workers "
+          f"x {options['threads']} threads")
+    # Objects alive now are shared with the workers; keep GC from touching them
+    gc.freeze()
+    CropCastServer().run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the CropCast API with prefork workers')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS,
+                        help='Worker processes (0 = one per CPU core)')
+    parser.add_argument('--threads', type=int, default=SERVER_THREADS, help='Threads per worker')
+    parser.add_argument('--timeout', type=int, default=SERVER_TIMEOUT)
+    args = parser.parse_args(argv)
+
+    app = load_app()
+    if importlib.util.find_spec('gunicorn') is None:
+        print("⚠️  gunicorn not installed (pip install gunicorn); "
+              "using Flask's threaded server in one process")
+        app.run(host=args.host, port=args.port, debug=False, threaded=True)
+        return
+    run_gunicorn(app, server_options(args.host, args.port, args.workers, args.threads,
+                                     args.timeout))
+
+
+if __name__ == '__main__':
+    main()
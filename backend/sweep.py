@@ -0,0 +1,227 @@
+"""Scenario sweeps: predictions over the Cartesian grid of feature ranges
+
+A sweep request fixes some features and gives ranges or lists for the
+others, e.g. rainfall 200-2000 mm x avgTemp 10-40 °C for Maize in India.
+The grid is never materialized: chunks of flat grid indices are unravelled
+into feature columns, encoded column-wise and scored with one predict call
+per chunk. ``Aggregator`` keeps per-group max/min/mean as chunks go by.
+"""
+import math
+
+import numpy as np
+
+from inference import FEATURE_NAMES, NUMERIC_FEATURES
+
+
+class SweepError(ValueError):
+    """Raised for a sweep specification that cannot be run"""
+
+
+def _number(name, value):
+    if isinstance(value, bool):
+        raise SweepError(f'{name} must be a number')
+    try:
+        number = float(value)
+    except (TypeError, ValueError, OverflowError):
+        raise SweepError(f'{name} must be a number') from None
+    if not math.isfinite(number):
+        raise SweepError(f'{name} must be a finite number')
+    return number
+
+
+def numeric_axis(name, spec, max_points):
+    """Values for a numeric feature: a number, a list, or {start, stop, step|num}"""
+    if isinstance(spec, dict):
+        start = _number(f'{name}.start', spec.get('start'))
+        stop = _number(f'{name}.stop', spec.get('stop'))
+        if stop < start:
+            raise SweepError(f'{name}.stop must not be below {name}.start')
+        if 'num' in spec:
+            num = spec['num']
+            if isinstance(num, bool) or not isinstance(num, int) or num < 1:
+                raise SweepError(f'{name}.num must be a positive integer')
+            if num > max_points:
+                raise SweepError(f'{name} has too many values (max {max_points})')
+            count = num
+        else:
+            step = _number(f'{name}.step', spec.get('step'))
+            if step <= 0:
+                raise SweepError(f'{name}.step must be positive')
+            # stop - start can overflow to inf and the quotient can exceed any int, so
+            # bound the float before converting it
+            steps = (stop - start) / step
+            if not steps < max_points:
+                raise SweepError(f'{name} has too many values (max {max_points})')
+            count = int(math.floor(steps + 1e-9)) + 1
+            if count > max_points:
+                raise SweepError(f'{name} has too many values ({count}, max {max_points})')
+        if 'num' in spec:
+            return np.linspace(start, stop, count)
+        return np.round(start + step * np.arange(count), 10)
+    if isinstance(spec, list):
+        if not spec:
+            raise SweepError(f'{name} list is empty')
+        if len(spec) > max_points:
+            raise SweepError(f'{name} has too many values ({len(spec)}, max {max_points})')
+        return np.array([_number(name, value) for value in spec], dtype=np.float64)
+    return np.array([_number(name, spec)], dtype=np.float64)
+
+
+def category_axis(name, spec, known):
+    """Values for country/item: one name, a list, or "*" for every known category"""
+    if spec == '*':
+        if known is None:
+            raise SweepError(f'{name} "*" needs the fitted categories')
+        return np.array(sorted(known), dtype=object)
+    values = spec if isinstance(spec, list) else [spec]
+    if not values:
+        raise SweepError(f'{name} list is empty')
+    for value in values:
+        if not isinstance(value, str) or not value:
+            raise SweepError(f'{name} must be a non-empty string')
+        if known is not None and value not in known:
+            label = 'crop item' if name == 'item' else name
+            raise SweepError(f'Unknown {label}: {value}')
+    return np.array(list(dict.fromkeys(values)), dtype=object)
+
+
+class Sweep:
+    """A parsed sweep: one value array per feature, in ``FEATURE_NAMES`` order
+
+    ``spec`` is ``{"fixed": {...}, "sweep": {...}}``; every feature must be
+    given in exactly one of them.
+    """
+
+    def __init__(self, spec, countries=None, items=None, max_points=1000000):
+        if not isinstance(spec, dict):
+            raise SweepError('Expected a JSON object with "fixed" and "sweep"')
+        fixed = spec.get('fixed') or {}
+        swept = spec.get('sweep') or {}
+        if not isinstance(fixed, dict) or not isinstance(swept, dict):
+            raise SweepError('"fixed" and "sweep" must be objects')
+        unknown = (set(fixed) | set(swept)) - set(FEATURE_NAMES)
+        if unknown:
+            raise SweepError(f'Unknown features: {", ".join(sorted(unknown))}')
+        both = set(fixed) & set(swept)
+        if both:
+            raise SweepError(f'Features both fixed and swept: {", ".join(sorted(both))}')
+        missing = [name for name in FEATURE_NAMES if name not in fixed and name not in swept]
+        if missing:
+            raise SweepError(f'Missing features: {", ".join(missing)}')
+
+        known = {'country': countries, 'item': items}
+        self.axes = []
+        for name in FEATURE_NAMES:
+            value = swept[name] if name in swept else fixed[name]
+            if name in NUMERIC_FEATURES:
+                if name in fixed and isinstance(value, (list, dict)):
+                    raise SweepError(f'Fixed {name} must be a single number')
+                self.axes.append(numeric_axis(name, value, max_points))
+            else:
+                # "*" expands to every category, so it belongs under "sweep"
+                if name in fixed and (isinstance(value, list) or value == '*'):
+                    raise SweepError(f'Fixed {name} must be a single value; sweep it to use a list or "*"')
+                self.axes.append(category_axis(name, value, known[name]))
+
+        self.swept = [name for name in FEATURE_NAMES if name in swept]
+        self.fixed = {name: _plain(self.axes[i][0])
+                      for i, name in enumerate(FEATURE_NAMES) if name in fixed}
+        self.shape = tuple(len(axis) for axis in self.axes)
+        self.total = math.prod(self.shape)
+        if self.total > max_points:
+            raise SweepError(f'Sweep too large: {self.total} points (max {max_points})')
+
+    def chunks(self, chunk_size):
+        """Yield ``(flat indices, multi-index, feature columns)`` chunk by chunk"""
+        for start in range(0, self.total, chunk_size):
+            flat = np.arange(start, min(start + chunk_size, self.total))
+            index = np.unravel_index(flat, self.shape)
+            yield flat, index, [axis[i] for axis, i in zip(self.axes, index)]
+
+    def point(self, flat):
+        """Swept feature values at one flat grid index"""
+        index = np.unravel_index(flat, self.shape)
+        return {name: _plain(axis[i])
+                for name, axis, i in zip(FEATURE_NAMES, self.axes, index) if name in self.swept}
+
+    def describe(self):
+        return {
+            'fixed': self.fixed,
+            'sweep': {name: len(self.axes[FEATURE_NAMES.index(name)]) for name in self.swept},
+            'points': self.total
+        }
+
+
+def _plain(value):
+    return value.item() if hasattr(value, 'item') else value
+
+
+class Aggregator:
+    """Running max/min/mean of predictions per group of feature values"""
+
+    def __init__(self, sweep, by=('item',)):
+        by = [by] if isinstance(by, str) else by
+        if not isinstance(by, (list, tuple)):
+            raise SweepError('aggregate.by must be a feature name or a list of them')
+        unknown = [str(name) for name in by if name not in FEATURE_NAMES]
+        if unknown:
+            raise SweepError(f'Cannot group by: {", ".join(unknown)}')
+        self.sweep = sweep
+        self.by = list(by)
+        self._positions = [FEATURE_NAMES.index(name) for name in by]
+        self._groups = {}
+
+    def update(self, flat, index, predictions):
+        if self._positions:
+            codes = np.ravel_multi_index([index[p] for p in self._positions],
+                                         [self.sweep.shape[p] for p in self._positions])
+        else:
+            codes = np.zeros(len(flat), dtype=np.intp)
+
+        # Sorting by (group, prediction) puts each group's min first and max last
+        order = np.lexsort((predictions, codes))
+        codes, predictions, flat = codes[order], predictions[order], flat[order]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        ends = np.r_[starts[1:], len(codes)] - 1
+        sums = np.add.reduceat(predictions, starts)
+
+        for first, last, total in zip(starts.tolist(), ends.tolist(), sums.tolist()):
+            code = int(codes[first])
+            group = self._groups.get(code)
+            if group is None:
+                group = self._groups[code] = {'count': 0, 'sum': 0.0,
+                                              'max': (-math.inf, None), 'min': (math.inf, None)}
+            group['count'] += last - first + 1
+            group['sum'] += total
+            if predictions[last] > group['max'][0]:
+                group['max'] = (float(predictions[last]), int(flat[last]))
+            if predictions[first] < group['min'][0]:
+                group['min'] = (float(predictions[first]), int(flat[first]))
+
+    def result(self):
+        """Groups sorted by best (max) prediction, each with its arg-max/arg-min points"""
+        shape = [self.sweep.shape[p] for p in self._positions]
+        groups = []
+        for code, group in self._groups.items():
+            entry = {}
+            if self._positions:
+                for name, p, i in zip(self.by, self._positions, np.unravel_index(code, shape)):
+                    entry[name] = _plain(self.sweep.axes[p][i])
+            entry['count'] = group['count']
+            entry['mean'] = group['sum'] / group['count']
+            for stat in ('max', 'min'):
+                value, flat = group[stat]
+                entry[stat] = dict(self.sweep.point(flat), prediction=value)
+            groups.append(entry)
+        groups.sort(key=lambda entry: entry['max']['prediction'], reverse=True)
+        return groups
+
+
+def run_sweep(models, sweep, chunk_size=8192, aggregator=None):
+    """Yield ``(flat, columns, predictions, confidences)`` for each chunk of the grid"""
+    for flat, index, columns in sweep.chunks(chunk_size):
+        predictions, confidences = models.predict(models.encode_columns(columns))
+        predictions = np.asarray(predictions, dtype=np.float64).reshape(-1)
+        if aggregator is not None:
+            aggregator.update(flat, index, predictions)
+        yield flat, columns, predictions, confidences
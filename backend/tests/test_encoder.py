@@ -0,0 +1,77 @@
+"""Parity of the fast feature encoder with the fitted ColumnTransformer"""
+import os
+import pickle
+import random
+import warnings
+
+import numpy as np
+import pytest
+
+from encoder import FastEncoder, UnknownCategoryError
+from inference import FEATURE_NAMES, domain_rows, known_categories
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _dense(X):
+    return X.toarray() if hasattr(X, 'toarray') else np.asarray(X)
+
+
+@pytest.fixture(scope='module')
+def preprocessor():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        with open(os.path.join(BACKEND_DIR, 'preprocesser.pkl'), 'rb') as f:
+            return pickle.load(f)
+
+
+@pytest.fixture(scope='module')
+def rows(preprocessor):
+    # The training-domain grid plus off-grid values, including exact integers and extremes
+    countries, items = (sorted(values) for values in known_categories(preprocessor))
+    rng = random.Random(7)
+    extra = [[rng.choice([1961, 2013.5, 2050]), rng.uniform(0, 4000), rng.choice([0, 1e-9, 3.7e5]),
+              rng.uniform(-10, 35), rng.choice(countries), rng.choice(items)] for _ in range(2000)]
+    return domain_rows(preprocessor, 3) + extra
+
+
+@pytest.fixture(scope='module', params=['fitted', 'from_state'])
+def encoder(request, preprocessor):
+    fast = FastEncoder(preprocessor)
+    return fast if request.param == 'fitted' else FastEncoder.from_state(fast.to_state())
+
+
+def test_encode_matches_transform(preprocessor, encoder, rows):
+    np.testing.assert_array_equal(encoder.encode(rows), _dense(preprocessor.transform(rows)))
+
+
+def test_encode_columns_matches_transform(preprocessor, encoder, rows):
+    columns = [[row[col] for row in rows] for col in range(len(FEATURE_NAMES))]
+    columns[:4] = [np.asarray(column, dtype=np.float64) for column in columns[:4]]
+    np.testing.assert_array_equal(encoder.encode_columns(columns), _dense(preprocessor.transform(rows)))
+
+
+def test_encode_one_matches_transform(preprocessor, encoder, rows):
+    sample = rows[::97]
+    expected = _dense(preprocessor.transform(sample))
+    for row, want in zip(sample, expected):
+        np.testing.assert_array_equal(encoder.encode_one(row)[0], want)
+
+
+@pytest.mark.parametrize('column, value', [(4, 'Atlantis'), (5, 'Moonbeans'), (4, None)])
+def test_unknown_category_rejected_like_transform(preprocessor, encoder, rows, column, value):
+    row = list(rows[0])
+    row[column] = value
+    with pytest.raises(ValueError):
+        preprocessor.transform([row])
+    with pytest.raises(UnknownCategoryError):
+        encoder.encode_one(row)
+    with pytest.raises(UnknownCategoryError):
+        encoder.encode([rows[1], row])
+    with pytest.raises(UnknownCategoryError):
+        encoder.encode_columns([[v] for v in row])
+
+
+def test_state_round_trip_is_stable(preprocessor):
+    state = FastEncoder(preprocessor).to_state()
+    assert FastEncoder.from_state(state).to_state() == state
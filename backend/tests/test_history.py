@@ -0,0 +1,150 @@
+"""Keyset pagination and filters of the prediction history"""
+import json
+
+import pytest
+
+from database import PredictionDatabase, decode_cursor
+
+# (timestamp, country, item): five rows share each timestamp so pages must break ties by id
+ROWS = [(f'2024-03-{day:02d} {hour:02d}:30:00', country, item)
+        for day in (13, 14, 15)
+        for hour in (7, 8)
+        for country, item in (('India', 'Maize'), ('India', 'Wheat'), ('Kenya', 'Maize'),
+                              ('Kenya', 'Wheat'), ('Peru', 'Potatoes'))]
+
+
+@pytest.fixture
+def database(tmp_path):
+    db = PredictionDatabase(str(tmp_path / 'predictions.db'))
+    db.init_schema()
+    with db.connection() as conn:
+        for timestamp, country, item in ROWS:
+            features = [2013, 1200.0, 100.0, 20.0, country, item]
+            conn.execute('''
+                INSERT INTO predictions (timestamp, input_data, prediction_result, location_data,
+                                         user_id, crop, country)
+                VALUES (?, ?, ?, NULL, 'farmer', ?, ?)
+            ''', (timestamp, json.dumps({'features': features}), json.dumps({'prediction': 1000.0}),
+                  item, country))
+        conn.execute("INSERT INTO predictions (timestamp, input_data, user_id) "
+                     "VALUES ('2024-03-14 08:30:00', '{}', 'someone-else')")
+    yield db
+    db.close()
+
+
+def _all_ids(db, limit, **filters):
+    ids, cursor, pages = [], None, 0
+    while True:
+        rows, cursor = db.fetch_history('farmer', limit, cursor=cursor, **filters)
+        assert len(rows) <= limit
+        ids.extend(row[0] for row in rows)
+        pages += 1
+        if cursor is None:
+            return ids, pages
+
+
+def _expected(database, where='1'):
+    with database.connection() as conn:
+        return [row[0] for row in conn.execute(
+            f"SELECT id FROM predictions WHERE user_id = 'farmer' AND {where} "
+            "ORDER BY timestamp DESC, id DESC")]
+
+
+@pytest.mark.parametrize('limit', [1, 3, 4, 5, 7, 30, 31])
+def test_pages_neither_overlap_nor_skip_on_tied_timestamps(database, limit):
+    ids, pages = _all_ids(database, limit)
+    assert ids == _expected(database)
+    assert len(set(ids)) == len(ROWS)
+    assert pages == max(1, -(-len(ROWS) // limit))
+
+
+@pytest.mark.parametrize('filters, where', [
+    ({'crop': 'Maize'}, "crop = 'Maize'"),
+    ({'country': 'Kenya'}, "country = 'Kenya'"),
+    ({'crop': 'Wheat', 'country': 'India'}, "crop = 'Wheat' AND country = 'India'"),
+    ({'since': '2024-03-14 08:30:00'}, "timestamp >= '2024-03-14 08:30:00'"),
+    ({'until': '2024-03-14 07:30:00'}, "timestamp <= '2024-03-14 07:30:00'"),
+    ({'since': '2024-03-14 00:00:00', 'until': '2024-03-14 23:59:59', 'crop': 'Potatoes'},
+     "timestamp BETWEEN '2024-03-14' AND '2024-03-14 23:59:59' AND crop = 'Potatoes'"),
+])
+def test_filters(database, filters, where):
+    ids, _ = _all_ids(database, 4, **filters)
+    assert ids == _expected(database, where)
+    assert ids
+
+
+def test_malformed_cursor_raises_value_error(database):
+    with pytest.raises(ValueError):
+        database.fetch_history('farmer', 10, cursor='not a cursor')
+    with pytest.raises(ValueError):
+        decode_cursor('bm8tc2VwYXJhdG9y')  # "no-separator"
+
+
+@pytest.fixture
+def client(database, monkeypatch):
+    crop = pytest.importorskip('crop')
+    monkeypatch.setattr(crop, 'prediction_db', database)
+    return crop.app.test_client()
+
+
+def test_endpoint_pages_with_next_cursor(client, database):
+    ids, url = [], '/history?user_id=farmer&limit=4'
+    while True:
+        response = client.get(url)
+        assert response.status_code == 200
+        body = response.get_json()
+        ids.extend(entry['id'] for entry in body['history'])
+        if body['next_cursor'] is None:
+            break
+        url = f"/history?user_id=farmer&limit=4&cursor={body['next_cursor']}"
+    assert ids == _expected(database)
+
+
+def test_endpoint_converts_offset_bounds_to_utc(client, database):
+    # 10:00+02:00 is 08:00 UTC, so only the 08:30 rows of the 14th are at or after it
+    response = client.get('/history?user_id=farmer&from=2024-03-14T10:00:00%2B02:00'
+                          '&to=2024-03-14T05:00:00-04:00')
+    assert response.status_code == 200
+    timestamps = {entry['timestamp'] for entry in response.get_json()['history']}
+    assert timestamps == {'2024-03-14 08:30:00'}
+
+
+def test_endpoint_date_only_bounds_cover_whole_days(client, database):
+    response = client.get('/history?user_id=farmer&from=2024-03-14&to=2024-03-14&limit=500')
+    assert [entry['id'] for entry in response.get_json()['history']] == \
+        _expected(database, "timestamp LIKE '2024-03-14 %'")
+
+
+@pytest.mark.parametrize('cursor', ['garbage', 'MjAyNC0wMy0xNHxhYmM='])  # second: "2024-03-14|abc"
+def test_endpoint_rejects_malformed_cursor(client, cursor):
+    response = client.get(f'/history?user_id=farmer&cursor={cursor}')
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_saved_nan_is_stored_as_null(client, database):
+    row_id = database.save_prediction({'features': [2013, float('nan'), 1.0, 20.0, 'Peru', 'Potatoes']},
+                                      {'prediction': float('inf'), 'confidence': 90.0}, None, 'nan-user')
+    response = client.get('/history?user_id=nan-user')
+    assert response.status_code == 200
+    entry, = json.loads(response.get_data(as_text=True), parse_constant=pytest.fail)['history']
+    assert entry['id'] == row_id
+    assert entry['input_data']['features'][1] is None
+    assert entry['prediction'] == {'prediction': None, 'confidence': 90.0}
+    assert entry['location'] is None
+
+
+@pytest.mark.parametrize('body, expected', [
+    ({'model_version': 'v-top', 'prediction': {'model_version': 'v-echoed'}}, 'v-top'),
+    ({'prediction': {'model_version': 'v-echoed'}}, 'v-echoed'),
+    ({'prediction': {'prediction': 1.0}}, None),
+])
+def test_save_prediction_records_model_version(client, database, body, expected):
+    import crop
+
+    response = client.post('/save-prediction', json=dict(body, user_id='versioned'))
+    assert response.status_code == 200
+    with database.connection() as conn:
+        version, = conn.execute('SELECT model_version FROM predictions WHERE id = ?',
+                                (response.get_json()['id'],)).fetchone()
+    assert version == (expected or crop.model_store.current.version)
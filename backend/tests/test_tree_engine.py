@@ -0,0 +1,58 @@
+"""Parity of the compiled tree with the fitted DecisionTreeRegressor"""
+import os
+import pickle
+import warnings
+
+import numpy as np
+import pytest
+
+from tree_engine import CompiledTree, domain_matrix, threshold_matrix
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _unpickle(name):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        with open(os.path.join(BACKEND_DIR, name), 'rb') as f:
+            return pickle.load(f)
+
+
+@pytest.fixture(scope='module')
+def model():
+    return _unpickle('dtr.pkl')
+
+
+@pytest.fixture(scope='module')
+def compiled(model):
+    return CompiledTree(model)
+
+
+@pytest.fixture(scope='module')
+def matrices(compiled):
+    preprocessor = _unpickle('preprocesser.pkl')
+    return {'training domain': domain_matrix(preprocessor),
+            'split thresholds': threshold_matrix(compiled)}
+
+
+@pytest.mark.parametrize('name', ['training domain', 'split thresholds'])
+def test_predict_matches_model(model, compiled, matrices, name):
+    X = matrices[name]
+    np.testing.assert_array_equal(compiled.predict(X), model.predict(X))
+
+
+@pytest.mark.parametrize('name', ['training domain', 'split thresholds'])
+def test_predict_one_matches_model(model, compiled, matrices, name):
+    X = matrices[name]
+    expected = model.predict(X)
+    for start in range(0, X.shape[0], 10000):
+        chunk = X[start:start + 10000]
+        dense = chunk.toarray() if hasattr(chunk, 'toarray') else chunk
+        actual = [compiled.predict_one(row) for row in dense]
+        np.testing.assert_array_equal(actual, expected[start:start + 10000])
+
+
+def test_state_round_trip(model, compiled, matrices):
+    X = matrices['split thresholds']
+    rebuilt = CompiledTree.from_state(compiled.to_state())
+    np.testing.assert_array_equal(rebuilt.predict(X), model.predict(X))
@@ -0,0 +1,186 @@
+"""Flat array-backed inference for the fitted DecisionTreeRegressor
+
+scikit-learn validates its input on every ``predict`` call, which dominates
+the cost of scoring a single row. ``CompiledTree`` copies the fitted tree into
+plain NumPy arrays once and walks them directly for single rows, while
+batches are handed straight to the fitted tree's compiled traversal. Inputs
+are rounded to float32 exactly like scikit-learn does before comparing
+against the float64 thresholds, so results are bit-identical to
+``model.predict``.
+
+The arrays can also be exported with ``to_state()`` and rebuilt from a
+memory-mapped bundle with ``from_state()`` (see ``model_store.py``), so worker
+processes share one copy of the tree pages instead of each unpickling
+``dtr.pkl``.
+
+Run ``python tree_engine.py`` to check parity over the training domain;
+``tests/test_tree_engine.py`` asserts it with pytest.
+"""
+import numpy as np
+
+TREE_LEAF = -1
+ARRAY_NAMES = ('feature', 'threshold', 'children_left', 'children_right', 'value')
+
+
+class CompiledTree:
+    """Array form of a single-output sklearn decision tree"""
+
+    def __init__(self, estimator):
+        tree = estimator.tree_
+        if tree.n_outputs != 1:
+            raise ValueError('Only single-output trees can be compiled')
+        self._setup(estimator.n_features_in_, {
+            'feature': tree.feature.astype(np.intp),
+            'threshold': tree.threshold.astype(np.float64),
+            'children_left': tree.children_left.astype(np.intp),
+            'children_right': tree.children_right.astype(np.intp),
+            'value': tree.value[:, 0, 0].astype(np.float64)
+        }, tree)
+
+    def _setup(self, n_features, arrays, tree=None):
+        self.n_features = int(n_features)
+        for name in ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+        self._tree = tree
+        self._lists = None
+        if tree is not None:
+            # Python lists make the single-row walk avoid NumPy scalar overhead.
+            # Memory-mapped trees skip them so the pages stay shared.
+            self._lists = (self.feature.tolist(), self.threshold.tolist(),
+                           self.children_left.tolist(), self.children_right.tolist())
+
+    @classmethod
+    def from_state(cls, state):
+        """Rebuild from ``to_state()`` output, keeping (possibly memory-mapped) arrays as-is"""
+        compiled = cls.__new__(cls)
+        compiled._setup(state['n_features'], state)
+        return compiled
+
+    def to_state(self):
+        """Plain dict of contiguous arrays, suitable for an uncompressed joblib dump"""
+        state = {name: np.ascontiguousarray(getattr(self, name)) for name in ARRAY_NAMES}
+        state['n_features'] = self.n_features
+        return state
+
+    @property
+    def node_count(self):
+        return len(self.value)
+
+    def _as_float32(self, X):
+        if hasattr(X, 'tocsr'):
+            X = X.tocsr().astype(np.float32)
+            X.sort_indices()
+        else:
+            X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f'Expected input with {self.n_features} features')
+        return X
+
+    def apply(self, X):
+        """Return the leaf index reached by every row of ``X``"""
+        if not hasattr(X, 'shape'):
+            X = np.asarray(X, dtype=np.float64)
+        if X.shape[0] == 1:
+            row = X.toarray()[0] if hasattr(X, 'toarray') else X[0]
+            if row.shape[0] != self.n_features:
+                raise ValueError(f'Expected input with {self.n_features} features')
+            return np.array([self.apply_one(row)], dtype=np.intp)
+        X = self._as_float32(X)
+        if self._tree is not None:
+            # A NumPy level-by-level walk of this deep tree is several times
+            # slower than the compiled Cython traversal, so batches go straight
+            # to it on validated float32 input, skipping the estimator wrapper.
+            return self._tree.apply(X)
+        return self._walk(X.toarray() if hasattr(X, 'toarray') else X)
+
+    def _walk(self, X):
+        node = np.zeros(X.shape[0], dtype=np.intp)
+        active = np.arange(X.shape[0]) if self.children_left[0] != TREE_LEAF else np.arange(0)
+        while active.size:
+            current = node[active]
+            go_left = X[active, self.feature[current]] <= self.threshold[current]
+            child = np.where(go_left, self.children_left[current], self.children_right[current])
+            node[active] = child
+            active = active[self.children_left[child] != TREE_LEAF]
+        return node
+
+    def predict(self, X):
+        """Predict a batch; drop-in replacement for ``model.predict``"""
+        return self.value[self.apply(X)]
+
+    def apply_one(self, row):
+        """Return the leaf index for one dense feature row"""
+        row = np.asarray(row, dtype=np.float32).tolist()
+        if self._lists is not None:
+            feature, threshold, left, right = self._lists
+        else:
+            feature, threshold = self.feature, self.threshold
+            left, right = self.children_left, self.children_right
+        node = 0
+        while left[node] != TREE_LEAF:
+            if row[feature[node]] <= threshold[node]:
+                node = left[node]
+            else:
+                node = right[node]
+        return int(node)
+
+    def predict_one(self, row):
+        """Predict one dense feature row without building a batch"""
+        return float(self.value[self.apply_one(row)])
+
+
+def domain_matrix(preprocessor, numeric_steps=5, spread=3.0):
+    """Transformed rows covering every country/crop pair over the numeric range"""
+    from inference import domain_rows
+
+    return preprocessor.transform(domain_rows(preprocessor, numeric_steps, spread))
+
+
+def threshold_matrix(compiled):
+    """Rows that sit exactly on, and just either side of, every split threshold"""
+    internal = np.flatnonzero(compiled.children_left != TREE_LEAF)
+    X = np.zeros((3 * internal.size, compiled.n_features), dtype=np.float64)
+    thresholds = compiled.threshold[internal]
+    for k, values in enumerate((thresholds, np.nextafter(thresholds, -np.inf),
+                                np.nextafter(thresholds, np.inf))):
+        rows = np.arange(internal.size) + k * internal.size
+        X[rows, compiled.feature[internal]] = values
+    return X
+
+
+def check_parity(estimator, compiled, X):
+    """Return the number of rows where ``compiled`` disagrees with ``estimator``"""
+    expected = estimator.predict(X)
+    batch = compiled.predict(X)
+    mismatches = np.count_nonzero(batch != expected)
+
+    dense = X.toarray() if hasattr(X, 'toarray') else np.asarray(X)
+    step = max(1, dense.shape[0] // 2000)
+    for i in range(0, dense.shape[0], step):
+        if compiled.predict_one(dense[i]) != expected[i]:
+            mismatches += 1
+    return mismatches
+
+
+if __name__ == '__main__':
+    import pickle
+    import time
+    import warnings
+
+    warnings.filterwarnings('ignore')
+    with open('dtr.pkl', 'rb') as f:
+        model = pickle.load(f)
+
+    compiled = CompiledTree(model)
+    print(f'🌳 Compiled tree with {compiled.node_count} nodes')
+
+    with open('preprocesser.pkl', 'rb') as f:
+        preprocessor = pickle.load(f)
+
+    for name, X in (('training domain', domain_matrix(preprocessor)),
+                    ('split thresholds', threshold_matrix(compiled))):
+        start = time.perf_counter()
+        mismatches = check_parity(model, compiled, X)
+        elapsed = time.perf_counter() - start
+        status = '✅' if mismatches == 0 else '❌'
+        print(f'{status} {name}: {X.shape[0]} rows, {mismatches} mismatches ({elapsed:.2f}s)')
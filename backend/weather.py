@@ -0,0 +1,202 @@
+"""Weather lookups behind a pluggable provider, snapped to a grid and cached
+
+Coordinates are snapped to the centre of a ``grid_degrees`` cell before the
+provider is asked, so nearby points (every small pan of the map) share one
+cached answer. Providers only need ``fetch(lat, lon)``; ``fetch_many`` is
+used for batches and can be overridden when a provider has a bulk API.
+
+Built-in providers:
+
+* ``mock`` - the demo formula the API has always returned
+* ``grid`` - a precomputed grid file written by ``build_grid()`` and
+  memory-mapped on load, so lookups are array reads shared by all workers
+
+A provider can also be given as ``"package.module:ClassName"``.
+"""
+import importlib
+import math
+
+import numpy as np
+
+from cache import LRUCache
+
+FIELDS = ('temperature', 'humidity', 'rainfall')
+
+
+class WeatherProvider:
+    """Interface for weather sources; values are for the given cell centre"""
+
+    name = 'base'
+    step = None  # Native grid spacing in degrees, if the provider has one
+
+    def fetch(self, lat, lon):
+        """Return ``{'temperature': ..., 'humidity': ..., 'rainfall': ...}``"""
+        raise NotImplementedError
+
+    def fetch_many(self, points):
+        """Weather for many ``(lat, lon)`` points, in order"""
+        return [self.fetch(lat, lon) for lat, lon in points]
+
+
+class MockWeatherProvider(WeatherProvider):
+    """Deterministic demo values derived from the coordinates"""
+
+    name = 'mock'
+
+    def fetch(self, lat, lon):
+        return {
+            'temperature': 25 + (lat / 10) % 15,
+            'humidity': 60 + (lon / 10) % 30,
+            'rainfall': 800 + (lat * lon) % 1000
+        }
+
+
+class GridFileProvider(WeatherProvider):
+    """Nearest-point lookups in a memory-mapped grid written by ``build_grid()``"""
+
+    name = 'grid'
+
+    def __init__(self, path='weather_grid.joblib'):
+        import joblib
+
+        bundle = joblib.load(path, mmap_mode='r')
+        self.path = path
+        self.lat_min = float(bundle['lat_min'])
+        self.lon_min = float(bundle['lon_min'])
+        self.step = float(bundle['step'])
+        self.fields = tuple(bundle['fields'])
+        self.values = bundle['values']  # (n_lat, n_lon, len(fields)) float32, memory-mapped
+        print(f"🗺️  Weather grid {self.values.shape[0]}x{self.values.shape[1]} "
+              f"at {self.step}° from {path}")
+
+    def _indices(self, lats, lons):
+        i = np.rint((np.asarray(lats, dtype=np.float64) - self.lat_min) / self.step).astype(np.intp)
+        j = np.rint((np.asarray(lons, dtype=np.float64) - self.lon_min) / self.step).astype(np.intp)
+        return (np.clip(i, 0, self.values.shape[0] - 1),
+                np.clip(j, 0, self.values.shape[1] - 1))
+
+    def fetch(self, lat, lon):
+        return self.fetch_many([(lat, lon)])[0]
+
+    def fetch_many(self, points):
+        if not points:
+            return []
+        lats, lons = zip(*points)
+        i, j = self._indices(lats, lons)
+        rows = np.asarray(self.values[i, j], dtype=np.float64).tolist()
+        return [dict(zip(self.fields, row)) for row in rows]
+
+
+PROVIDERS = {
+    'mock': MockWeatherProvider,
+    'grid': GridFileProvider,
+}
+
+
+def make_provider(name, **options):
+    """Instantiate a registered provider, or one given as ``module:Class``"""
+    if name in PROVIDERS:
+        cls = PROVIDERS[name]
+    elif ':' in name:
+        module, attr = name.split(':', 1)
+        cls = getattr(importlib.import_module(module), attr)
+    else:
+        raise ValueError(f'Unknown weather provider: {name}')
+    if cls is GridFileProvider:
+        return cls(options.get('grid_path') or 'weather_grid.joblib')
+    return cls()
+
+
+def parse_coordinates(lat, lon):
+    """Validate a latitude/longitude pair (numbers or numeric strings)"""
+    lat, lon = float(lat), float(lon)
+    if not (math.isfinite(lat) and math.isfinite(lon)):
+        raise ValueError('Coordinates must be finite numbers')
+    if not -90 <= lat <= 90:
+        raise ValueError('Latitude must be between -90 and 90')
+    if not -180 <= lon <= 180:
+        raise ValueError('Longitude must be between -180 and 180')
+    return lat, lon
+
+
+class WeatherService:
+    """Grid-snapped, per-cell cached access to a weather provider"""
+
+    def __init__(self, provider, grid_degrees=0.1, cache_size=10000, ttl=600):
+        self.provider = provider
+        # A gridded provider has no finer data than its own grid
+        self.grid_degrees = provider.step or grid_degrees
+        self.cache = LRUCache(max_size=cache_size, ttl=ttl)
+
+    def cell(self, lat, lon):
+        """Integer cell index for a coordinate (identity when the grid is 0)"""
+        if not self.grid_degrees:
+            return (lat, lon)
+        return (round(lat / self.grid_degrees), round(lon / self.grid_degrees))
+
+    def cell_center(self, cell):
+        if not self.grid_degrees:
+            return cell
+        return (round(cell[0] * self.grid_degrees, 6), round(cell[1] * self.grid_degrees, 6))
+
+    def get(self, lat, lon):
+        """Weather for one validated coordinate"""
+        return self.get_many([(lat, lon)])[0]
+
+    def get_many(self, points):
+        """Weather for many validated coordinates; each distinct cell is fetched once"""
+        cells = [self.cell(lat, lon) for lat, lon in points]
+        found = {}
+        missing = []
+        for cell in dict.fromkeys(cells):
+            value = self.cache.get(cell)
+            if value is None:
+                missing.append(cell)
+            else:
+                found[cell] = value
+
+        if missing:
+            generation = self.cache.generation
+            fetched = self.provider.fetch_many([self.cell_center(cell) for cell in missing])
+            for cell, values in zip(missing, fetched):
+                value = {field: round(float(values[field]), 2) for field in FIELDS}
+                value['grid_cell'] = list(self.cell_center(cell))
+                self.cache.put(cell, value, generation)
+                found[cell] = value
+        return [dict(found[cell]) for cell in cells]
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats.update({'provider': self.provider.name, 'grid_degrees': self.grid_degrees})
+        return stats
+
+
+def build_grid(provider, path, step=0.25, lat_range=(-90.0, 90.0), lon_range=(-180.0, 180.0)):
+    """Precompute ``provider`` over a regular grid and write a memory-mappable file"""
+    import joblib
+
+    lats = np.round(np.arange(lat_range[0], lat_range[1] + step / 2, step), 6)
+    lons = np.round(np.arange(lon_range[0], lon_range[1] + step / 2, step), 6)
+    values = np.empty((len(lats), len(lons), len(FIELDS)), dtype=np.float32)
+    for i, lat in enumerate(lats.tolist()):
+        row = provider.fetch_many([(lat, lon) for lon in lons.tolist()])
+        values[i] = [[entry[field] for field in FIELDS] for entry in row]
+    # Uncompressed so joblib can memory-map the values on load
+    joblib.dump({'lat_min': float(lats[0]), 'lon_min': float(lons[0]), 'step': step,
+                 'fields': list(FIELDS), 'values': values}, path)
+    return values.shape
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    if len(sys.argv) < 2 or sys.argv[1] != 'build':
+        print('Usage: python weather.py build [weather_grid.joblib] [step_degrees]')
+        sys.exit(2)
+    path = sys.argv[2] if len(sys.argv) > 2 else 'weather_grid.joblib'
+    step = float(sys.argv[3]) if len(sys.argv) > 3 else 0.25
+    start = time.perf_counter()
+    shape = build_grid(MockWeatherProvider(), path, step)
+    print(f'✅ Wrote {path}: {shape[0]}x{shape[1]} cells at {step}° '
+          f'({time.perf_counter() - start:.1f}s)')